@@ -1,41 +1,43 @@
+import time
+INICIO_PROCESSO = time.perf_counter() # Só a 1ª execução do script importa de fato (ver get_telemetria)
 import streamlit as st
 import os
-import tempfile
-import shutil
-import gc
-import time
-import json
+import sys
 import re
+import hashlib
 from io import BytesIO
 from datetime import datetime
 
 # --- BIBLIOTECAS ---
-import whisper
-import pandas as pd
-from docx import Document as DocxDocument
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain_ollama import OllamaEmbeddings, ChatOllama
+# Ollama, Chroma, pandas, OCR, Whisper e python-docx carregam sob demanda (ou só nos workers de ingestão)
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.documents import Document
-import pytesseract
-from PIL import Image, ImageOps
-import fitz  # PyMuPDF
-import numpy as np
+from nemesis_cache import CacheIngestao, CacheRespostas, versao_corpus
+from nemesis_embeddings import criar_embeddings, MODELO_EMBEDDING
+from nemesis_modelos import GerenciadorModelos, KEEP_ALIVE, descrever as descrever_modelos
+from nemesis_store import GerenciadorCasos, ESPERA_FECHAR
+from nemesis_lexico import IndiceLexico, buscar_hibrido
+from nemesis_contexto import montar_contexto, contar_tokens
+from nemesis_planilhas import CatalogoTabelas, calcular_respostas
+from nemesis_fila import FilaIngestao, garantir_workers, memoria_do_job
+from nemesis_telemetria import configurar as configurar_telemetria, iniciar_endpoint, etapa, acumular, relatorio_inicio, BACKENDS_PESADOS
+from nemesis_extratores import EXTENSOES
+from nemesis_vetores import BancoPlano, BACKENDS, BACKEND_PADRAO, garantir_backend, migrar_de_chroma
+from nemesis_catalogo import CatalogoCasos
+from nemesis_multicaso import buscar_em_casos, casos_indexados
+from nemesis_sync import EstadoSync, ObservadorPasta, sincronizar, TEM_WATCHDOG
 
 # --- 1. CONFIGURAÇÃO ---
 CAMINHO_TESSERACT = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
 if os.path.exists(CAMINHO_TESSERACT):
-    pytesseract.pytesseract.tesseract_cmd = CAMINHO_TESSERACT
-    STATUS_OCR = True
+    STATUS_OCR = True # O caminho vai para os workers de ingestão
 else:
     STATUS_OCR = False
 
 PASTA_MEMORIA = "./banco_de_dados_nemesis"
-ARQUIVO_CONFIG = os.path.join(PASTA_MEMORIA, "nemesis_config.json")
+PASTA_TABELAS = os.path.join(PASTA_MEMORIA, "_cache", "tabelas") # Cópias colunares (Parquet) das planilhas
 MODELO_ATUAL = "llama3.1"
+LIMITE_MEMORIA_IMEDIATA = 200_000 # Caracteres de texto bruto guardados na sessão (o resto fica só no banco)
 
 st.set_page_config(page_title="NEMESIS AI PRO", page_icon="⚖️", layout="wide")
 
@@ -45,48 +47,110 @@ if "caso_selecionado" not in st.session_state: st.session_state.caso_selecionado
 if "memoria_imediata" not in st.session_state: st.session_state.memoria_imediata = ""
 if "messages" not in st.session_state: st.session_state.messages = []
 if "ultimas_fontes" not in st.session_state: st.session_state.ultimas_fontes = []
+if "ultimas_metricas" not in st.session_state: st.session_state.ultimas_metricas = {}
+if "jobs_ingestao" not in st.session_state: st.session_state.jobs_ingestao = []
+if "rastro_resposta" not in st.session_state: st.session_state.rastro_resposta = None
+if "rastro_ingestao" not in st.session_state: st.session_state.rastro_ingestao = None
+if "busca_global" not in st.session_state: st.session_state.busca_global = False
+if "docx_pedidos" not in st.session_state: st.session_state.docx_pedidos = set()
 
 # --- 3. CACHE ---
 @st.cache_resource
-def get_whisper_model():
-    return whisper.load_model("base")
+def get_telemetria(_inicio):
+    # Métricas em _cache/metricas/metricas_app.json; /metrics só com NEMESIS_METRICAS_PORTA
+    configurar_telemetria(os.path.join(PASTA_MEMORIA, "_cache", "metricas"), "app")
+    iniciar_endpoint()
+    return relatorio_inicio("app", _inicio) # Partida a frio (imports da 1ª execução), gravada em inicio.jsonl
 
 @st.cache_resource
 def get_llm():
-    return ChatOllama(model=MODELO_ATUAL, temperature=0.0)
+    from langchain_ollama import ChatOllama
+    return ChatOllama(model=MODELO_ATUAL, temperature=0.0, keep_alive=KEEP_ALIVE)
+
+@st.cache_resource
+def get_modelos():
+    # Aquece llama3.1 e all-minilm em segundo plano na partida e renova o keep_alive (NEMESIS_INTERVALO_PING)
+    return GerenciadorModelos(MODELO_ATUAL, MODELO_EMBEDDING).iniciar()
 
 @st.cache_resource
 def get_embedding_function():
-    return OllamaEmbeddings(model="all-minilm")
+    # all-minilm com cache em disco (perguntas repetidas e trechos repetidos não vão ao Ollama)
+    return criar_embeddings(os.path.join(PASTA_MEMORIA, "_cache"))
+
+@st.cache_resource
+def get_gerenciador_casos():
+    # Bancos Chroma abertos ficam num pool LRU compartilhado por todas as sessões
+    return GerenciadorCasos(get_embedding_function())
+
+@st.cache_resource
+def get_fila_ingestao():
+    # OCR, Whisper e embeddings rodam em processos separados; a página só envia e acompanha
+    return FilaIngestao(PASTA_MEMORIA)
+
+@st.cache_resource
+def get_observadores():
+    # Um observador (watchdog) por caso, compartilhado entre sessões e recarregamentos da página
+    return {}
+
+@st.cache_resource
+def get_catalogo():
+    # Lista de casos e nemesis_config.json em memória (relidos só quando mudam) + faxina da lixeira
+    catalogo = CatalogoCasos(PASTA_MEMORIA)
+    catalogo.antes_de_apagar = lambda caso: get_gerenciador_casos().fechar(os.path.join(PASTA_MEMORIA, caso), espera=ESPERA_FECHAR)
+    return catalogo.iniciar_faxina()
+
+@st.cache_resource
+def get_cache_ingestao():
+    return CacheIngestao(os.path.join(PASTA_MEMORIA, "_cache"))
 
 # --- 4. UTILITÁRIOS ---
-def gerar_word(texto):
+def chave_mensagem(msg):
+    # Hash do conteúdo + fontes, calculado uma vez por mensagem (chave do DOCX e do botão)
+    if "hash" not in msg:
+        fontes = "|".join(f"{d.metadata.get('hash')}:{d.metadata.get('source_name')}" for d in msg.get("fontes") or [])
+        msg["hash"] = hashlib.sha1(f"{msg['role']}\0{msg['content']}\0{fontes}".encode("utf-8")).hexdigest()[:16]
+    return msg["hash"]
+
+def _novo_docx(titulo):
+    from docx import Document as DocxDocument
     doc = DocxDocument()
-    doc.add_heading('Relatório Nemesis AI', 0)
+    doc.add_heading(titulo, 0)
     doc.add_paragraph(f"Gerado: {datetime.now().strftime('%d/%m/%Y')}")
-    doc.add_paragraph(texto)
-    buffer = BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    return buffer
+    return doc
 
-def transcrever_audio_whisper(caminho_audio):
-    model = get_whisper_model()
-    try:
-        result = model.transcribe(caminho_audio)
-        return result["text"]
-    except Exception as e: return f"Erro áudio: {e}"
+def _resposta_docx(doc, msg):
+    doc.add_paragraph(msg["content"])
+    if msg.get("fontes"):
+        doc.add_paragraph("Fontes:")
+        for d in msg["fontes"]: doc.add_paragraph(descrever_fonte(d), style="List Bullet")
 
-def ler_planilha(caminho_arquivo):
-    try:
-        if caminho_arquivo.endswith('.csv'): df = pd.read_csv(caminho_arquivo)
-        else: df = pd.read_excel(caminho_arquivo)
-        # Converte para markdown para a IA entender a estrutura
-        return df.to_markdown(index=False)
-    except ImportError:
-        return "ERRO CRÍTICO: Instale 'tabulate' (pip install tabulate)"
-    except Exception as e:
-        return f"Erro planilha: {e}"
+def _bytes_docx(doc):
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+# Só gera quando pedido; memorizado pelo hash (o conteúdo não entra no hash do cache_data)
+@st.cache_data(max_entries=128, show_spinner=False)
+def gerar_word(chave, _msg):
+    doc = _novo_docx('Relatório Nemesis AI')
+    _resposta_docx(doc, _msg)
+    return _bytes_docx(doc)
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def gerar_word_conversa(chave, _mensagens, titulo):
+    doc = _novo_docx(f'Conversa Nemesis AI — {titulo}')
+    for msg in _mensagens:
+        if msg["role"] == "user": doc.add_heading(msg["content"], level=2)
+        else: _resposta_docx(doc, msg)
+    return _bytes_docx(doc)
+
+def botao_docx(chave, rotulo, gerar):
+    # 1º clique prepara (gera uma vez), depois vira o botão de download
+    if chave in st.session_state.docx_pedidos:
+        st.download_button(f"⬇️ {rotulo}", gerar(), f"Nemesis_{chave[:8]}.docx", key=f"d_{chave}")
+    elif st.button(f"📄 {rotulo}", key=f"p_{chave}"):
+        st.session_state.docx_pedidos.add(chave)
+        st.rerun()
 
 # --- 5. CSS ---
 st.markdown("""
@@ -102,210 +166,310 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- 6. GESTÃO ---
-def carregar_config():
-    if not os.path.exists(PASTA_MEMORIA): os.makedirs(PASTA_MEMORIA)
-    if not os.path.exists(ARQUIVO_CONFIG):
-        with open(ARQUIVO_CONFIG, 'w') as f: json.dump({"pinned": [], "trash": []}, f)
-    try:
-        with open(ARQUIVO_CONFIG, 'r') as f:
-            cfg = json.load(f)
-            if "trash" not in cfg: cfg["trash"] = []
-            return cfg
-    except: return {"pinned": [], "trash": []}
-
-def salvar_config(config):
-    with open(ARQUIVO_CONFIG, 'w') as f: json.dump(config, f)
-
-def faxina_inicial():
-    cfg = carregar_config()
-    lixo = cfg.get("trash", [])
-    if not lixo: return
-    restante = []
-    for caso in lixo:
-        caminho = os.path.join(PASTA_MEMORIA, caso)
-        if os.path.exists(caminho):
-            try: shutil.rmtree(caminho) 
-            except: restante.append(caso) 
-    if len(restante) != len(lixo):
-        cfg["trash"] = restante
-        salvar_config(cfg)
-
-faxina_inicial()
+def parar_observador(nome_caso):
+    observador = get_observadores().pop(nome_caso, None)
+    if observador: observador.parar()
 
 def acao_excluir(nome_caso):
+    # Libera os arquivos do Chroma antes de apagar; outra sessão ainda consultando o caso = tente de novo
+    if not get_gerenciador_casos().fechar(os.path.join(PASTA_MEMORIA, nome_caso), espera=ESPERA_FECHAR):
+        st.toast("⏳ Caso em uso por uma consulta. Tente excluir de novo em instantes.")
+        return
+    parar_observador(nome_caso)
     st.session_state.vectorstore = None
     st.session_state.caso_selecionado = None
     st.session_state.memoria_imediata = ""
     st.session_state.messages = []
-    gc.collect() 
-    cfg = carregar_config()
-    if nome_caso not in cfg["trash"]: cfg["trash"].append(nome_caso)
-    if nome_caso in cfg.get("pinned", []): cfg["pinned"].remove(nome_caso)
-    salvar_config(cfg)
-    try: shutil.rmtree(os.path.join(PASTA_MEMORIA, nome_caso))
-    except: pass 
+    get_catalogo().excluir(nome_caso) # Some da lista agora; a pasta é apagada em segundo plano
     st.toast("🗑️ Enviado para lixeira.")
     time.sleep(0.5)
     st.rerun()
 
 def acao_fixar(nome_caso):
-    cfg = carregar_config()
-    if nome_caso in cfg["pinned"]:
-        cfg["pinned"].remove(nome_caso)
-        st.toast("Desfixado")
-    else:
-        cfg["pinned"].append(nome_caso)
-        st.toast("📌 Fixado")
-    salvar_config(cfg)
+    st.toast("📌 Fixado" if get_catalogo().alternar_fixado(nome_caso) else "Desfixado")
     st.rerun()
 
 def acao_renomear(antigo, novo):
     if not novo: return
     novo_limpo = re.sub(r'[^a-zA-Z0-9_-]', '', novo.strip().replace(" ", "_")).strip("_-")
     if not novo_limpo: return
+    if not get_gerenciador_casos().fechar(os.path.join(PASTA_MEMORIA, antigo), espera=ESPERA_FECHAR):
+        st.toast("⏳ Caso em uso por uma consulta. Tente renomear de novo em instantes.")
+        return
     st.session_state.vectorstore = None
-    gc.collect()
+    parar_observador(antigo)
     try:
-        os.rename(os.path.join(PASTA_MEMORIA, antigo), os.path.join(PASTA_MEMORIA, novo_limpo))
-        cfg = carregar_config()
-        if antigo in cfg["pinned"]:
-            cfg["pinned"].remove(antigo)
-            cfg["pinned"].append(novo_limpo)
-        salvar_config(cfg)
+        get_catalogo().renomear(antigo, novo_limpo)
         st.session_state.caso_selecionado = novo_limpo
         st.toast("✅ Renomeado!")
         st.rerun()
     except: st.error("⚠️ Erro ao renomear.")
 
-def listar_casos_visiveis():
-    if not os.path.exists(PASTA_MEMORIA): os.makedirs(PASTA_MEMORIA)
-    cfg = carregar_config()
-    todos = [f for f in os.listdir(PASTA_MEMORIA) 
-             if os.path.isdir(os.path.join(PASTA_MEMORIA, f)) 
-             and not f.startswith("_") 
-             and f not in cfg.get("trash", [])]
-    pinned = [c for c in todos if c in cfg.get("pinned", [])]
-    others = [c for c in todos if c not in cfg.get("pinned", [])]
-    return sorted(pinned) + sorted(others)
-
-def carregar_banco(nome_caso):
+def carregar_banco(nome_caso, backend=None):
+    # Trocar de caso não fecha nem reabre nada: o handle volta do pool (ou é aberto e entra nele).
+    # backend (chroma | int8 | float16) só decide o tipo de um caso novo
+    return get_gerenciador_casos().obter(os.path.join(PASTA_MEMORIA, nome_caso), nome_caso, backend=backend)
+
+def usar_banco(nome_caso):
+    # Handle preso no pool durante a busca: despejo, outra sessão ou o fim de um job não fecham no meio
+    return get_gerenciador_casos().usar(os.path.join(PASTA_MEMORIA, nome_caso), nome_caso)
+
+def acao_migrar(nome_caso):
+    # Chroma -> vetores int8 (memmap). Handle fechado e nenhum job escrevendo no caso.
     caminho = os.path.join(PASTA_MEMORIA, nome_caso)
-    if not os.path.exists(caminho): os.makedirs(caminho)
-    if st.session_state.vectorstore:
-        try: st.session_state.vectorstore._client._system.stop()
-        except: pass
-    return Chroma(collection_name=nome_caso, embedding_function=get_embedding_function(), persist_directory=caminho)
-
-# --- 7. PROCESSAMENTO (COM CORREÇÃO DE LOTE) ---
-def processar_arquivos(vectorstore, arquivos):
-    if not arquivos: return 0, ""
-    docs_acumulados = []
-    texto_sessao = ""
-    progresso = st.progress(0, text="Processando...")
-    
-    for i, arquivo in enumerate(arquivos):
-        ext = arquivo.name.split('.')[-1].lower()
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{ext}") as tmp:
-            tmp.write(arquivo.getvalue())
-            tmp_path = tmp.name
-        
-        texto_extraido = ""
-        origem = ""
-        
+    if get_fila_ingestao().ativos(caminho):
+        st.toast("⏳ Ingestão em andamento neste caso. Tente quando terminar.")
+        return
+    if not get_gerenciador_casos().fechar(caminho, espera=ESPERA_FECHAR):
+        st.toast("⏳ Caso em uso por uma consulta. Tente de novo em instantes.")
+        return
+    st.session_state.vectorstore = None
+    try:
+        with st.spinner("Convertendo banco..."): r = migrar_de_chroma(caminho, nome_caso, "int8")
+        st.toast(f"🗜️ {r['fragmentos']} fragmentos convertidos para int8.")
+    except Exception as e: st.toast(f"❌ Falha ao converter (o caso continua no Chroma): {e}")
+    time.sleep(0.5)
+    st.rerun()
+
+# --- 7. PROCESSAMENTO (FILA EM SEGUNDO PLANO: EXTRAI → FATIA → GRAVA NOS WORKERS) ---
+ETAPAS = {"na_fila": "⏳ na fila", "extraindo": "⚙️ extraindo", "gravando": "🧠 gravando", "concluido": "✅ concluído"}
+
+def subir_workers():
+    # Sem Tesseract os workers não tentam OCR (como na CLI): PDF só pela camada de texto, imagem vira erro claro
+    garantir_workers(PASTA_MEMORIA, tesseract_cmd=CAMINHO_TESSERACT if STATUS_OCR else None, ocr=STATUS_OCR)
+
+def processar_arquivos(arquivos):
+    # Envia o lote para a fila persistente e volta na hora; o painel acompanha o progresso
+    caso = st.session_state.get("caso_selecionado")
+    if not arquivos or not caso: return None
+    job_id = get_fila_ingestao().enviar(caso, os.path.join(PASTA_MEMORIA, caso), caso,
+                                        [(a.name, a.getvalue()) for a in arquivos])
+    subir_workers()
+    st.session_state.jobs_ingestao.append(job_id)
+    return job_id
+
+def sincronizar_caso(caso, origem):
+    # Também roda na thread do observador: nada de st.session_state aqui (o painel adota o job pela fila)
+    resumo = sincronizar(origem, os.path.join(PASTA_MEMORIA, caso), caso, caso, get_fila_ingestao())
+    if resumo["job"] is not None: subir_workers()
+    return resumo
+
+def descrever_sync(resumo):
+    if isinstance(resumo, Exception): return f"❌ {resumo}"
+    texto = f"🆕 {resumo['novos']} · ✏️ {resumo['alterados']} · 🗑️ {resumo['removidos']} · = {resumo['inalterados']}"
+    if resumo["em_andamento"]: texto += f" · ⏳ {resumo['em_andamento']} na fila"
+    return texto
+
+def painel_sincronizacao(caso):
+    estado = EstadoSync(os.path.join(PASTA_MEMORIA, caso))
+    observador = get_observadores().get(caso)
+    origem = st.text_input("Pasta no disco:", value=(observador.origem if observador else estado.origem()) or "",
+                           key=f"sync_{caso}", placeholder=r"Ex: C:\Clientes\Silva")
+    c1, c2 = st.columns([1, 1])
+    if c1.button("🔄 Sincronizar", use_container_width=True, disabled=not origem):
         try:
-            if ext in ['jpg', 'jpeg', 'png']:
-                origem = "IMAGEM"
-                img = Image.open(tmp_path)
-                if np.mean(np.array(img.convert("L"))) < 127: img = ImageOps.invert(img.convert("L"))
-                texto_extraido = pytesseract.image_to_string(img, lang='por+eng')
-            elif ext == 'pdf':
-                origem = "PDF"
-                doc = fitz.open(tmp_path)
-                for pag in doc:
-                    t = pag.get_text()
-                    if len(t.strip()) < 5: 
-                        pix = pag.get_pixmap()
-                        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                        if np.mean(np.array(img.convert("L"))) < 127: img = ImageOps.invert(img.convert("L"))
-                        t = pytesseract.image_to_string(img, lang='por+eng')
-                    texto_extraido += t + "\n"
-                doc.close()
-            elif ext in ['wav', 'mp3']:
-                origem = "ÁUDIO"
-                texto_extraido = transcrever_audio_whisper(tmp_path)
-            elif ext in ['xlsx', 'xls', 'csv']:
-                origem = "PLANILHA"
-                texto_extraido = ler_planilha(tmp_path)
-
-            if texto_extraido and len(texto_extraido.strip()) > 2:
-                doc_final = f"--- {origem}: {arquivo.name} ---\n{texto_extraido}\n"
-                docs_acumulados.append(Document(page_content=doc_final, metadata={"source_name": arquivo.name}))
-                texto_sessao += doc_final + "\n\n"
-            else:
-                st.warning(f"⚠️ {arquivo.name} vazio.")
-
-        except Exception as e:
-            st.error(f"Erro em {arquivo.name}: {e}")
-        finally:
-            if os.path.exists(tmp_path): os.remove(tmp_path)
-        progresso.progress((i + 1) / len(arquivos))
-        
-    if docs_acumulados and vectorstore:
-        progresso.text("Indexando memória (isso pode demorar)...")
-        splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200)
-        todos_fragmentos = splitter.split_documents(docs_acumulados)
-        
-        # --- A CORREÇÃO DO ERRO DE BATCH SIZE AQUI ---
-        # ChromaDB tem limite de ~5461. Vamos inserir em lotes de 4000.
-        TAMANHO_LOTE = 4000
-        total_docs = len(todos_fragmentos)
-        
-        for i in range(0, total_docs, TAMANHO_LOTE):
-            lote = todos_fragmentos[i : i + TAMANHO_LOTE]
-            vectorstore.add_documents(lote)
-            time.sleep(0.1) # Respiro para o banco
-    
-    progresso.empty()
-    return len(docs_acumulados), texto_sessao
+            resumo = sincronizar_caso(caso, origem)
+            st.toast(descrever_sync(resumo) if resumo["job"] else "✅ Pasta já sincronizada.")
+        except FileNotFoundError as e: st.error(f"⚠️ {e}")
+        st.rerun()
+    observar = c2.checkbox("👀 Observar alterações", value=observador is not None, disabled=not TEM_WATCHDOG or not origem,
+                           help=None if TEM_WATCHDOG else "Instale o watchdog para observar a pasta.")
+    if observar and (observador is None or observador.origem != os.path.abspath(origem)) and os.path.isdir(origem):
+        parar_observador(caso)
+        get_observadores()[caso] = ObservadorPasta(origem, lambda: sincronizar_caso(caso, origem)).iniciar()
+    elif not observar and observador is not None:
+        parar_observador(caso)
+    contagem = estado.resumo()
+    if contagem: st.caption(" · ".join(f"{n} {s}" for s, n in sorted(contagem.items())))
+    if observador is not None and observador.ultimo is not None: st.caption(f"Última alteração: {descrever_sync(observador.ultimo)}")
+
+def finalizar_job(job):
+    # Job terminou: avisos, memória imediata (se ainda for o mesmo caso) e banco reaberto com os vetores novos
+    get_gerenciador_casos().fechar(job["pasta_caso"])
+    # Toasts sobrevivem ao st.rerun() que vem logo depois
+    if job["status"] == "erro": st.toast(f"❌ Erro ao indexar: {job['erro']}")
+    for a in job["arquivos"]:
+        if a["status"] == "erro": st.toast(f"❌ Erro em {a['nome']}: {a['erro']}")
+        elif a["status"] == "vazio": st.toast(f"⚠️ {a['nome']} vazio.")
+    lidos = [a for a in job["arquivos"] if a["status"] not in ("erro", "vazio", None)]
+    hits = sum(1 for a in lidos if a["status"] in ("cache", "ja_indexado", "duplicado"))
+    st.toast(f"♻️ Cache: {hits} reaproveitado(s), {len(lidos) - hits} processado(s)")
+    escrita = job["escrita"]
+    if escrita.get("fragmentos"):
+        st.toast(f"🧠 {escrita['fragmentos']} fragmentos indexados ({escrita['fragmentos_por_segundo']}/s)")
+    if job.get("etapas"): st.session_state.rastro_ingestao = job["etapas"]
+    if job["caso"] == st.session_state.get("caso_selecionado"):
+        st.session_state.memoria_imediata = memoria_do_job(get_cache_ingestao(), job, LIMITE_MEMORIA_IMEDIATA)
+
+@st.fragment(run_every=1.0)
+def painel_ingestao():
+    # Só este trecho re-executa a cada segundo; o chat continua usável durante a ingestão
+    fila = get_fila_ingestao()
+    # Jobs que o observador da pasta enfileirou enquanto a página estava parada
+    caso = st.session_state.get("caso_selecionado")
+    if caso and caso in get_observadores():
+        st.session_state.jobs_ingestao += [j for j in fila.ativos(os.path.join(PASTA_MEMORIA, caso)) if j not in st.session_state.jobs_ingestao]
+    terminados = []
+    for job_id in list(st.session_state.jobs_ingestao):
+        job = fila.job(job_id)
+        if job is None:
+            st.session_state.jobs_ingestao.remove(job_id)
+            continue
+        if job["status"] in ("concluido", "erro"):
+            terminados.append(job)
+            continue
+        feitos = sum(a["fracao"] or 0 for a in job["arquivos"])
+        st.progress(min(feitos / max(len(job["arquivos"]), 1), 1.0), text=f"📥 {job['caso']}: {len(job['arquivos'])} arquivo(s)")
+        for a in job["arquivos"]:
+            st.caption(f"{ETAPAS.get(a['etapa'], a['etapa'])} · {a['nome']} ({int((a['fracao'] or 0) * 100)}%)")
+    if terminados:
+        for job in terminados:
+            st.session_state.jobs_ingestao.remove(job["id"])
+            finalizar_job(job)
+        st.rerun()
 
 # --- 8. CHAT ---
 def fluxo_de_resposta(vectorstore, pergunta):
-    imediato = st.session_state.get("memoria_imediata", "")
-    ctx_bd = ""
+    # Rastro da resposta inteira (cache, busca, pandas, contexto, LLM) para o painel de depuração
+    caso = "*" if st.session_state.get("busca_global") else st.session_state.get("caso_selecionado") or ""
+    with etapa("resposta", caso=caso) as rastro:
+        st.session_state.rastro_resposta = rastro
+        yield from _gerar_resposta(vectorstore, pergunta)
+
+def _gerar_resposta(vectorstore, pergunta):
+    # Busca em todos os casos: sem memória imediata, cache de respostas e pandas (que são de um caso só)
+    global_ = st.session_state.get("busca_global")
+    imediato = "" if global_ else st.session_state.get("memoria_imediata", "")
     historico = []
+    st.session_state.ultimas_metricas = {}
+    multicaso = None
     
-    if vectorstore:
+    caso = None if global_ else st.session_state.get("caso_selecionado")
+    lexico = IndiceLexico(os.path.join(PASTA_MEMORIA, caso)) if caso else None
+
+    # Mesma pergunta (ou quase) sobre o mesmo corpus: repete a resposta sem ir ao LLM.
+    # A versão muda a cada ingestão no caso, então respostas antigas não voltam.
+    respostas, versao = None, None
+    if vectorstore and caso:
         try:
-            historico = vectorstore.as_retriever(search_kwargs={"k": 5}).invoke(pergunta)
-            ctx_bd = "\n\n".join([d.page_content for d in historico])
-        except: pass
-    
-    st.session_state.ultimas_fontes = historico
+            respostas = CacheRespostas(os.path.join(PASTA_MEMORIA, caso))
+            with usar_banco(caso) as vs: versao = versao_corpus(vs, lexico)
+            with etapa("cache_respostas.busca"): achado = respostas.buscar(versao, pergunta, get_embedding_function().embed_query)
+        except Exception: respostas, achado = None, None
+        if achado:
+            st.session_state.ultimas_fontes = achado["fontes"]
+            st.session_state.ultimas_metricas = {"cache": achado["tipo"]}
+            st.toast("♻️ Resposta reaproveitada do cache" + (" (pergunta semelhante)" if achado["tipo"] == "semelhante" else ""))
+            for parte in re.split(r"(\s+)", achado["resposta"]): yield parte
+            return
+
+    if global_:
+        try:
+            # Todos os casos em paralelo, top-k global com o caso de cada fragmento
+            with etapa("busca.multicaso"):
+                r = buscar_em_casos(get_gerenciador_casos(), casos_indexados(PASTA_MEMORIA, get_catalogo().visiveis()), pergunta, get_embedding_function(), k=8)
+            historico = r["docs"]
+            multicaso = {k: r[k] for k in ("consultados", "responderam", "atrasados", "segundos")}
+            if r["atrasados"]: st.toast(f"⏱️ {len(r['atrasados'])} caso(s) não responderam a tempo")
+        except Exception as e: st.toast(f"❌ Falha na busca em todos os casos: {e}")
+    elif vectorstore and caso:
+        try:
+            # Híbrido: BM25 (nº de processo, CPF/CNPJ, artigos) + vetorial, fundidos por posição
+            with etapa("busca.hibrida"), usar_banco(caso) as vs: historico = buscar_hibrido(vs, lexico, pergunta, k=5)
+        except Exception as e: st.toast(f"❌ Falha na busca: {e}")
 
-    if not imediato and not ctx_bd:
-        yield "Sem dados. Anexe um arquivo."
+    # Perguntas numéricas (soma, média, top-N, contagem) são calculadas em pandas sobre as planilhas do caso
+    calculos = ""
+    if caso:
+        try:
+            with etapa("calculos.pandas"): calculos = calcular_respostas(pergunta, PASTA_TABELAS, CatalogoTabelas(os.path.join(PASTA_MEMORIA, caso)))
+        except Exception: pass
+
+    if not imediato and not historico and not calculos:
+        st.session_state.ultimas_fontes = []
+        st.session_state.ultimas_metricas = {"multicaso": multicaso} if multicaso else {}
+        yield "Nada encontrado nos casos." if global_ else "Sem dados. Anexe um arquivo."
         return
 
+    # Orçamento de tokens: sem repetir fragmentos sobrepostos e só a parte da memória imediata que importa
+    with etapa("contexto.montagem"):
+        ctx = montar_contexto(pergunta, historico, imediato, calculos, rotulo=rotulo_caso if global_ else None)
+    historico = ctx["fontes"]
+    st.session_state.ultimas_fontes = historico
+
     contexto_final = f"""
     VOCÊ É UM ANALISTA DE DADOS (JURÍDICO/FINANCEIRO).
     DADOS BRUTOS (OCR/PLANILHAS):
-    {imediato}
+    {ctx["imediato"]}
     HISTÓRICO:
-    {ctx_bd}
+    {ctx["historico"]}
+    CÁLCULOS EXATOS (PANDAS):
+    {ctx["calculos"] or "Nenhum."}
     INSTRUÇÕES:
     1. Responda com base nos dados acima.
     2. NÃO recuse analisar imagens/planilhas. O texto acima é o conteúdo delas.
+    3. Para somas, médias, contagens e rankings use os CÁLCULOS EXATOS; não some valores da tabela por conta própria.
+    {"4. Cada trecho do HISTÓRICO vem de um caso diferente (indicado entre colchetes); diga sempre em qual caso está cada informação." if global_ else ""}
     """
     
     chain = ChatPromptTemplate.from_template("Analise e responda:\n{question}") | get_llm()
     # Concatena prompt e pergunta para garantir contexto
     full_q = f"{contexto_final}\n\nPERGUNTA: {pergunta}"
     
+    metricas = {"tokens_prompt": contar_tokens(full_q), "tokens_contexto": ctx["tokens"]}
+    if multicaso: metricas["multicaso"] = multicaso
+    gerado = []
+    inicio = time.perf_counter()
     for chunk in chain.stream({"question": full_q}):
+        if not gerado:
+            metricas["primeiro_token"] = time.perf_counter() - inicio
+            acumular("llm.primeiro_token", metricas["primeiro_token"]) # Prefill do llama3.1
+        # O Ollama devolve a contagem real do prompt no último pedaço
+        real = (getattr(chunk, "response_metadata", None) or {}).get("prompt_eval_count")
+        if real: metricas["tokens_prompt"] = real
+        gerado.append(chunk.content)
         yield chunk.content
+    metricas["total"] = time.perf_counter() - inicio
+    acumular("llm.geracao", metricas["total"] - metricas.get("primeiro_token", 0))
+    st.session_state.ultimas_metricas = metricas
+
+    if respostas:
+        try:
+            with etapa("cache_respostas.salvar"): respostas.salvar(versao, pergunta, "".join(gerado), historico, get_embedding_function().embed_query)
+        except Exception: pass
+
+def mostrar_rastro(titulo, resumo):
+    if not resumo:
+        st.caption(f"{titulo}: nada ainda.")
+        return
+    st.markdown(f"**{titulo}** · {resumo['total_s']:.2f}s" + ("" if resumo.get("concluido", True) else " (em andamento)"))
+    total = resumo["total_s"] or 1
+    linhas = ["| Etapa | Tempo (s) | Nº | % |", "| :--- | ---: | ---: | ---: |"]
+    for e in resumo["etapas"]:
+        linhas.append(f"| {e['etapa']} | {e['segundos']:.3f} | {e['n']} | {100 * e['segundos'] / total:.0f}% |")
+    st.markdown("\n".join(linhas))
+
+def rotulo_caso(d):
+    return f"Caso {', '.join(d.metadata.get('casos') or [d.metadata.get('caso', '?')])} · {d.metadata.get('source_name', '')}"
+
+def descrever_fonte(d):
+    casos = d.metadata.get("casos")
+    return (f"📁 {', '.join(casos)} · " if casos else "") + f"📄 {d.metadata.get('source_name')}"
+
+def descrever_metricas(m):
+    if m.get("cache"): return f"♻️ Resposta do cache ({m['cache']})"
+    mc = m.get("multicaso")
+    global_ = f"🌐 {mc['responderam']}/{mc['consultados']} casos em {mc['segundos']:.2f}s" if mc else ""
+    if "tokens_prompt" not in m: return global_
+    texto = (global_ + " | " if global_ else "") + f"📏 Prompt: {m['tokens_prompt']} tokens (dados: {m['tokens_contexto']})"
+    if "primeiro_token" in m: texto += f" | ⏱️ 1º token: {m['primeiro_token']:.1f}s"
+    if "total" in m: texto += f" | total: {m['total']:.1f}s"
+    return texto
 
 # --- MAIN ---
 def main():
+    inicio = get_telemetria(INICIO_PROCESSO)
+    modelos = get_modelos()
     with st.sidebar:
         st.header("🗂️ Histórico")
         if st.button("➕ Novo Caso", use_container_width=True):
@@ -313,15 +477,15 @@ def main():
             st.session_state.memoria_imediata = ""
             st.session_state.messages = []
             st.rerun()
+        st.toggle("🌐 Buscar em todos os casos", key="busca_global",
+                  help="Pergunta sobre todos os casos ao mesmo tempo; cada fonte mostra o caso de origem.")
         st.markdown("---")
         
-        casos = listar_casos_visiveis()
-        cfg = carregar_config()
-        
-        for caso in casos:
+        catalogo = get_catalogo()
+        for caso in catalogo.visiveis():
             c1, c2 = st.columns([0.85, 0.15])
             with c1:
-                icone = "📌" if caso in cfg["pinned"] else "📁"
+                icone = "📌" if catalogo.fixado(caso) else "📁"
                 if st.button(f"{icone} {caso}", key=f"btn_{caso}", use_container_width=True):
                     st.session_state.caso_selecionado = caso
                     st.session_state.memoria_imediata = ""
@@ -334,21 +498,44 @@ def main():
                     if st.button(f"📌 Fixar", key=f"pin_{caso}", use_container_width=True): acao_fixar(caso)
                     nn = st.text_input("Renomear:", value=caso, key=f"inp_{caso}")
                     if st.button("✏️ Salvar", key=f"ren_{caso}", use_container_width=True): acao_renomear(caso, nn)
+                    if catalogo.tipo_banco(caso) == "chroma":
+                        if st.button("🗜️ Compactar banco", key=f"mig_{caso}", use_container_width=True,
+                                     help="Converte o Chroma deste caso em vetores int8 (menos disco, abre na hora)"): acao_migrar(caso)
                     st.divider()
                     if st.button("🗑️ Excluir", key=f"del_{caso}", type="primary", use_container_width=True): acao_excluir(caso)
 
         if not STATUS_OCR: st.error("🚨 TESSERACT OFF")
+        pool = get_gerenciador_casos().estatisticas()
+        st.caption(f"🗄️ Bancos abertos: {pool['abertos']}/{pool['capacidade']} | hits {pool['hits']} · misses {pool['misses']}")
+        with st.expander("🐞 Depuração"):
+            # Etapas concorrentes (lotes de embedding em paralelo) podem somar mais que 100%
+            rastro = st.session_state.rastro_resposta
+            mostrar_rastro("Última resposta", rastro.resumo() if rastro else None)
+            mostrar_rastro("Última ingestão", st.session_state.rastro_ingestao)
+            carregados = [m for m in BACKENDS_PESADOS if m in sys.modules]
+            st.caption(f"⏱️ Partida: {inicio['segundos']:.2f}s" + (f" · RSS {inicio['rss_mb']:.0f} MB" if inicio["rss_mb"] else "")
+                       + f" · carregados: {', '.join(carregados) or 'nenhum'}")
+            st.caption(f"🔥 {descrever_modelos(modelos.estatisticas())}")
 
     if st.session_state.get("caso_selecionado"):
         st.title(f"⚖️ {st.session_state.caso_selecionado}")
-        if st.session_state.vectorstore is None:
-            st.session_state.vectorstore = carregar_banco(st.session_state.caso_selecionado)
+        # Busca no pool a cada execução: se o handle foi despejado por outra sessão, reabre
+        st.session_state.vectorstore = carregar_banco(st.session_state.caso_selecionado)
+        if isinstance(st.session_state.vectorstore, BancoPlano):
+            v = st.session_state.vectorstore.estatisticas()
+            st.caption(f"🗜️ Banco {v['tipo']} · {v['fragmentos']} fragmentos · {v['mb']} MB")
     else:
         st.markdown("# 👋 Nemesis AI")
+        tipo_banco = st.selectbox("Banco vetorial:", BACKENDS, index=BACKENDS.index(BACKEND_PADRAO) if BACKEND_PADRAO in BACKENDS else 0,
+                                  help="int8/float16: vetores compactos em disco, busca por força bruta (ideal para casos pequenos)")
         novo = st.text_input("Novo Cliente:", placeholder="Ex: Silva")
         if novo:
             safe = re.sub(r'[^a-zA-Z0-9_-]', '', novo.strip().replace(" ", "_")).strip("_-")
             if not safe: safe="novo"
+            if get_catalogo().na_lixeira(safe) and safe not in get_catalogo().reclamar(safe):
+                st.error("⚠️ Um caso com esse nome ainda está sendo apagado. Tente em instantes.")
+                st.stop()
+            garantir_backend(os.path.join(PASTA_MEMORIA, safe), tipo_banco) # Caso existente mantém o banco que tem
             st.session_state.caso_selecionado = safe
             st.rerun()
 
@@ -356,11 +543,17 @@ def main():
         with st.chat_message(msg["role"]):
             st.markdown(msg["content"])
             if msg["role"] == "assistant":
-                doc = gerar_word(msg["content"])
-                st.download_button("📄 Baixar DOCX", doc, f"Nemesis_{int(time.time())}.docx", key=f"d_{msg['content'][:5]}")
+                chave = chave_mensagem(msg)
+                botao_docx(chave, "Baixar DOCX", lambda: gerar_word(chave, msg))
             if msg.get("fontes"):
                 with st.expander("🔍 Fontes"):
-                    for d in msg["fontes"]: st.markdown(f"<div class='source-box'>📄 {d.metadata.get('source_name')}</div>", unsafe_allow_html=True)
+                    for d in msg["fontes"]: st.markdown(f"<div class='source-box'>{descrever_fonte(d)}</div>", unsafe_allow_html=True)
+            if msg.get("metricas"): st.caption(descrever_metricas(msg["metricas"]))
+    if any(m["role"] == "assistant" for m in st.session_state.messages):
+        mensagens = st.session_state.messages
+        chave = hashlib.sha1("".join(chave_mensagem(m) for m in mensagens).encode()).hexdigest()[:16]
+        titulo = "Todos os casos" if st.session_state.busca_global else (st.session_state.caso_selecionado or "Nemesis")
+        botao_docx(chave, "Exportar conversa inteira", lambda: gerar_word_conversa(chave, mensagens, titulo))
 
     if st.session_state.get("caso_selecionado"):
         if st.session_state.get("memoria_imediata"):
@@ -369,19 +562,27 @@ def main():
 
         with st.expander("📎 Anexar", expanded=False):
             c1, c2 = st.columns([5, 1])
-            files = c1.file_uploader("Upload", type=["pdf", "jpg", "png", "xlsx", "csv", "wav"], accept_multiple_files=True, label_visibility="collapsed")
+            files = c1.file_uploader("Upload", type=EXTENSOES, accept_multiple_files=True, label_visibility="collapsed")
             if c2.button("Processar", use_container_width=True) and files:
-                qtd, texto = processar_arquivos(st.session_state.vectorstore, files)
-                st.session_state.memoria_imediata = texto
+                processar_arquivos(files)
                 st.rerun()
-
-        if prompt := st.chat_input("Pergunte..."):
+        with st.expander("📁 Sincronizar Pasta", expanded=False):
+            painel_sincronizacao(st.session_state.caso_selecionado)
+        # Página recarregada no meio de uma ingestão: volta a acompanhar os jobs do caso
+        ativos = get_fila_ingestao().ativos(os.path.join(PASTA_MEMORIA, st.session_state.caso_selecionado))
+        if ativos and not st.session_state.jobs_ingestao: subir_workers()
+        st.session_state.jobs_ingestao += [j for j in ativos if j not in st.session_state.jobs_ingestao]
+        if st.session_state.jobs_ingestao or st.session_state.caso_selecionado in get_observadores(): painel_ingestao()
+
+    if st.session_state.get("caso_selecionado") or st.session_state.busca_global:
+        if prompt := st.chat_input("Pergunte em todos os casos..." if st.session_state.busca_global else "Pergunte..."):
             st.session_state.messages.append({"role": "user", "content": prompt})
             with st.chat_message("user"): st.markdown(prompt)
             with st.chat_message("assistant"):
                 resp = st.write_stream(fluxo_de_resposta(st.session_state.vectorstore, prompt))
                 ft = st.session_state.get("ultimas_fontes", [])
-                st.session_state.messages.append({"role": "assistant", "content": resp, "fontes": ft})
+                st.session_state.messages.append({"role": "assistant", "content": resp, "fontes": ft,
+                                                  "metricas": st.session_state.get("ultimas_metricas", {})})
                 st.rerun()
 
 if __name__ == "__main__":
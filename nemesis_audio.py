@@ -0,0 +1,204 @@
+import os
+import sqlite3
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from nemesis_cache import hash_arquivo
+
+# --- CONFIGURAÇÃO ---
+MODELO_WHISPER = os.environ.get("NEMESIS_WHISPER_MODELO", "base")
+IDIOMA_WHISPER = os.environ.get("NEMESIS_WHISPER_IDIOMA") or None # None = detecção automática
+AUDIO_WORKERS = int(os.environ.get("NEMESIS_AUDIO_WORKERS", max(1, min(4, (os.cpu_count() or 2) // 2))))
+SEGMENTO_SEGUNDOS = 120 # Tamanho-alvo de cada trecho enviado ao Whisper
+JANELA_SILENCIO = 15 # Procura o ponto mais silencioso em ±15s do corte-alvo
+TAXA = 16000 # whisper.audio.SAMPLE_RATE, sem importar whisper/torch só para ler a constante
+BLOCO_LEITURA = 60 # Segundos decodificados pelo ffmpeg por leitura (o áudio inteiro nunca fica na memória)
+
+# --- MODELO QUENTE (UM POR PROCESSO) ---
+_modelo = None
+_lock_modelo = threading.Lock()
+
+def get_modelo_whisper():
+    global _modelo
+    with _lock_modelo:
+        if _modelo is None:
+            import whisper # Carrega torch: só quando o primeiro áudio chega
+            _modelo = whisper.load_model(MODELO_WHISPER)
+        return _modelo
+
+def transcrever_trecho(audio):
+    return get_modelo_whisper().transcribe(audio, fp16=False, language=IDIOMA_WHISPER)["text"].strip()
+
+def _iniciar_worker(threads):
+    # Divide os núcleos entre os workers em vez de cada um disputar todos
+    import torch
+    torch.set_num_threads(threads)
+    get_modelo_whisper()
+
+# --- POOL PERSISTENTE (MODELO CARREGADO UMA VEZ POR PROCESSO, ENTRE ARQUIVOS) ---
+_pool = None
+_pool_config = None
+_lock_pool = threading.Lock()
+
+def _get_pool(workers):
+    # Recriado só quando a configuração muda; os workers mantêm o Whisper carregado entre áudios
+    global _pool, _pool_config
+    config = (workers, max(1, (os.cpu_count() or 2) // workers), MODELO_WHISPER)
+    with _lock_pool:
+        if _pool is None or _pool_config != config:
+            if _pool is not None: _pool.shutdown(cancel_futures=True)
+            _pool = ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_worker, initargs=(config[1],))
+            _pool_config = config
+        return _pool
+
+def encerrar_pool():
+    global _pool, _pool_config
+    with _lock_pool:
+        if _pool is not None: _pool.shutdown(cancel_futures=True)
+        _pool, _pool_config = None, None
+
+# --- DECODIFICAÇÃO EM BLOCOS (FFMPEG) ---
+def duracao(caminho):
+    # Segundos pelo ffprobe (só para a barra de progresso); None se não der para saber
+    try:
+        r = subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", caminho],
+                           capture_output=True, timeout=30)
+        return float(r.stdout.decode().strip())
+    except (OSError, ValueError, subprocess.SubprocessError): return None
+
+def ler_blocos(caminho, segundos=BLOCO_LEITURA):
+    # Mesma conversão do whisper.load_audio (mono, 16 kHz, s16le), lida do pipe aos poucos
+    cmd = ["ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0", "-i", caminho,
+           "-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(TAXA), "-"]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while True:
+            dados = proc.stdout.read(segundos * TAXA * 2)
+            if not dados: break
+            yield np.frombuffer(dados[: len(dados) // 2 * 2], np.int16).astype(np.float32) / 32768.0
+        erro = proc.stderr.read().decode("utf-8", errors="replace").strip()
+        if proc.wait() != 0: raise RuntimeError(f"Falha ao decodificar o áudio: {erro}")
+    finally:
+        if proc.poll() is None: proc.kill() # Gerador abandonado no meio
+        proc.stdout.close()
+        proc.stderr.close()
+        proc.wait()
+
+# --- SEGMENTAÇÃO POR SILÊNCIO ---
+def energia_por_quadro(audio, quadro, bloco=TAXA * 60):
+    # RMS por quadro, calculado em blocos de 1 minuto (não duplica o áudio inteiro na memória)
+    partes = []
+    passo = (bloco // quadro) * quadro
+    for i in range(0, len(audio) - quadro + 1, passo):
+        trecho = audio[i : i + passo]
+        n = len(trecho) // quadro
+        partes.append(np.sqrt(np.mean(np.square(trecho[: n * quadro].reshape(n, quadro)), axis=1)))
+    return np.concatenate(partes) if partes else np.zeros(0, dtype=np.float32)
+
+def segmentar_fluxo(blocos, alvo=SEGMENTO_SEGUNDOS, janela=JANELA_SILENCIO):
+    # Corta no ponto de menor energia perto de cada alvo, direto sobre os blocos do ffmpeg: gera
+    # (inicio, fim, trecho) em amostras guardando no máximo ~1,5 trecho + 1 bloco na memória.
+    # Corta só com 1,5x alvo acumulado: o último trecho nunca fica curto.
+    quadro = int(0.03 * TAXA)
+    buffer = np.zeros(0, dtype=np.float32)
+    inicio = 0
+    for bloco in blocos:
+        buffer = np.concatenate((buffer, bloco))
+        while len(buffer) >= alvo * TAXA * 1.5:
+            energia = energia_por_quadro(buffer[: (alvo + janela) * TAXA], quadro)
+            ini = max(TAXA, (alvo - janela) * TAXA) // quadro
+            q = ini + int(np.argmin(energia[ini:]))
+            corte = q * quadro + quadro // 2
+            yield inicio, inicio + corte, buffer[:corte]
+            inicio += corte
+            buffer = buffer[corte:]
+    if len(buffer): yield inicio, inicio + len(buffer), buffer
+
+# --- CACHE DE TRANSCRIÇÕES (POR HASH DO ÁUDIO + TRECHO) ---
+class CacheTranscricoes:
+    def __init__(self, pasta):
+        os.makedirs(pasta, exist_ok=True)
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(os.path.join(pasta, "transcricoes.sqlite"), check_same_thread=False)
+        self._con.execute("""CREATE TABLE IF NOT EXISTS trechos (
+            hash TEXT, modelo TEXT, inicio INTEGER, fim INTEGER, texto TEXT,
+            PRIMARY KEY (hash, modelo, inicio, fim))""")
+        self._con.commit()
+
+    def buscar(self, hash_audio, inicio, fim):
+        with self._lock:
+            linha = self._con.execute("SELECT texto FROM trechos WHERE hash = ? AND modelo = ? AND inicio = ? AND fim = ?",
+                                      (hash_audio, MODELO_WHISPER, inicio, fim)).fetchone()
+        return linha[0] if linha else None
+
+    def salvar(self, hash_audio, inicio, fim, texto):
+        with self._lock:
+            self._con.execute("INSERT OR REPLACE INTO trechos VALUES (?, ?, ?, ?, ?)",
+                              (hash_audio, MODELO_WHISPER, inicio, fim, texto))
+            self._con.commit()
+
+    def fechar(self):
+        with self._lock: self._con.close()
+
+# --- TRANSCRIÇÃO EM STREAMING ---
+def iterar_transcricao(caminho, cache=None, ao_progresso=None, workers=None):
+    # Gera o texto de cada trecho na ordem do áudio, assim que fica pronto, decodificando em blocos.
+    # Trechos já transcritos (mesmo áudio) saem direto do cache.
+    workers = AUDIO_WORKERS if workers is None else workers
+    h = hash_arquivo(caminho) if cache else None
+    segundos = duracao(caminho)
+    estimado = max(1, round(segundos / SEGMENTO_SEGUNDOS)) if segundos else None
+    pendentes = deque() # (inicio, fim, texto pronto ou Future)
+    feitas = 0
+
+    def resolver(item):
+        inicio, fim, t = item
+        if not isinstance(t, str):
+            t = t.result()
+            if cache: cache.salvar(h, inicio, fim, t)
+        return t
+
+    def avisar():
+        if ao_progresso: ao_progresso(feitas, max(estimado or feitas + 1, feitas))
+
+    try:
+        for inicio, fim, trecho in segmentar_fluxo(ler_blocos(caminho)):
+            t = cache.buscar(h, inicio, fim) if cache else None
+            if t is None:
+                if workers <= 1 or (segundos and segundos <= SEGMENTO_SEGUNDOS * 1.5):
+                    t = transcrever_trecho(trecho)
+                    if cache: cache.salvar(h, inicio, fim, t)
+                else:
+                    t = _get_pool(workers).submit(transcrever_trecho, trecho)
+            pendentes.append((inicio, fim, t))
+            while pendentes and (isinstance(pendentes[0][2], str) or len(pendentes) > 2 * workers):
+                texto = resolver(pendentes.popleft())
+                feitas += 1
+                avisar()
+                yield texto
+        while pendentes:
+            texto = resolver(pendentes.popleft())
+            feitas += 1
+            avisar()
+            yield texto
+    except BrokenProcessPool:
+        encerrar_pool() # Worker morreu (falta de memória): o próximo áudio recria o pool
+        raise
+    finally:
+        for item in pendentes:
+            if not isinstance(item[2], str): item[2].cancel() # Gerador abandonado: não deixa trechos na fila do pool
+
+def transcrever_audio(caminho, cache=None):
+    return " ".join(t for t in iterar_transcricao(caminho, cache=cache) if t)
+
+def criar_extrator_audio(pasta_cache):
+    cache = CacheTranscricoes(pasta_cache)
+    def extrair_audio(caminho, ao_progresso=None):
+        yield from iterar_transcricao(caminho, cache=cache, ao_progresso=ao_progresso)
+    extrair_audio.cache = cache
+    return extrair_audio
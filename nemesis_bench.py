@@ -0,0 +1,554 @@
+import os
+import io
+import sys
+import csv
+import json
+import math
+import time
+import wave
+import random
+import shutil
+import hashlib
+import importlib.util
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+from nemesis_telemetria import rss_mb
+
+# --- CONFIGURAÇÃO ---
+SEMENTE = 42
+TAMANHOS_PLANILHA = (1_000, 10_000, 50_000) # Linhas; XLSX só até 10k (openpyxl é lento para gerar)
+PAGINAS_PDF = 6
+QTD_IMAGENS = 3
+QTD_AUDIOS = 2
+SEGUNDOS_AUDIO = 20
+DIMENSAO_STUB = 384 # Mesma dimensão do all-minilm
+VERSAO_RELATORIO = 1
+
+# --- CORPUS SINTÉTICO (REPRODUZÍVEL PELA SEMENTE) ---
+PALAVRAS = """contrato cláusula rescisão multa indenização prazo pagamento parcela autor réu juiz sentença recurso
+apelação agravo petição inicial contestação audiência testemunha perícia laudo honorários custas execução penhora
+acordo homologação citação intimação despacho decisão liminar tutela urgência dano moral material lucros cessantes
+fornecedor consumidor locação imóvel aluguel fiador garantia notificação extrajudicial vencimento juros correção""".split()
+CLIENTES = ["Silva", "Souza", "Oliveira", "Pereira", "Costa", "Almeida", "Ferreira", "Rodrigues", "Lima", "Gomes"]
+STATUS = ["ativo", "arquivado", "suspenso", "em recurso"]
+
+def numero_processo(rng):
+    return f"{rng.randint(0, 9999999):07d}-{rng.randint(10, 99)}.{rng.randint(2015, 2025)}.8.26.{rng.randint(1, 999):04d}"
+
+def paragrafo(rng, palavras=70):
+    texto = []
+    for i in range(palavras):
+        sorteio = rng.random()
+        if sorteio < 0.02: texto.append(f"processo nº {numero_processo(rng)}")
+        elif sorteio < 0.04: texto.append(f"art. {rng.randint(1, 999)}")
+        elif sorteio < 0.06: texto.append(f"R$ {rng.randint(100, 999999):,}".replace(",", ".") + f",{rng.randint(0, 99):02d}")
+        else: texto.append(rng.choice(PALAVRAS))
+    return " ".join(texto).capitalize() + "."
+
+def _fonte(tamanho):
+    from PIL import ImageFont
+    try: return ImageFont.load_default(size=tamanho)
+    except TypeError: return ImageFont.load_default()
+
+def imagem_de_texto(texto, largura=1240, altura=1754, escuro=False):
+    # Página "digitalizada": texto renderizado numa imagem, sem camada de texto
+    from PIL import Image, ImageDraw
+    import textwrap
+    fundo, tinta = ((25, 25, 25), (230, 230, 230)) if escuro else ((255, 255, 255), (0, 0, 0))
+    img = Image.new("RGB", (largura, altura), fundo)
+    desenho = ImageDraw.Draw(img)
+    y = 60
+    for linha in textwrap.wrap(texto, 90):
+        desenho.text((60, y), linha, fill=tinta, font=_fonte(22))
+        y += 30
+        if y > altura - 60: break
+    return img
+
+def gerar_corpus(pasta, semente=SEMENTE, paginas=PAGINAS_PDF, tamanhos=TAMANHOS_PLANILHA,
+                 imagens=QTD_IMAGENS, audios=QTD_AUDIOS):
+    import fitz
+    rng = random.Random(semente)
+    os.makedirs(pasta, exist_ok=True)
+    corpus = {"pdf_texto": [], "pdf_digitalizado": [], "imagem": [], "csv": [], "xlsx": [], "audio": []}
+
+    for i in range(2):
+        caminho = os.path.join(pasta, f"peticao_{i}.pdf")
+        doc = fitz.open()
+        for _ in range(paginas):
+            pag = doc.new_page()
+            pag.insert_textbox(fitz.Rect(50, 50, 545, 792), "\n\n".join(paragrafo(rng) for _ in range(5)), fontsize=9)
+        doc.save(caminho)
+        doc.close()
+        corpus["pdf_texto"].append(caminho)
+
+    caminho = os.path.join(pasta, "contrato_digitalizado.pdf")
+    doc = fitz.open()
+    for _ in range(max(1, paginas // 2)):
+        buffer = io.BytesIO()
+        imagem_de_texto(" ".join(paragrafo(rng) for _ in range(6))).save(buffer, format="PNG")
+        pag = doc.new_page()
+        pag.insert_image(pag.rect, stream=buffer.getvalue())
+    doc.save(caminho)
+    doc.close()
+    corpus["pdf_digitalizado"].append(caminho)
+
+    for i in range(imagens):
+        caminho = os.path.join(pasta, f"print_{i}.png")
+        imagem_de_texto(paragrafo(rng, 120), altura=900, escuro=(i % 2 == 1)).save(caminho)
+        corpus["imagem"].append(caminho)
+
+    for n in tamanhos:
+        linhas = [[numero_processo(rng), f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2018, 2025)}",
+                   rng.choice(CLIENTES), f"{rng.randint(100, 500000)},{rng.randint(0, 99):02d}", rng.choice(STATUS)]
+                  for _ in range(n)]
+        cabecalho = ["processo", "data", "cliente", "valor", "status"]
+        caminho = os.path.join(pasta, f"planilha_{n}.csv")
+        with open(caminho, "w", newline="", encoding="utf-8") as f:
+            escritor = csv.writer(f, delimiter=";")
+            escritor.writerow(cabecalho)
+            escritor.writerows(linhas)
+        corpus["csv"].append(caminho)
+        if n <= 10_000:
+            from openpyxl import Workbook
+            wb = Workbook(write_only=True)
+            ws = wb.create_sheet("dados")
+            ws.append(cabecalho)
+            for linha in linhas: ws.append(linha)
+            caminho = os.path.join(pasta, f"planilha_{n}.xlsx")
+            wb.save(caminho)
+            corpus["xlsx"].append(caminho)
+
+    for i in range(audios):
+        # Rajadas de tom separadas por silêncio (exercita o corte por silêncio); 16 kHz mono
+        taxa = 16000
+        sinal = np.zeros(taxa * SEGUNDOS_AUDIO, dtype=np.float32)
+        pos = 0
+        while pos < len(sinal):
+            dur = int(taxa * rng.uniform(1.5, 4.0))
+            t = np.arange(min(dur, len(sinal) - pos)) / taxa
+            sinal[pos : pos + len(t)] = 0.3 * np.sin(2 * np.pi * rng.uniform(150, 400) * t) * np.sin(np.pi * t / t[-1] if len(t) > 1 else 1)
+            pos += len(t) + int(taxa * rng.uniform(0.4, 1.2))
+        caminho = os.path.join(pasta, f"audiencia_{i}.wav")
+        with wave.open(caminho, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(taxa)
+            w.writeframes((sinal * 32767).astype(np.int16).tobytes())
+        corpus["audio"].append(caminho)
+    return corpus
+
+# --- OLLAMA DE MENTIRA (HTTP LOCAL COM LATÊNCIA CONFIGURÁVEL) ---
+def vetor_deterministico(texto, dimensao=DIMENSAO_STUB):
+    semente = int.from_bytes(hashlib.sha256(texto.encode("utf-8")).digest()[:8], "little")
+    v = np.random.default_rng(semente).standard_normal(dimensao).astype(np.float32)
+    return (v / np.linalg.norm(v)).tolist()
+
+class StubOllama:
+    # Responde /api/embed e /api/chat (streaming NDJSON) como o Ollama
+    def __init__(self, latencia_embed=0.02, latencia_item=0.001, primeiro_token=0.2, latencia_token=0.01,
+                 tokens_resposta=60, dimensao=DIMENSAO_STUB):
+        self.latencia_embed = latencia_embed
+        self.latencia_item = latencia_item
+        self.primeiro_token = primeiro_token
+        self.latencia_token = latencia_token
+        self.tokens_resposta = tokens_resposta
+        self.dimensao = dimensao
+        self.chamadas = {"embed": 0, "itens_embed": 0, "chat": 0}
+        self._lock = threading.Lock()
+        self._servidor = None
+
+    def _contar(self, chave, n=1):
+        with self._lock: self.chamadas[chave] += n
+
+    def iniciar(self):
+        stub = self
+
+        class Manipulador(BaseHTTPRequestHandler):
+            def log_message(self, *args): pass
+
+            def _json(self, dados, status=200):
+                corpo = json.dumps(dados).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def do_GET(self):
+                if self.path.startswith("/api/version"): self._json({"version": "0.0.0-stub"})
+                elif self.path.startswith("/api/tags"): self._json({"models": []})
+                else: self._json({"error": "não encontrado"}, 404)
+
+            def do_POST(self):
+                corpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                if self.path.startswith("/api/embed"):
+                    entradas = corpo.get("input", corpo.get("prompt", ""))
+                    entradas = [entradas] if isinstance(entradas, str) else entradas
+                    stub._contar("embed")
+                    stub._contar("itens_embed", len(entradas))
+                    time.sleep(stub.latencia_embed + stub.latencia_item * len(entradas))
+                    vetores = [vetor_deterministico(t, stub.dimensao) for t in entradas]
+                    if self.path.startswith("/api/embeddings"): self._json({"embedding": vetores[0]})
+                    else: self._json({"model": corpo.get("model"), "embeddings": vetores})
+                elif self.path.startswith("/api/chat"):
+                    stub._contar("chat")
+                    prompt = "".join(m.get("content", "") for m in corpo.get("messages", []))
+                    self._chat(corpo, len(prompt) // 4)
+                elif self.path.startswith("/api/show"): self._json({"modelfile": "", "parameters": "", "details": {}})
+                else: self._json({"error": "não encontrado"}, 404)
+
+            def _chat(self, corpo, tokens_prompt):
+                modelo = corpo.get("model", "stub")
+                palavras = [random.Random(i).choice(PALAVRAS) + " " for i in range(stub.tokens_resposta)]
+                if not corpo.get("stream", True):
+                    time.sleep(stub.primeiro_token + stub.latencia_token * len(palavras))
+                    return self._json({"model": modelo, "message": {"role": "assistant", "content": "".join(palavras)},
+                                       "done": True, "done_reason": "stop", "prompt_eval_count": tokens_prompt,
+                                       "eval_count": len(palavras)})
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                time.sleep(stub.primeiro_token)
+                for p in palavras:
+                    linha = {"model": modelo, "message": {"role": "assistant", "content": p}, "done": False}
+                    self.wfile.write((json.dumps(linha) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+                    time.sleep(stub.latencia_token)
+                fim = {"model": modelo, "message": {"role": "assistant", "content": ""}, "done": True, "done_reason": "stop",
+                       "prompt_eval_count": tokens_prompt, "eval_count": len(palavras)}
+                self.wfile.write((json.dumps(fim) + "\n").encode("utf-8"))
+                self.close_connection = True
+
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", 0), Manipulador)
+        self._servidor.daemon_threads = True
+        threading.Thread(target=self._servidor.serve_forever, daemon=True, name="nemesis-stub-ollama").start()
+        self.url = f"http://127.0.0.1:{self._servidor.server_address[1]}"
+        os.environ["OLLAMA_HOST"] = self.url # langchain_ollama/ollama leem daqui quando base_url não é passado
+        return self.url
+
+    def parar(self):
+        if self._servidor:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+
+# --- MEMÓRIA (RSS) ---
+class AmostradorRSS:
+    # Pico de RSS durante a etapa (amostra a cada 50 ms numa thread)
+    def __init__(self, intervalo=0.05):
+        self.intervalo = intervalo
+        self.pico = None
+        self._ativo = False
+
+    def _amostrar(self):
+        while self._ativo:
+            atual = rss_mb()
+            if atual is not None: self.pico = max(self.pico or 0, atual)
+            time.sleep(self.intervalo)
+
+    def __enter__(self):
+        self.pico = rss_mb()
+        self._ativo = True
+        self._thread = threading.Thread(target=self._amostrar, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._ativo = False
+        self._thread.join()
+
+# --- MEDIÇÃO POR ETAPA ---
+def percentil(valores, p):
+    if not valores: return None
+    ordenados = sorted(valores)
+    k = (len(ordenados) - 1) * p / 100
+    baixo, alto = math.floor(k), math.ceil(k)
+    return ordenados[baixo] + (ordenados[alto] - ordenados[baixo]) * (k - baixo)
+
+class Etapa:
+    def __init__(self, nome, unidade):
+        self.nome = nome
+        self.unidade = unidade
+        self.latencias = []
+        self.unidades = 0
+        self.extras = {}
+
+    @contextmanager
+    def operacao(self, unidades=1):
+        inicio = time.perf_counter()
+        yield
+        self.latencias.append(time.perf_counter() - inicio)
+        self.unidades += unidades
+
+class Benchmark:
+    def __init__(self):
+        self.etapas = {}
+
+    @contextmanager
+    def etapa(self, nome, unidade):
+        e = Etapa(nome, unidade)
+        inicio = time.perf_counter()
+        with AmostradorRSS() as rss:
+            yield e
+        duracao = time.perf_counter() - inicio
+        self.etapas[nome] = {
+            "unidade": unidade, "operacoes": len(e.latencias), "unidades": e.unidades, "segundos": round(duracao, 4),
+            "por_segundo": round(e.unidades / duracao, 3) if duracao else None,
+            "p50_ms": _ms(percentil(e.latencias, 50)), "p95_ms": _ms(percentil(e.latencias, 95)),
+            "pico_rss_mb": round(rss.pico, 1) if rss.pico is not None else None, **e.extras,
+        }
+        print(f"  {nome:<28} {e.unidades:>8} {unidade:<10} {self.etapas[nome]['por_segundo'] or 0:>10}/s  "
+              f"p50 {self.etapas[nome]['p50_ms']} ms  p95 {self.etapas[nome]['p95_ms']} ms", flush=True)
+
+    def pular(self, nome, motivo):
+        self.etapas[nome] = {"pulado": motivo}
+        print(f"  {nome:<28} pulado: {motivo}", flush=True)
+
+def _ms(segundos):
+    return round(segundos * 1000, 2) if segundos is not None else None
+
+def tem_tesseract():
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+def tem_whisper():
+    # Só procura o pacote: importar o whisper carrega o torch (segundos) antes de medir qualquer coisa
+    try: return importlib.util.find_spec("whisper") is not None
+    except Exception: return False
+
+# --- ETAPAS ---
+MODULOS_PARTIDA = ("nemesis_core", "nemesis_fila") # Menu da CLI e worker de ingestão (o app depende do Streamlit)
+PARTIDAS = 3
+
+def medir_partida(modulo, pasta):
+    # Import a frio num interpretador novo; só o tempo do import (sem a subida do Python)
+    codigo = (f"import sys, time, json; t = time.perf_counter(); import {modulo}; s = time.perf_counter() - t; "
+              "from nemesis_telemetria import BACKENDS_PESADOS, rss_mb; "
+              "print(json.dumps({'segundos': s, 'rss_mb': rss_mb(), 'carregados': [m for m in BACKENDS_PESADOS if m in sys.modules]}))")
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [raiz, os.environ.get("PYTHONPATH")]))}
+    saida = subprocess.run([sys.executable, "-c", codigo], cwd=pasta, env=env, capture_output=True, text=True, check=True)
+    return json.loads(saida.stdout.strip().splitlines()[-1])
+
+PERGUNTAS = ["qual o valor da multa por rescisão do contrato", "quem é o fiador da locação", "prazo para apelação",
+             "honorários e custas da execução", "art. 523 penhora", "dano moral e lucros cessantes", "audiência de conciliação",
+             "qual a soma do valor por cliente", "quantos processos estão arquivados", "laudo da perícia"]
+
+def executar(pasta, bench, corpus, ocr, audio, estagios=None):
+    from nemesis_ocr import iterar_paginas_pdf, ocr_imagem
+    from nemesis_planilhas import extrair_planilha
+    from PIL import Image
+
+    def quer(nome): return estagios is None or any(nome.startswith(e) for e in estagios)
+
+    # 0. Partida: import dos pontos de entrada (backends pesados devem ficar de fora até serem usados)
+    for modulo in MODULOS_PARTIDA:
+        nome = f"inicio_{modulo}"
+        if not quer(nome): continue
+        with bench.etapa(nome, "partidas") as e:
+            for _ in range(PARTIDAS):
+                r = medir_partida(modulo, pasta)
+                e.latencias.append(r["segundos"])
+                e.unidades += 1
+            e.extras["rss_mb"] = round(r["rss_mb"], 1) if r["rss_mb"] is not None else None
+            e.extras["carregados"] = r["carregados"]
+
+    # 1. Extração isolada, por tipo de arquivo
+    if quer("extracao_pdf_texto"):
+        with bench.etapa("extracao_pdf_texto", "páginas") as e:
+            for p in corpus["pdf_texto"]:
+                with e.operacao(PAGINAS_PDF): list(iterar_paginas_pdf(p, ocr=ocr))
+    if quer("extracao_pdf_digitalizado"):
+        if not ocr: bench.pular("extracao_pdf_digitalizado", "Tesseract indisponível")
+        else:
+            with bench.etapa("extracao_pdf_digitalizado", "páginas") as e:
+                for p in corpus["pdf_digitalizado"]:
+                    with e.operacao(max(1, PAGINAS_PDF // 2)): list(iterar_paginas_pdf(p))
+    if quer("extracao_imagem"):
+        if not ocr: bench.pular("extracao_imagem", "Tesseract indisponível")
+        else:
+            with bench.etapa("extracao_imagem", "imagens") as e:
+                for p in corpus["imagem"]:
+                    with e.operacao(): ocr_imagem(Image.open(p))
+    pasta_tabelas = os.path.join(pasta, "tabelas_bench")
+    for p in corpus["csv"] + corpus["xlsx"]:
+        nome = "extracao_" + os.path.basename(p).replace(".", "_")
+        if not quer(nome): continue
+        linhas = int(os.path.basename(p).split("_")[1].split(".")[0])
+        with bench.etapa(nome, "linhas") as e:
+            with e.operacao(linhas): list(extrair_planilha(p, pasta_tabelas))
+    if quer("extracao_audio"):
+        if not audio: bench.pular("extracao_audio", "openai-whisper indisponível")
+        else:
+            from nemesis_audio import transcrever_audio
+            with bench.etapa("extracao_audio", "segundos") as e:
+                for p in corpus["audio"]:
+                    with e.operacao(SEGUNDOS_AUDIO): transcrever_audio(p)
+
+    # 2. Ingestão ponta a ponta (extração → fatiamento → embeddings no stub → Chroma + BM25)
+    from nemesis_cache import CacheIngestao
+    from nemesis_embeddings import criar_embeddings
+    from nemesis_store import GerenciadorCasos
+    from nemesis_lexico import IndiceLexico, buscar_hibrido
+    from nemesis_fila import criar_extratores, FilaIngestao, processar_job
+    from nemesis_pipeline import ingerir_arquivos
+
+    raiz = os.path.join(pasta, "memoria")
+    pasta_cache = os.path.join(raiz, "_cache")
+    cache = CacheIngestao(pasta_cache)
+    embeddings = criar_embeddings(pasta_cache)
+    casos = GerenciadorCasos(embeddings)
+    extratores = criar_extratores(raiz, ocr=ocr)
+    arquivos = corpus["pdf_texto"] + corpus["csv"] + corpus["xlsx"]
+    if ocr: arquivos += corpus["pdf_digitalizado"] + corpus["imagem"]
+    if audio: arquivos += corpus["audio"]
+    fontes = [(os.path.basename(p), p) for p in arquivos]
+    pasta_caso = os.path.join(raiz, "bench")
+    vectorstore = casos.obter(pasta_caso, "bench")
+    lexico = IndiceLexico(pasta_caso)
+
+    for nome, rotulo in (("ingestao", "fria"), ("ingestao_repetida", "cache")):
+        if not quer(nome): continue
+        with bench.etapa(nome, "fragmentos") as e:
+            antes = (embeddings.hits, embeddings.misses) # Contadores são do processo: cada etapa mostra só o seu
+            marca = {"t": time.perf_counter()}
+            def ao_arquivo(r, e=e, marca=marca):
+                agora = time.perf_counter()
+                e.latencias.append(agora - marca["t"])
+                e.unidades += r["fragmentos"]
+                marca["t"] = agora
+            resultados, escrita = ingerir_arquivos(vectorstore, fontes, cache, extratores=extratores,
+                                                   ao_arquivo=ao_arquivo, lexico=lexico)
+            e.extras["arquivos"] = len(resultados)
+            e.extras["status"] = sorted({r["status"] for r in resultados})
+            e.extras["embed_hits"] = embeddings.hits - antes[0]
+            e.extras["embed_misses"] = embeddings.misses - antes[1]
+
+    if quer("fila"):
+        # Mesmo caminho do app/CLI: envio à fila + worker (aqui no próprio processo)
+        fila = FilaIngestao(raiz)
+        with bench.etapa("fila", "arquivos") as e:
+            with e.operacao(len(corpus["csv"])):
+                job_id = fila.enviar("bench_fila", os.path.join(raiz, "bench_fila"), "bench_fila", [(os.path.basename(p), p) for p in corpus["csv"]])
+                job = fila.pegar(os.getpid())
+                processar_job(fila, job, cache, casos, extratores)
+            e.extras["status"] = fila.job(job_id)["status"]
+
+    # 3. Consulta: busca híbrida, montagem do contexto e resposta em streaming
+    from nemesis_contexto import montar_contexto, contar_tokens
+    from langchain_ollama import ChatOllama
+    docs_por_pergunta = {}
+    if quer("busca"):
+        with bench.etapa("busca", "perguntas") as e:
+            for p in PERGUNTAS:
+                with e.operacao(): docs_por_pergunta[p] = buscar_hibrido(vectorstore, lexico, p, k=5)
+    if quer("contexto"):
+        with bench.etapa("contexto", "perguntas") as e:
+            for p in PERGUNTAS:
+                with e.operacao(): montar_contexto(p, docs_por_pergunta.get(p, []), "")
+    if quer("resposta"):
+        llm = ChatOllama(model="llama3.1", temperature=0.0)
+        primeiros = []
+        with bench.etapa("resposta", "perguntas") as e:
+            for p in PERGUNTAS:
+                ctx = montar_contexto(p, docs_por_pergunta.get(p) or buscar_hibrido(vectorstore, lexico, p, k=5), "")
+                mensagem = f"{ctx['historico']}\n\nPERGUNTA: {p}"
+                with e.operacao():
+                    inicio = time.perf_counter()
+                    for i, _ in enumerate(llm.stream(mensagem)):
+                        if i == 0: primeiros.append(time.perf_counter() - inicio)
+            e.extras["primeiro_token_p50_ms"] = _ms(percentil(primeiros, 50))
+            e.extras["primeiro_token_p95_ms"] = _ms(percentil(primeiros, 95))
+            e.extras["tokens_prompt_medio"] = round(sum(contar_tokens(f"{montar_contexto(p, docs_por_pergunta.get(p, []), '')['historico']}\n\nPERGUNTA: {p}")
+                                                        for p in PERGUNTAS) / len(PERGUNTAS))
+
+    casos.fechar_todos()
+    cache.fechar()
+    embeddings.fechar()
+
+# --- RELATÓRIO E COMPARAÇÃO ---
+def comparar(antes, depois, limite=0.10):
+    # Regressão = vazão caiu ou p95 subiu mais que 'limite' (10%)
+    regressoes = []
+    print(f"{'etapa':<28} {'vazão antes':>12} {'depois':>12} {'Δ':>8}   {'p95 antes':>10} {'depois':>10} {'Δ':>8}")
+    for nome, d in depois["etapas"].items():
+        a = antes["etapas"].get(nome)
+        if not a or "pulado" in a or "pulado" in d: continue
+        dv = (d["por_segundo"] / a["por_segundo"] - 1) if a.get("por_segundo") and d.get("por_segundo") is not None else None
+        dp = (d["p95_ms"] / a["p95_ms"] - 1) if a.get("p95_ms") and d.get("p95_ms") is not None else None
+        print(f"{nome:<28} {a.get('por_segundo') or 0:>12} {d.get('por_segundo') or 0:>12} {_pct(dv):>8}   "
+              f"{a.get('p95_ms') or 0:>10} {d.get('p95_ms') or 0:>10} {_pct(dp):>8}")
+        if (dv is not None and dv < -limite) or (dp is not None and dp > limite): regressoes.append(nome)
+    return regressoes
+
+def _pct(v):
+    return "-" if v is None else f"{v * 100:+.1f}%"
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ponta a ponta do Nemesis (corpus sintético + Ollama local de mentira)")
+    parser.add_argument("--saida", default="nemesis_bench.json", help="Relatório JSON")
+    parser.add_argument("--pasta", default=None, help="Onde gerar corpus e bancos (padrão: pasta temporária, apagada no fim)")
+    parser.add_argument("--semente", type=int, default=SEMENTE)
+    parser.add_argument("--tamanhos", default=",".join(map(str, TAMANHOS_PLANILHA)), help="Linhas das planilhas, separadas por vírgula")
+    parser.add_argument("--etapas", default=None, help="Só as etapas com estes prefixos (ex.: extracao,busca)")
+    parser.add_argument("--latencia-embed", type=float, default=0.02, help="Segundos por chamada de embedding")
+    parser.add_argument("--latencia-item", type=float, default=0.001, help="Segundos extras por texto no lote")
+    parser.add_argument("--primeiro-token", type=float, default=0.2, help="Segundos até o 1º token do chat")
+    parser.add_argument("--latencia-token", type=float, default=0.01, help="Segundos entre tokens do chat")
+    parser.add_argument("--sem-ocr", action="store_true")
+    parser.add_argument("--sem-audio", action="store_true")
+    parser.add_argument("--comparar", nargs=2, metavar=("ANTES", "DEPOIS"), help="Compara dois relatórios e sai com 1 se houver regressão")
+    parser.add_argument("--limite", type=float, default=0.10, help="Tolerância da comparação (0.10 = 10%%)")
+    args = parser.parse_args()
+
+    if args.comparar:
+        with open(args.comparar[0], encoding="utf-8") as f: antes = json.load(f)
+        with open(args.comparar[1], encoding="utf-8") as f: depois = json.load(f)
+        regressoes = comparar(antes, depois, args.limite)
+        if regressoes: print(f"\nRegressões: {', '.join(regressoes)}")
+        sys.exit(1 if regressoes else 0)
+
+    pasta = args.pasta or tempfile.mkdtemp(prefix="nemesis_bench_")
+    tamanhos = tuple(int(t) for t in args.tamanhos.split(",") if t)
+    stub = StubOllama(args.latencia_embed, args.latencia_item, args.primeiro_token, args.latencia_token)
+    stub.iniciar()
+    ocr = not args.sem_ocr and tem_tesseract()
+    audio = not args.sem_audio and tem_whisper()
+    bench = Benchmark()
+    try:
+        print(f"Gerando corpus em {pasta} (semente {args.semente})...", flush=True)
+        inicio = time.perf_counter()
+        corpus = gerar_corpus(os.path.join(pasta, "corpus"), args.semente, tamanhos=tamanhos)
+        print(f"  corpus pronto em {time.perf_counter() - inicio:.1f}s", flush=True)
+        estagios = args.etapas.split(",") if args.etapas else None
+        executar(pasta, bench, corpus, ocr, audio, estagios)
+    finally:
+        stub.parar()
+        if not args.pasta: shutil.rmtree(pasta, ignore_errors=True)
+
+    relatorio = {
+        "versao": VERSAO_RELATORIO,
+        "criado": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "maquina": {"python": platform.python_version(), "sistema": platform.platform(), "cpus": os.cpu_count()},
+        "config": {"semente": args.semente, "tamanhos_planilha": list(tamanhos), "paginas_pdf": PAGINAS_PDF,
+                   "latencia_embed": args.latencia_embed, "latencia_item": args.latencia_item,
+                   "primeiro_token": args.primeiro_token, "latencia_token": args.latencia_token, "ocr": ocr, "audio": audio},
+        "stub": stub.chamadas,
+        "etapas": bench.etapas,
+    }
+    with open(args.saida, "w", encoding="utf-8") as f: json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    print(f"Relatório: {args.saida}")
+
+if __name__ == "__main__":
+    main()
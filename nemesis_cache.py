@@ -0,0 +1,186 @@
+import os
+import re
+import json
+import unicodedata
+import sqlite3
+import hashlib
+import threading
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+# --- CACHE DE INGESTÃO (ENDEREÇADO POR CONTEÚDO) ---
+# Chave = SHA-256 dos bytes do arquivo. Guarda o texto extraído (OCR/Whisper/planilha)
+# em partes (páginas) e os IDs dos fragmentos gravados, para que um re-upload pule todo o pipeline.
+
+def hash_conteudo(dados):
+    return hashlib.sha256(dados).hexdigest()
+
+def hash_arquivo(caminho, bloco=1 << 20):
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for parte in iter(lambda: f.read(bloco), b""):
+            h.update(parte)
+    return h.hexdigest()
+
+def ids_fragmentos(hash_arq, qtd, inicio=0):
+    # IDs determinísticos: o mesmo arquivo sempre gera os mesmos IDs (upsert, sem duplicar)
+    return [f"{hash_arq}:{n}" for n in range(inicio, inicio + qtd)]
+
+class CacheIngestao:
+    def __init__(self, pasta):
+        os.makedirs(pasta, exist_ok=True)
+        self.caminho = os.path.join(pasta, "ingestao.sqlite")
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(self.caminho, check_same_thread=False)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        # Uma linha em 'arquivos' só existe quando a extração terminou (partes órfãs = extração interrompida)
+        self._con.execute("""CREATE TABLE IF NOT EXISTS arquivos (
+            hash TEXT PRIMARY KEY, nome TEXT, origem TEXT, texto TEXT,
+            chunk_ids TEXT, criado REAL)""")
+        self._con.execute("""CREATE TABLE IF NOT EXISTS partes (
+            hash TEXT, n INTEGER, texto TEXT, meta TEXT, PRIMARY KEY (hash, n))""")
+        try: self._con.execute("ALTER TABLE partes ADD COLUMN meta TEXT") # Bancos anteriores ao 'meta'
+        except sqlite3.OperationalError: pass
+        self._con.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def buscar(self, hash_arq):
+        with self._lock:
+            linha = self._con.execute(
+                "SELECT origem, chunk_ids FROM arquivos WHERE hash = ?", (hash_arq,)).fetchone()
+        if linha is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        origem, chunk_ids = linha
+        return {"origem": origem, "chunk_ids": json.loads(chunk_ids) if chunk_ids else []}
+
+    def partes(self, hash_arq, lote=32):
+        # Gera (texto, metadados ou None). Lê em páginas para não segurar um cursor aberto entre yields
+        with self._lock:
+            linha = self._con.execute("SELECT texto FROM arquivos WHERE hash = ?", (hash_arq,)).fetchone()
+        if linha and linha[0]:
+            yield linha[0], None # Entrada antiga: texto inteiro numa coluna só
+            return
+        n = 0
+        while True:
+            with self._lock:
+                linhas = self._con.execute(
+                    "SELECT n, texto, meta FROM partes WHERE hash = ? AND n >= ? ORDER BY n LIMIT ?",
+                    (hash_arq, n, lote)).fetchall()
+            if not linhas: return
+            for n, texto, meta in linhas: yield texto, (json.loads(meta) if meta else None)
+            n += 1
+
+    def iniciar(self, hash_arq):
+        with self._lock:
+            self._con.execute("DELETE FROM partes WHERE hash = ?", (hash_arq,))
+
+    def adicionar_parte(self, hash_arq, n, texto, meta=None):
+        with self._lock:
+            self._con.execute("INSERT OR REPLACE INTO partes (hash, n, texto, meta) VALUES (?, ?, ?, ?)",
+                              (hash_arq, n, texto, json.dumps(meta) if meta else None))
+
+    def concluir(self, hash_arq, nome, origem):
+        with self._lock:
+            self._con.execute(
+                "INSERT OR REPLACE INTO arquivos (hash, nome, origem, texto, chunk_ids, criado) VALUES (?, ?, ?, NULL, NULL, ?)",
+                (hash_arq, nome, origem, time.time()))
+            self._con.commit()
+
+    def descartar(self, hash_arq):
+        with self._lock:
+            self._con.execute("DELETE FROM partes WHERE hash = ?", (hash_arq,))
+            self._con.execute("DELETE FROM arquivos WHERE hash = ?", (hash_arq,))
+            self._con.commit()
+
+    def salvar_chunks(self, hash_arq, chunk_ids):
+        with self._lock:
+            self._con.execute("UPDATE arquivos SET chunk_ids = ? WHERE hash = ?", (json.dumps(chunk_ids), hash_arq))
+            self._con.commit()
+
+    def fechar(self):
+        with self._lock: self._con.close()
+
+    def estatisticas(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+def ja_indexado(vectorstore, chunk_ids):
+    # Confere no próprio banco: o caso pode ter sido apagado/renomeado desde a última ingestão
+    if not chunk_ids or vectorstore is None: return False
+    try:
+        achados = vectorstore.get(ids=chunk_ids, include=[])["ids"]
+        return len(achados) == len(chunk_ids)
+    except Exception:
+        return False
+
+# --- CACHE DE RESPOSTAS (POR CASO + VERSÃO DO CORPUS + PERGUNTA) ---
+LIMIAR_SIMILARIDADE = float(os.environ.get("NEMESIS_LIMIAR_RESPOSTA", 0.95))
+
+def normalizar_pergunta(pergunta):
+    texto = unicodedata.normalize("NFKD", pergunta.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", texto)).strip()
+
+def versao_corpus(vectorstore, lexico):
+    # Muda a cada gravação/remoção no caso (contador do índice léxico + total do Chroma)
+    try: total = vectorstore._collection.count()
+    except Exception: total = 0
+    return f"{lexico.versao() if lexico is not None else 0}:{total}"
+
+def _fontes_para_json(docs):
+    return json.dumps([{"id": d.id, "texto": d.page_content, "meta": d.metadata} for d in docs], ensure_ascii=False)
+
+def _fontes_de_json(dados):
+    return [Document(id=f.get("id"), page_content=f["texto"], metadata=f.get("meta") or {}) for f in json.loads(dados)]
+
+class CacheRespostas:
+    # respostas.sqlite na pasta do caso; conexão aberta só durante cada operação
+    def __init__(self, pasta_caso, limiar=LIMIAR_SIMILARIDADE):
+        self.caminho = os.path.join(pasta_caso, "respostas.sqlite")
+        self.limiar = limiar
+
+    def _conectar(self):
+        os.makedirs(os.path.dirname(self.caminho) or ".", exist_ok=True)
+        con = sqlite3.connect(self.caminho, timeout=30)
+        con.execute("""CREATE TABLE IF NOT EXISTS respostas (
+            versao TEXT, pergunta TEXT, vetor BLOB, resposta TEXT, fontes TEXT, criado REAL,
+            PRIMARY KEY (versao, pergunta))""")
+        return con
+
+    def buscar(self, versao, pergunta, embedding_fn=None):
+        # 1º igual (normalizada); 2º semelhante (cosseno >= limiar e mesmos números na pergunta)
+        chave = normalizar_pergunta(pergunta)
+        con = self._conectar()
+        try:
+            linha = con.execute("SELECT resposta, fontes FROM respostas WHERE versao = ? AND pergunta = ?", (versao, chave)).fetchone()
+            if linha: return {"resposta": linha[0], "fontes": _fontes_de_json(linha[1]), "tipo": "exato"}
+            if embedding_fn is None: return None
+            candidatas = con.execute("SELECT pergunta, vetor, resposta, fontes FROM respostas WHERE versao = ? AND vetor IS NOT NULL",
+                                     (versao,)).fetchall()
+        finally:
+            con.close()
+        numeros = set(re.findall(r"\d+", chave))
+        candidatas = [c for c in candidatas if set(re.findall(r"\d+", c[0])) == numeros]
+        if not candidatas: return None
+        q = np.asarray(embedding_fn(pergunta), dtype=np.float32)
+        matriz = np.stack([np.frombuffer(c[1], dtype=np.float32) for c in candidatas])
+        sims = matriz @ q / (np.linalg.norm(matriz, axis=1) * np.linalg.norm(q) + 1e-9)
+        melhor = int(np.argmax(sims))
+        if sims[melhor] < self.limiar: return None
+        return {"resposta": candidatas[melhor][2], "fontes": _fontes_de_json(candidatas[melhor][3]), "tipo": "semelhante"}
+
+    def salvar(self, versao, pergunta, resposta, fontes, embedding_fn=None):
+        vetor = np.asarray(embedding_fn(pergunta), dtype=np.float32).tobytes() if embedding_fn else None
+        con = self._conectar()
+        try:
+            with con:
+                con.execute("DELETE FROM respostas WHERE versao != ?", (versao,)) # Versões antigas não servem mais
+                con.execute("INSERT OR REPLACE INTO respostas VALUES (?, ?, ?, ?, ?, ?)",
+                            (versao, normalizar_pergunta(pergunta), vetor, resposta, _fontes_para_json(fontes), time.time()))
+        finally:
+            con.close()
@@ -0,0 +1,161 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+
+from nemesis_vetores import backend_do_caso
+
+# --- CONFIGURAÇÃO ---
+INTERVALO_FAXINA = 60 # Segundos entre tentativas de apagar casos da lixeira (arquivo preso no Windows)
+
+# --- CATÁLOGO DE CASOS (ÍNDICE EM MEMÓRIA + nemesis_config.json) ---
+# Um por processo, compartilhado por todas as sessões. A listagem da pasta e o config só são relidos
+# quando o mtime muda; o config é gravado inteiro num temporário e trocado com os.replace (nunca fica
+# pela metade), sempre sob a mesma trava. Casos excluídos vão para a lixeira e uma thread apaga as
+# pastas em segundo plano, fora da execução da página.
+class CatalogoCasos:
+    def __init__(self, raiz, nome_config="nemesis_config.json"):
+        self.raiz = os.path.abspath(raiz)
+        self.caminho = os.path.join(self.raiz, nome_config)
+        self._lock = threading.RLock()
+        self._config = None # (chave do stat, {"pinned": [...], "trash": [...]})
+        self._pastas = None # (mtime da raiz, [nomes])
+        self._bancos = {} # caso -> (mtime da pasta do caso, chroma | int8 | float16 | None)
+        self._acordar = threading.Event()
+        self._faxineiro = None
+        self.antes_de_apagar = None # Função(caso): fecha handles do caso antes do rmtree
+
+    # --- CONFIG ---
+    def _chave(self, caminho):
+        try:
+            st = os.stat(caminho)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError: return None
+
+    def config(self):
+        with self._lock:
+            chave = self._chave(self.caminho)
+            if self._config is None or self._config[0] != chave:
+                cfg = {}
+                if chave is not None:
+                    try:
+                        with open(self.caminho, 'r') as f: cfg = json.load(f)
+                    except (OSError, ValueError): cfg = {}
+                cfg = {"pinned": list(cfg.get("pinned", [])), "trash": list(cfg.get("trash", []))}
+                self._config = (chave, cfg, set(cfg["pinned"]), set(cfg["trash"]))
+            return self._config[1]
+
+    def _gravar(self, cfg):
+        os.makedirs(self.raiz, exist_ok=True)
+        fd, temporario = tempfile.mkstemp(prefix=".config_", suffix=".tmp", dir=self.raiz)
+        try:
+            with os.fdopen(fd, 'w') as f: json.dump(cfg, f)
+            os.replace(temporario, self.caminho)
+        except BaseException:
+            try: os.remove(temporario)
+            except OSError: pass
+            raise
+        self._config = (self._chave(self.caminho), cfg, set(cfg["pinned"]), set(cfg["trash"]))
+
+    def atualizar(self, funcao):
+        # Ler, alterar e gravar sob a trava: duas sessões mexendo ao mesmo tempo não perdem alterações
+        with self._lock:
+            cfg = {k: list(v) for k, v in self.config().items()}
+            funcao(cfg)
+            self._gravar(cfg)
+            return cfg
+
+    def fixado(self, caso):
+        with self._lock:
+            self.config()
+            return caso in self._config[2]
+
+    def na_lixeira(self, caso):
+        with self._lock:
+            self.config()
+            return caso in self._config[3]
+
+    # --- LISTAGEM ---
+    def _nomes(self):
+        with self._lock:
+            chave = self._chave(self.raiz)
+            if self._pastas is None or self._pastas[0] != chave:
+                nomes = []
+                if chave is not None:
+                    with os.scandir(self.raiz) as entradas:
+                        nomes = [e.name for e in entradas if e.is_dir() and not e.name.startswith(("_", "."))]
+                self._pastas = (chave, nomes)
+            return self._pastas[1]
+
+    def visiveis(self):
+        # Fixados primeiro, depois os demais, em ordem alfabética; lixeira fica de fora
+        with self._lock:
+            self.config()
+            _, _, fixados, lixeira = self._config
+            nomes = [n for n in self._nomes() if n not in lixeira]
+        return sorted(n for n in nomes if n in fixados) + sorted(n for n in nomes if n not in fixados)
+
+    def tipo_banco(self, caso):
+        # O banco é criado dentro da pasta do caso (muda o mtime dela): não precisa abrir nada a cada execução
+        pasta = os.path.join(self.raiz, caso)
+        chave = self._chave(pasta)
+        item = self._bancos.get(caso)
+        if item is None or item[0] != chave:
+            item = self._bancos[caso] = (chave, backend_do_caso(pasta) if chave else None)
+        return item[1]
+
+    # --- AÇÕES ---
+    def alternar_fixado(self, caso):
+        def alterar(cfg):
+            if caso in cfg["pinned"]: cfg["pinned"].remove(caso)
+            else: cfg["pinned"].append(caso)
+        return caso in self.atualizar(alterar)["pinned"]
+
+    def renomear(self, antigo, novo):
+        # Pasta renomeada e config atualizado sob a mesma trava
+        with self._lock:
+            os.rename(os.path.join(self.raiz, antigo), os.path.join(self.raiz, novo))
+            def alterar(cfg):
+                if antigo in cfg["pinned"]: cfg["pinned"] = [novo if c == antigo else c for c in cfg["pinned"]]
+            self.atualizar(alterar)
+
+    def excluir(self, caso):
+        # Some da lista na hora; a pasta é apagada pela faxina
+        def alterar(cfg):
+            if caso in cfg["pinned"]: cfg["pinned"].remove(caso)
+            if caso not in cfg["trash"]: cfg["trash"].append(caso)
+        self.atualizar(alterar)
+        self._acordar.set()
+
+    # --- FAXINA EM SEGUNDO PLANO ---
+    def reclamar(self, caso=None):
+        # Tenta apagar da lixeira (um caso ou todos); o que ainda está preso fica para a próxima
+        lixo = [caso] if caso else list(self.config()["trash"])
+        apagados = []
+        for nome in lixo:
+            caminho = os.path.join(self.raiz, nome)
+            try:
+                if self.antes_de_apagar and self.antes_de_apagar(nome) is False: continue # Consulta ainda aberta: próxima faxina
+                if os.path.exists(caminho): shutil.rmtree(caminho)
+                apagados.append(nome)
+            except Exception: pass
+        if apagados:
+            self.atualizar(lambda cfg: cfg.__setitem__("trash", [c for c in cfg["trash"] if c not in apagados]))
+        return apagados
+
+    def _rodar_faxina(self, intervalo):
+        while True:
+            self._acordar.wait(intervalo)
+            self._acordar.clear()
+            try:
+                if self.config()["trash"]: self.reclamar()
+            except Exception: pass
+
+    def iniciar_faxina(self, intervalo=INTERVALO_FAXINA):
+        with self._lock:
+            if self._faxineiro is None:
+                self._faxineiro = threading.Thread(target=self._rodar_faxina, args=(intervalo,), daemon=True, name="nemesis-faxina")
+                self._faxineiro.start()
+                self._acordar.set() # Primeira passada logo na partida
+        return self
@@ -0,0 +1,164 @@
+import os
+import re
+import math
+from collections import Counter
+
+from nemesis_lexico import tokenizar
+
+# --- CONFIGURAÇÃO ---
+ORCAMENTO_TOKENS = int(os.environ.get("NEMESIS_ORCAMENTO_TOKENS", 3000)) # Só os dados; prompt fixo e pergunta à parte
+FRACAO_IMEDIATA = 0.5 # Parte do orçamento reservada à memória imediata (sobra vai para o histórico e vice-versa)
+TAMANHO_BLOCO = 800 # Caracteres por bloco da memória imediata
+SOBREPOSICAO_MAX = 600 # Maior sobreposição procurada entre fragmentos vizinhos (splitter usa 200)
+LIMIAR_DUPLICADO = 0.8 # Fração de shingles já vistos para considerar o trecho repetido
+TAMANHO_SHINGLE = 8
+
+# --- CONTAGEM DE TOKENS ---
+# tiktoken (cl100k) fica perto do BPE do llama3; sem ele (ou sem o arquivo de vocabulário, offline)
+# usa uma estimativa por palavras.
+_codificador = None
+
+def _get_codificador():
+    global _codificador
+    if _codificador is None:
+        try:
+            import tiktoken
+            _codificador = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _codificador = False
+    return _codificador
+
+RE_PECA = re.compile(r"\w+|[^\w\s]")
+
+def contar_tokens(texto):
+    if not texto: return 0
+    cod = _get_codificador()
+    if cod: return len(cod.encode(texto, disallowed_special=()))
+    return sum(1 + len(p) // 5 for p in RE_PECA.findall(texto))
+
+def cortar_tokens(texto, limite):
+    if contar_tokens(texto) <= limite: return texto
+    cod = _get_codificador()
+    if cod: return cod.decode(cod.encode(texto, disallowed_special=())[:limite])
+    return texto[: limite * 3]
+
+# --- DUPLICATAS E SOBREPOSIÇÕES ---
+def _shingles(texto):
+    palavras = texto.lower().split()
+    if len(palavras) < TAMANHO_SHINGLE: return {" ".join(palavras)} if palavras else set()
+    return {" ".join(palavras[i : i + TAMANHO_SHINGLE]) for i in range(len(palavras) - TAMANHO_SHINGLE + 1)}
+
+def remover_sobreposicao(anterior, atual, maximo=SOBREPOSICAO_MAX):
+    # Tira do início de 'atual' o trecho que repete o final de 'anterior' (overlap do splitter)
+    for k in range(min(maximo, len(anterior), len(atual)), 20, -1):
+        if anterior.endswith(atual[:k]): return atual[k:].lstrip()
+    return atual
+
+class Deduplicador:
+    def __init__(self, limiar=LIMIAR_DUPLICADO):
+        self.limiar = limiar
+        self.vistos = set()
+        self.ultimo = {} # hash do arquivo -> (n, texto) do último fragmento aceito
+
+    def filtrar(self, texto, doc_id=None):
+        # Retorna o texto sem a parte repetida, ou None se for quase todo repetido
+        if doc_id and ":" in doc_id:
+            h, n = doc_id.rsplit(":", 1)
+            anterior = self.ultimo.get(h)
+            if anterior and n.isdigit() and abs(int(n) - anterior[0]) == 1:
+                texto = remover_sobreposicao(anterior[1], texto) if int(n) > anterior[0] else texto
+        sh = _shingles(texto)
+        if not sh: return None
+        if len(sh & self.vistos) / len(sh) >= self.limiar: return None
+        self.vistos |= sh
+        if doc_id and ":" in doc_id:
+            h, n = doc_id.rsplit(":", 1)
+            if n.isdigit(): self.ultimo[h] = (int(n), texto)
+        return texto
+
+# --- MEMÓRIA IMEDIATA: BLOCOS MAIS RELEVANTES ---
+def _blocos(texto, tamanho=TAMANHO_BLOCO):
+    # Quebra em parágrafos e junta até ~tamanho; parágrafo gigante é fatiado
+    blocos, atual = [], ""
+    for par in re.split(r"\n\s*\n", texto):
+        while len(par) > tamanho:
+            corte = par.rfind(" ", 0, tamanho)
+            corte = corte if corte > tamanho // 2 else tamanho
+            if atual: blocos.append(atual); atual = ""
+            blocos.append(par[:corte]); par = par[corte:].lstrip()
+        if atual and len(atual) + len(par) > tamanho:
+            blocos.append(atual); atual = ""
+        atual = f"{atual}\n\n{par}" if atual else par
+    if atual.strip(): blocos.append(atual)
+    return [b for b in blocos if b.strip()]
+
+def _pontuar(blocos, pergunta):
+    # BM25 em memória sobre os blocos da sessão
+    termos = set(tokenizar(pergunta))
+    docs = [Counter(tokenizar(b)) for b in blocos]
+    if not termos or not docs: return [0.0] * len(blocos)
+    media = sum(sum(d.values()) for d in docs) / len(docs) or 1
+    df = Counter(t for d in docs for t in termos if t in d)
+    n = len(docs)
+    pontos = []
+    for d in docs:
+        tam = sum(d.values())
+        p = 0.0
+        for t in termos:
+            tf = d.get(t, 0)
+            if tf:
+                idf = math.log(1 + (n - df[t] + 0.5) / (df[t] + 0.5))
+                p += idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * tam / media))
+        pontos.append(p)
+    return pontos
+
+def selecionar_imediata(pergunta, imediato, orcamento, dedup=None):
+    if not imediato or orcamento <= 0: return "", 0
+    if contar_tokens(imediato) <= orcamento and dedup is None: return imediato, contar_tokens(imediato)
+    blocos = _blocos(imediato)
+    pontos = _pontuar(blocos, pergunta)
+    escolhidos, usados = [], 0
+    # Mais relevantes primeiro; empate (pergunta genérica) favorece o começo do documento
+    for i in sorted(range(len(blocos)), key=lambda i: (-pontos[i], i)):
+        texto = dedup.filtrar(blocos[i]) if dedup else blocos[i]
+        if not texto: continue
+        t = contar_tokens(texto)
+        if usados + t > orcamento: continue
+        escolhidos.append((i, texto)); usados += t
+    escolhidos.sort()
+    return "\n[...]\n".join(t for _, t in escolhidos), usados
+
+# --- MONTAGEM ---
+def montar_contexto(pergunta, docs, imediato="", calculos="", orcamento=ORCAMENTO_TOKENS, rotulo=None):
+    # Cálculos exatos entram sempre; fragmentos recuperados (na ordem do ranking) e memória imediata
+    # dividem o resto. A parte que um dos lados não usa fica para o outro.
+    # rotulo(doc) -> texto: cabeçalho de cada fragmento (ex.: caso de origem na busca em todos os casos)
+    t_calc = contar_tokens(calculos)
+    if t_calc > orcamento // 2:
+        calculos = cortar_tokens(calculos, orcamento // 2); t_calc = orcamento // 2
+    livre = orcamento - t_calc
+    cota_imediata = int(livre * FRACAO_IMEDIATA) if imediato else 0
+    if imediato and not docs: cota_imediata = livre
+    dedup = Deduplicador()
+
+    fontes, partes, usados, descartados = [], [], 0, 0
+    limite_hist = livre - min(cota_imediata, contar_tokens(imediato))
+    for d in docs:
+        texto = dedup.filtrar(d.page_content, getattr(d, "id", None))
+        if not texto:
+            descartados += 1; continue
+        if rotulo: texto = f"[{rotulo(d)}]\n{texto}"
+        t = contar_tokens(texto)
+        if usados + t > limite_hist:
+            descartados += 1; continue
+        partes.append(texto); fontes.append(d); usados += t
+
+    texto_imediato, t_imediato = selecionar_imediata(pergunta, imediato, livre - usados, dedup if docs else None)
+    return {
+        "imediato": texto_imediato,
+        "historico": "\n\n".join(partes),
+        "calculos": calculos,
+        "fontes": fontes,
+        "descartados": descartados,
+        "tokens": t_calc + usados + t_imediato,
+    }
@@ -1,40 +1,65 @@
+import time
+INICIO_PROCESSO = time.perf_counter() # Antes dos outros imports: o relatório de partida mede tudo
 import os
 import sys
-import time
 import shutil
+import json
 import warnings
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # --- DESATIVA AVISOS CHATOS ---
 warnings.filterwarnings("ignore")
 
 # --- BIBLIOTECAS DE IA E DADOS ---
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma 
-from langchain_ollama import OllamaEmbeddings, ChatOllama
+# Ollama, Chroma, pandas, OCR e Whisper só carregam quando usados (workers de ingestão ou 1ª consulta)
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.documents import Document
 
-# --- BIBLIOTECAS DE VISÃO E ÁUDIO ---
-import pytesseract
-from PIL import Image, ImageOps
-import fitz  # PyMuPDF
-import pandas as pd
-import whisper
-import numpy as np
+from nemesis_cache import CacheRespostas, versao_corpus
+from nemesis_embeddings import criar_embeddings, MODELO_EMBEDDING
+from nemesis_modelos import GerenciadorModelos, KEEP_ALIVE, descrever as descrever_modelos
+from nemesis_store import GerenciadorCasos, ESPERA_FECHAR
+from nemesis_fila import FilaIngestao, garantir_workers, parar_workers
+from nemesis_lexico import IndiceLexico, buscar_hibrido
+from nemesis_contexto import montar_contexto, contar_tokens
+from nemesis_planilhas import CatalogoTabelas, calcular_respostas
+from nemesis_vetores import BancoPlano, BACKEND_PADRAO, backend_do_caso, garantir_backend, migrar_de_chroma
+from nemesis_multicaso import buscar_em_casos, casos_indexados
+from nemesis_sync import EstadoSync, ObservadorPasta, sincronizar, TEM_WATCHDOG
+from nemesis_telemetria import configurar, etapa, no_contexto, acumular, ultimo, exportar, relatorio_inicio, ultimo_inicio, BACKENDS_PESADOS
 
 # --- CONFIGURAÇÃO ---
 NOME_MODELO = "llama3.1"
 PASTA_MEMORIA = "./memoria_nemesis_terminal"
 CAMINHO_TESSERACT = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+PASTA_TABELAS = os.path.join(PASTA_MEMORIA, "_cache", "tabelas")
+PASTA_CASOS = "./banco_de_dados_nemesis" # Casos do app, pesquisados junto com a memória do terminal na opção 7
+BACKEND_VETORIAL = BACKEND_PADRAO # Memória nova: "chroma", "int8" ou "float16" (memória existente mantém o que tem)
 
 # Configura OCR
 if os.path.exists(CAMINHO_TESSERACT):
-    pytesseract.pytesseract.tesseract_cmd = CAMINHO_TESSERACT
-    TEM_OCR = True
+    TEM_OCR = True # O caminho vai para os workers; pytesseract não é importado aqui
 else:
     TEM_OCR = False
     print("⚠️ AVISO: Tesseract não encontrado. OCR desativado.")
 
+_embeddings = None
+_casos = None
+_ultima_ingestao = None # Quebra por etapa que o worker gravou no job
+COLECAO = "nemesis_terminal"
+
+def get_embeddings():
+    # Embeddings com cache em disco, compartilhados entre aprender e consultar
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = criar_embeddings(os.path.join(PASTA_MEMORIA, "_cache"))
+    return _embeddings
+
+def get_casos():
+    global _casos
+    if _casos is None: _casos = GerenciadorCasos(get_embeddings())
+    return _casos
+
 # --- FERRAMENTAS VISUAIS (BARRINHAS DE PROGRESSO FALSAS) ---
 def print_status(msg):
     print(f"\033[94m[INFO]\033[0m {msg}")
@@ -45,110 +70,151 @@ def print_sucesso(msg):
 def print_erro(msg):
     print(f"\033[91m[ERRO]\033[0m {msg}")
 
-# --- FUNÇÕES DE LEITURA (OCR, AUDIO, EXCEL) ---
-def ler_arquivo_multimidia(caminho):
-    ext = caminho.split('.')[-1].lower()
-    print_status(f"Processando arquivo tipo: .{ext}")
-    
-    texto = ""
-    
-    try:
-        # 1. IMAGEM
-        if ext in ['jpg', 'png', 'jpeg']:
-            if not TEM_OCR: return "Erro: OCR não instalado."
-            img = Image.open(caminho)
-            if np.mean(np.array(img.convert("L"))) < 127: 
-                img = ImageOps.invert(img.convert("L"))
-            texto = pytesseract.image_to_string(img, lang='por+eng')
-            
-        # 2. PDF (HÍBRIDO)
-        elif ext == 'pdf':
-            doc = fitz.open(caminho)
-            for pag in doc:
-                t = pag.get_text()
-                if len(t) < 5 and TEM_OCR: # Se vazio, OCR
-                    pix = pag.get_pixmap()
-                    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                    t = pytesseract.image_to_string(img, lang='por+eng')
-                texto += t + "\n"
-            doc.close()
-            
-        # 3. ÁUDIO (WHISPER)
-        elif ext in ['wav', 'mp3']:
-            print_status("Carregando modelo auditivo (Whisper)...")
-            model = whisper.load_model("base")
-            result = model.transcribe(caminho)
-            texto = result["text"]
-            
-        # 4. EXCEL
-        elif ext in ['xlsx', 'csv']:
-            if ext == 'csv': df = pd.read_csv(caminho)
-            else: df = pd.read_excel(caminho)
-            texto = df.to_markdown(index=False)
-            
-        return texto
-        
-    except Exception as e:
-        print_erro(f"Falha ao ler: {e}")
-        return None
+def print_rastro(titulo, resumo):
+    if not resumo: return
+    print_status(f"{titulo}: {resumo['total_s']:.2f}s")
+    total = resumo["total_s"] or 1
+    for e in resumo["etapas"]:
+        print(f"   {e['etapa']:<24} {e['segundos']:>8.3f}s  x{e['n']:<4} {100 * e['segundos'] / total:>4.0f}%")
 
 # --- CÉREBRO (MEMÓRIA) ---
+ETAPAS = {"na_fila": "Na fila", "extraindo": "Extraindo", "gravando": "Gravando", "concluido": "Concluído"}
+
+def acompanhar_job(fila, job_id):
+    # Sobe os workers e mostra o progresso até o job terminar
+    garantir_workers(PASTA_MEMORIA, tesseract_cmd=CAMINHO_TESSERACT if TEM_OCR else None, ocr=TEM_OCR)
+    while True:
+        job = fila.job(job_id)
+        if job["status"] in ("concluido", "erro"): break
+        atual = next((a for a in job["arquivos"] if a["etapa"] != "concluido"), None)
+        if atual is None: msg = "Removendo fragmentos antigos..." if job["remover"] else "Finalizando..."
+        else:
+            msg = f"{ETAPAS.get(atual['etapa'], atual['etapa'])}... {int((atual['fracao'] or 0) * 100)}%"
+            if len(job["arquivos"]) > 1: msg = f"[{atual['n'] + 1}/{len(job['arquivos'])}] {atual['nome']}: {msg}"
+        print(f"\r\033[94m[INFO]\033[0m {msg}   ", end="", flush=True)
+        time.sleep(0.5)
+    print()
+    if _casos is not None: _casos.fechar(PASTA_MEMORIA) # Reabre com os vetores gravados pelo worker
+    global _ultima_ingestao
+    if job.get("etapas"): _ultima_ingestao = job["etapas"]
+    return job
+
 def aprender_arquivo(caminho_arquivo):
     if not os.path.exists(caminho_arquivo):
         print_erro("Arquivo não encontrado!")
         return
 
-    # 1. Extração
-    conteudo = ler_arquivo_multimidia(caminho_arquivo)
-    if not conteudo or len(conteudo.strip()) < 5:
-        print_erro("Arquivo vazio ou ilegível.")
+    ext = caminho_arquivo.split('.')[-1].lower()
+    print_status(f"Processando arquivo tipo: .{ext}")
+
+    # Mesma fila e mesmos workers do app: OCR/Whisper/embeddings fora deste processo
+    fila = FilaIngestao(PASTA_MEMORIA)
+    job_id = fila.enviar("terminal", PASTA_MEMORIA, COLECAO, [(os.path.basename(caminho_arquivo), caminho_arquivo)])
+    job = acompanhar_job(fila, job_id)
+
+    if job["status"] == "erro":
+        print_erro(f"Falha ao gravar: {job['erro']}")
         return
+    r = job["arquivos"][0]
+    escrita = job["escrita"]
 
-    # 2. Criação do Documento
-    doc = Document(
-        page_content=f"--- FONTE: {os.path.basename(caminho_arquivo)} ---\n{conteudo}",
-        metadata={"source": caminho_arquivo}
-    )
+    if r["status"] == "erro":
+        print_erro(f"Falha ao ler: {r['erro']}")
+        return
+    if r["status"] == "vazio":
+        print_erro("Arquivo vazio ou ilegível.")
+        return
+    if r["status"] == "novo":
+        print_status(f"Cache MISS ({r['hash'][:12]}): conteúdo extraído.")
+    else:
+        print_status(f"♻️ Cache HIT ({r['hash'][:12]}): extração reaproveitada.")
+    if r["status"] == "ja_indexado":
+        print_sucesso(f"Arquivo já aprendido ({r['fragmentos']} fragmentos). Nada a gravar.")
+        return
+    print_status(f"Gravados {r['fragmentos']} fragmentos de memória "
+                 f"({escrita.get('fragmentos_por_segundo', 0)} frag/s, lote final {escrita.get('lote_atual', '-')}).")
+    print_sucesso(f"Aprendizado concluído! (job {job_id} em {job['concluido'] - job['criado']:.1f}s)")
 
-    # 3. Chunking (Fatiamento)
-    splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=200)
-    chunks = splitter.split_documents([doc])
-    
-    print_status(f"Gerados {len(chunks)} fragmentos de memória.")
-
-    # 4. Gravação no Banco (Com Batch Size Fix)
-    vectorstore = Chroma(
-        collection_name="nemesis_terminal",
-        embedding_function=OllamaEmbeddings(model="all-minilm"),
-        persist_directory=PASTA_MEMORIA
-    )
-    
-    # Grava em lotes de 4000 para não travar
-    BATCH_SIZE = 4000
-    for i in range(0, len(chunks), BATCH_SIZE):
-        lote = chunks[i : i + BATCH_SIZE]
-        vectorstore.add_documents(lote)
-        print_status(f"Gravando lote {i} a {i+len(lote)}...")
-    
-    print_sucesso("Aprendizado concluído!")
+def sincronizar_pasta(origem):
+    # Só o que mudou desde a última sincronização vai para a fila (estado em sync.sqlite)
+    fila = FilaIngestao(PASTA_MEMORIA)
+    try: resumo = sincronizar(origem, PASTA_MEMORIA, "terminal", COLECAO, fila)
+    except FileNotFoundError as e:
+        print_erro(str(e))
+        return None
+    print_status(f"{resumo['novos']} novo(s), {resumo['alterados']} alterado(s), {resumo['removidos']} removido(s), "
+                 f"{resumo['inalterados']} inalterado(s)" + (f", {resumo['em_andamento']} ainda na fila" if resumo["em_andamento"] else ""))
+    if resumo["job"] is None:
+        print_sucesso("Pasta já sincronizada.")
+        return resumo
+    job = acompanhar_job(fila, resumo["job"])
+    if job["status"] == "erro":
+        print_erro(f"Falha na sincronização: {job['erro']}")
+        return resumo
+    falhas = [a for a in job["arquivos"] if a["status"] == "erro"]
+    for a in falhas: print_erro(f"{a['nome']}: {a['erro']}")
+    print_sucesso(f"Sincronizado: {sum(a['fragmentos'] or 0 for a in job['arquivos'] if a['status'] in ('novo', 'cache'))} fragmento(s) gravado(s), "
+                  f"{job['escrita'].get('removidos', 0)} removido(s) (job {job['id']} em {job['concluido'] - job['criado']:.1f}s).")
+    return resumo
 
 # --- MENTE (CONSULTA) ---
-def consultar_nemesis(pergunta):
-    # Carrega Banco
-    vectorstore = Chroma(
-        collection_name="nemesis_terminal",
-        embedding_function=OllamaEmbeddings(model="all-minilm"),
-        persist_directory=PASTA_MEMORIA
-    )
-    
-    # Recupera Contexto
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
-    docs = retriever.invoke(pergunta)
+def consultar_nemesis(pergunta, todos_os_casos=False, ao_token=None):
+    # ao_token(texto): chamado a cada pedaço da resposta do LLM, conforme chega (cache e avisos não passam por ele)
+    with etapa("resposta", caso="*" if todos_os_casos else "terminal"):
+        return _consultar_todos(pergunta, ao_token) if todos_os_casos else _consultar(pergunta, ao_token)
+
+def _consultar_todos(pergunta, ao_token=None):
+    # Memória do terminal + casos do app, em paralelo; cada fragmento sai com o caso de origem
+    entradas = casos_indexados(PASTA_CASOS)
+    if backend_do_caso(PASTA_MEMORIA): entradas.append(("terminal", PASTA_MEMORIA, COLECAO))
+    if not entradas: return "⚠️ Nenhum caso indexado."
+    with etapa("busca.multicaso"): r = buscar_em_casos(get_casos(), entradas, pergunta, get_embeddings(), k=8)
+    print_status(f"🌐 {r['responderam']}/{r['consultados']} casos em {r['segundos']:.2f}s"
+                 + (f" | sem resposta a tempo: {', '.join(r['atrasados'])}" if r["atrasados"] else ""))
+    for caso, erro in r["erros"].items(): print_erro(f"{caso}: {erro}")
+    for i, d in enumerate(r["docs"], 1):
+        trecho = " ".join(d.page_content.split())[:90]
+        print(f"   {i}. [{', '.join(d.metadata['casos'])}] {d.metadata.get('source_name', '')}: {trecho}...")
+    if not r["docs"]: return "⚠️ Nada encontrado nos casos."
+    rotulo = lambda d: f"Caso {', '.join(d.metadata['casos'])} · {d.metadata.get('source_name', '')}"
+    with etapa("contexto.montagem"): ctx = montar_contexto(pergunta, r["docs"], rotulo=rotulo)
+    return _responder(pergunta, ctx, instrucao_extra="4. Cada trecho vem de um caso (entre colchetes); diga em qual caso está cada informação.",
+                      ao_token=ao_token)
+
+def _consultar(pergunta, ao_token=None):
+    lexico = IndiceLexico(PASTA_MEMORIA)
+    respostas = CacheRespostas(PASTA_MEMORIA)
+
+    # Carrega Banco (reaproveita o handle aberto, preso no pool até a busca terminar)
+    with get_casos().usar(PASTA_MEMORIA, COLECAO, backend=BACKEND_VETORIAL) as vectorstore:
+        # Cache de respostas: invalidado sozinho quando algo novo é aprendido (versão do corpus)
+        versao = versao_corpus(vectorstore, lexico)
+        with etapa("cache_respostas.busca"): achado = respostas.buscar(versao, pergunta, get_embeddings().embed_query)
+        if achado:
+            print(f"\n♻️  Resposta em cache ({achado['tipo']})")
+            return achado["resposta"]
+
+        # Recupera Contexto (BM25 + vetorial; identificador exato dispensa o embedding)
+        with etapa("busca.hibrida"): docs = buscar_hibrido(vectorstore, lexico, pergunta, k=5)
     
-    if not docs:
+    # Somas/médias/top-N/contagens saem do pandas, não da IA somando texto de tabela
+    try:
+        with etapa("calculos.pandas"): calculos = calcular_respostas(pergunta, PASTA_TABELAS, CatalogoTabelas(PASTA_MEMORIA))
+    except Exception: calculos = ""
+
+    if not docs and not calculos:
         return "⚠️ Não tenho memórias sobre isso. Me ensine algo primeiro."
 
-    contexto = "\n\n".join([d.page_content for d in docs])
+    # Cabe no orçamento de tokens, sem os trechos repetidos pela sobreposição dos fragmentos
+    with etapa("contexto.montagem"): ctx = montar_contexto(pergunta, docs, calculos=calculos)
+    texto = _responder(pergunta, ctx, ao_token=ao_token)
+    with etapa("cache_respostas.salvar"): respostas.salvar(versao, pergunta, texto, ctx["fontes"], get_embeddings().embed_query)
+    return texto
+
+def _gerar(pergunta, ctx, instrucao_extra="", ao_token=None):
+    # Uma geração no Ollama em streaming (1º token medido); devolve (texto, tempos)
+    contexto = ctx["historico"]
+    if ctx["calculos"]: contexto += f"\n\nCÁLCULOS EXATOS (PANDAS):\n{ctx['calculos']}"
     
     # Prompt Blindado
     sistema = """
@@ -159,29 +225,196 @@ def consultar_nemesis(pergunta):
     {context}
     
     INSTRUÇÕES:
-    1. Se for tabela, analise os números.
+    1. Se for tabela, analise os números. Para somas, médias e rankings use os CÁLCULOS EXATOS.
     2. Se for transcrição de áudio ou imagem, trate como texto normal.
     3. Seja direto e técnico.
-    """
+    """ + (f"    {instrucao_extra}\n" if instrucao_extra else "")
     
     prompt = ChatPromptTemplate.from_template(sistema + "\nPERGUNTA: {question}")
-    llm = ChatOllama(model=NOME_MODELO, temperature=0.0)
+    from langchain_ollama import ChatOllama
+    llm = ChatOllama(model=NOME_MODELO, temperature=0.0, keep_alive=KEEP_ALIVE)
     chain = prompt | llm
     
+    tokens_prompt = contar_tokens(prompt.format(context=contexto, question=pergunta))
+    partes, primeiro = [], None
+    inicio = time.perf_counter()
+    for chunk in chain.stream({"context": contexto, "question": pergunta}):
+        if primeiro is None:
+            primeiro = time.perf_counter() - inicio
+            acumular("llm.primeiro_token", primeiro)
+        tokens_prompt = (chunk.response_metadata or {}).get("prompt_eval_count") or tokens_prompt
+        partes.append(chunk.content)
+        if ao_token and chunk.content: ao_token(chunk.content)
+    total = time.perf_counter() - inicio
+    acumular("llm.geracao", total - (primeiro or 0))
+    return "".join(partes), {"tokens_prompt": tokens_prompt, "primeiro_token": round(primeiro or 0, 3), "llm": round(total, 3)}
+
+def _responder(pergunta, ctx, instrucao_extra="", ao_token=None):
     print("\n⚖️  Pensando...", end="", flush=True)
-    resposta = chain.invoke({"context": contexto, "question": pergunta})
-    return resposta.content
+    texto, tempos = _gerar(pergunta, ctx, instrucao_extra, ao_token)
+    print(f"\n📏 Prompt: {tempos['tokens_prompt']} tokens (dados: {ctx['tokens']}) | ⏱️ 1º token: {tempos['primeiro_token']:.1f}s | total: {tempos['llm']:.1f}s")
+    return texto
+
+def mostrar_resposta(pergunta, todos_os_casos=False):
+    # Tokens na tela conforme chegam do Ollama; resposta do cache e avisos saem inteiros
+    linha = "-"*50
+    transmitidos = []
+    def escrever(texto):
+        if not transmitidos: print("\n" + linha)
+        transmitidos.append(texto)
+        print(texto, end="", flush=True)
+    resp = consultar_nemesis(pergunta, todos_os_casos, ao_token=escrever)
+    if not transmitidos: print("\n" + linha + "\n" + resp)
+    print("\n" + linha)
+    return resp
+
+# --- LOTE DE PERGUNTAS (SEM MENU) ---
+# python nemesis_core.py --lote perguntas.txt --saida respostas.jsonl [--caso ./banco_de_dados_nemesis/Silva]
+# 1. Todas as perguntas embedadas num lote só; 2. busca + contexto de todas; 3. geração no Ollama com
+# CONCORRENCIA_LOTE perguntas ao mesmo tempo (o servidor precisa de OLLAMA_NUM_PARALLEL >= esse valor
+# para gerar de fato em paralelo). Cada resposta vai para o JSONL assim que termina.
+CONCORRENCIA_LOTE = int(os.environ.get("NEMESIS_CONCORRENCIA_LOTE", 2))
+
+def ler_perguntas(caminho):
+    # .txt: uma pergunta por linha (# comenta). .jsonl: {"id": ..., "pergunta": ...}
+    perguntas = []
+    with open(caminho, "r", encoding="utf-8") as f:
+        for n, linha in enumerate(f, 1):
+            linha = linha.strip()
+            if not linha or linha.startswith("#"): continue
+            if caminho.lower().endswith(".jsonl"):
+                item = json.loads(linha)
+                perguntas.append((str(item.get("id", n)), item["pergunta"]))
+            else: perguntas.append((str(n), linha))
+    return perguntas
+
+def _ja_respondidas(saida):
+    # Para --retomar: ids que já saíram sem erro
+    feitas = set()
+    if not os.path.exists(saida): return feitas
+    with open(saida, "r", encoding="utf-8") as f:
+        for linha in f:
+            try: item = json.loads(linha)
+            except ValueError: continue # Última linha cortada (processo interrompido)
+            if not item.get("erro"): feitas.add(item["id"])
+    return feitas
+
+def responder_lote(caminho_perguntas, saida, pasta=PASTA_MEMORIA, colecao=None, concorrencia=CONCORRENCIA_LOTE, retomar=False, k=5):
+    terminal = os.path.abspath(pasta) == os.path.abspath(PASTA_MEMORIA)
+    colecao = colecao or (COLECAO if terminal else os.path.basename(os.path.abspath(pasta)))
+    tabelas = PASTA_TABELAS if terminal else os.path.join(os.path.dirname(os.path.abspath(pasta)), "_cache", "tabelas")
+    if backend_do_caso(pasta) is None: raise FileNotFoundError(f"Nenhum banco indexado em {pasta}")
+    perguntas = ler_perguntas(caminho_perguntas)
+    feitas = _ja_respondidas(saida) if retomar else set()
+    perguntas = [(i, p) for i, p in perguntas if i not in feitas]
+    resumo = {"perguntas": len(perguntas), "puladas": len(feitas), "respondidas": 0, "cache": 0, "erros": 0}
+    if not perguntas: return resumo
+
+    t0 = time.perf_counter()
+    lexico = IndiceLexico(pasta)
+    respostas = CacheRespostas(pasta)
+    catalogo = CatalogoTabelas(pasta)
+
+    # 1. Embeddings de todas as perguntas numa chamada (o que já está no cache nem vai ao Ollama)
+    with etapa("lote.embeddings", itens=len(perguntas)):
+        inicio = time.perf_counter()
+        vetores = get_embeddings().embed_documents([p for _, p in perguntas])
+        tempo_embedding = (time.perf_counter() - inicio) / len(perguntas)
+    print_status(f"{len(perguntas)} pergunta(s) embedada(s) em {tempo_embedding * len(perguntas):.2f}s")
+
+    # Handle preso no pool durante todo o lote: nada o fecha entre uma busca e outra
+    with open(saida, "a" if retomar else "w", encoding="utf-8") as arquivo, get_casos().usar(pasta, colecao) as vectorstore:
+        versao = versao_corpus(vectorstore, lexico)
+        def gravar(item):
+            arquivo.write(json.dumps(item, ensure_ascii=False) + "\n")
+            arquivo.flush() # Interrompido no meio, o que já saiu fica
+            resumo["erros"] += bool(item.get("erro"))
+            resumo["respondidas"] += 1
+            print_status(f"[{resumo['respondidas']}/{resumo['perguntas']}] {item['id']}: "
+                         + (f"erro: {item['erro']}" if item.get("erro") else f"{item['tempos']['total']:.1f}s"))
+
+        # 2. Busca e contexto de todas (rápido, sem LLM); cache de respostas primeiro
+        pendentes = []
+        for (id_, pergunta), vetor in zip(perguntas, vetores):
+            inicio = time.perf_counter()
+            item = {"id": id_, "pergunta": pergunta}
+            try:
+                achado = respostas.buscar(versao, pergunta, lambda _: vetor)
+                if achado:
+                    resumo["cache"] += 1
+                    gravar({**item, "resposta": achado["resposta"], "fontes": [d.metadata.get("source_name") for d in achado["fontes"]],
+                            "cache": achado["tipo"], "tempos": {"embedding": round(tempo_embedding, 3), "total": round(time.perf_counter() - inicio, 3)}})
+                    continue
+                with etapa("busca.hibrida"): docs = buscar_hibrido(vectorstore, lexico, pergunta, k=k, vetor=vetor)
+                try:
+                    with etapa("calculos.pandas"): calculos = calcular_respostas(pergunta, tabelas, catalogo)
+                except Exception: calculos = ""
+                with etapa("contexto.montagem"): ctx = montar_contexto(pergunta, docs, calculos=calculos) if docs or calculos else None
+            except Exception as e:
+                gravar({**item, "erro": str(e), "tempos": {"total": round(time.perf_counter() - inicio, 3)}})
+                continue
+            pendentes.append((item, vetor, ctx, {"embedding": round(tempo_embedding, 3), "busca": round(time.perf_counter() - inicio, 3)}))
+
+        # 3. Geração concorrente; grava na ordem em que terminam
+        def gerar(item, ctx):
+            if ctx is None: return "⚠️ Não tenho memórias sobre isso. Me ensine algo primeiro.", {}
+            with etapa("resposta", caso=colecao, modo="lote"): return _gerar(item["pergunta"], ctx)
+
+        with ThreadPoolExecutor(max_workers=max(1, concorrencia), thread_name_prefix="nemesis-lote") as pool:
+            inicio_llm = time.perf_counter()
+            futuros = {pool.submit(no_contexto(gerar), item, ctx): (item, vetor, ctx, tempos) for item, vetor, ctx, tempos in pendentes}
+            for futuro in as_completed(futuros):
+                item, vetor, ctx, tempos = futuros[futuro]
+                try: texto, tempos_llm = futuro.result()
+                except Exception as e:
+                    gravar({**item, "erro": str(e), "tempos": tempos})
+                    continue
+                tempos = {**tempos, **tempos_llm, "total": round(tempos["embedding"] + tempos["busca"] + tempos_llm.get("llm", 0), 3),
+                          "espera": round(time.perf_counter() - inicio_llm - tempos_llm.get("llm", 0), 3)} # Na fila do pool
+                fontes = ctx["fontes"] if ctx else []
+                gravar({**item, "resposta": texto, "fontes": [d.metadata.get("source_name") for d in fontes], "cache": None, "tempos": tempos})
+                if ctx is not None: respostas.salvar(versao, item["pergunta"], texto, fontes, lambda _, v=vetor: v)
+    resumo["segundos"] = round(time.perf_counter() - t0, 2)
+    return resumo
 
 # --- MENU PRINCIPAL ---
 if __name__ == "__main__":
+    configurar(os.path.join(PASTA_MEMORIA, "_cache", "metricas"), "cli")
+    inicio = relatorio_inicio("cli", INICIO_PROCESSO)
+    if len(sys.argv) > 1: # Modo lote: sem menu, para rodar de madrugada
+        parser = argparse.ArgumentParser(description="Responde um arquivo de perguntas e grava as respostas em JSONL")
+        parser.add_argument("--lote", required=True, help="Perguntas: .txt (uma por linha) ou .jsonl ({\"id\", \"pergunta\"})")
+        parser.add_argument("--saida", required=True, help="Arquivo JSONL de respostas (uma linha por pergunta, gravada ao terminar)")
+        parser.add_argument("--caso", default=PASTA_MEMORIA, help="Pasta do caso (padrão: memória do terminal)")
+        parser.add_argument("--colecao", default=None, help="Coleção (padrão: nome da pasta do caso)")
+        parser.add_argument("--concorrencia", type=int, default=CONCORRENCIA_LOTE, help="Perguntas geradas ao mesmo tempo no Ollama")
+        parser.add_argument("--retomar", action="store_true", help="Mantém a saída e pula as perguntas já respondidas")
+        args = parser.parse_args()
+        try: r = responder_lote(args.lote, args.saida, args.caso, args.colecao, args.concorrencia, args.retomar)
+        except FileNotFoundError as e:
+            print_erro(str(e))
+            sys.exit(1)
+        finally:
+            try: exportar()
+            except OSError: pass
+        print_sucesso(f"{r['respondidas']}/{r['perguntas']} resposta(s) em {r.get('segundos', 0)}s | cache {r['cache']} · erros {r['erros']}"
+                      + (f" · já respondidas {r['puladas']}" if r["puladas"] else "") + f" -> {args.saida}")
+        sys.exit(1 if r["erros"] else 0)
+    garantir_backend(PASTA_MEMORIA, BACKEND_VETORIAL) # Os workers abrem a memória com o mesmo tipo
     print("\n" + "="*40)
     print("   👁️  NEMESIS CORE v2.0 (TERMINAL)")
     print("="*40)
+    print(f"⏱️  Partida em {inicio['segundos']:.2f}s" + (f" | RSS {inicio['rss_mb']:.0f} MB" if inicio["rss_mb"] else ""))
+    modelos = GerenciadorModelos(NOME_MODELO, MODELO_EMBEDDING).iniciar() # Aquece enquanto o menu espera
     
     while True:
         print("\n[1] Aprender Arquivo (PDF/Img/Audio/Excel)")
         print("[2] Consultar")
         print("[3] Limpar Memória")
+        print("[4] Status (caches, bancos abertos e tempos por etapa)")
+        print("[5] Sincronizar Pasta (só o que mudou)")
+        print("[6] Compactar Memória (Chroma -> vetores int8)")
+        print("[7] Consultar Todos os Casos")
         print("[0] Sair")
         
         opcao = input("\nEscolha > ")
@@ -191,21 +424,97 @@ if __name__ == "__main__":
             aprender_arquivo(caminho)
             
         elif opcao == '2':
-            p = input("Pergunta: ")
-            resp = consultar_nemesis(p)
-            print("\n" + "-"*50)
-            print(resp)
-            print("-"*50)
+            mostrar_resposta(input("Pergunta: "))
             
         elif opcao == '3':
             confirmar = input("Tem certeza? Isso apaga tudo (s/n): ")
             if confirmar.lower() == 's':
+                if not parar_workers(PASTA_MEMORIA):
+                    print_erro("Workers de ingestão ainda ocupados. Tente de novo em instantes.")
+                    continue
+                if _casos is not None:
+                    _casos.fechar_todos()
+                    _casos = None
+                if _embeddings is not None:
+                    _embeddings.fechar()
+                    _embeddings = None
                 if os.path.exists(PASTA_MEMORIA):
                     shutil.rmtree(PASTA_MEMORIA)
+                    garantir_backend(PASTA_MEMORIA, BACKEND_VETORIAL)
                     print_sucesso("Memória formatada.")
                 else:
                     print_status("Memória já estava vazia.")
                     
+        elif opcao == '4':
+            if _casos is not None:
+                pool = _casos.estatisticas()
+                print_status(f"Bancos abertos: {pool['abertos']}/{pool['capacidade']} | hits {pool['hits']} · misses {pool['misses']} · despejos {pool['despejos']}")
+            tipo_banco = backend_do_caso(PASTA_MEMORIA)
+            if tipo_banco in ("int8", "float16"):
+                v = BancoPlano(PASTA_MEMORIA).estatisticas()
+                print_status(f"Banco vetorial: {v['tipo']} | {v['fragmentos']} fragmentos ({v['dimensao']} dim) | {v['mb']} MB")
+            else:
+                print_status(f"Banco vetorial: {tipo_banco or 'vazio'}") # Sem abrir o Chroma (importa o chromadb)
+            if _embeddings is not None:
+                emb = _embeddings.estatisticas()
+                print_status(f"Embeddings: {emb['hits']} hit(s), {emb['misses']} miss(es), {emb['mb']} MB em disco")
+            fila = FilaIngestao(PASTA_MEMORIA)
+            print_status(f"Ingestão: {fila.workers_vivos()} worker(s) ativo(s), {len(fila.ativos())} job(s) na fila")
+            estado_sync = EstadoSync(PASTA_MEMORIA)
+            if estado_sync.origem():
+                print_status(f"Pasta sincronizada: {estado_sync.origem()} | " + ", ".join(f"{n} {s}" for s, n in estado_sync.resumo().items()))
+            carregados = [m for m in BACKENDS_PESADOS if m in sys.modules]
+            print_status(f"Partida: {ultimo_inicio()['segundos']:.2f}s | carregados agora: {', '.join(carregados) or 'nenhum backend pesado'}")
+            print_status(f"Modelos: {descrever_modelos(modelos.estatisticas())}")
+            print_rastro("Última ingestão", _ultima_ingestao)
+            print_rastro("Última resposta", ultimo("resposta"))
+
+        elif opcao == '5':
+            anterior = EstadoSync(PASTA_MEMORIA).origem()
+            origem = input(f"Pasta a sincronizar{f' [{anterior}]' if anterior else ''}: ").replace('"', '').strip() or anterior
+            if not origem: continue
+            if sincronizar_pasta(origem) is None: continue
+            if TEM_WATCHDOG and input("Observar a pasta e sincronizar a cada alteração? (s/n): ").lower() == 's':
+                # O observador só enfileira; o progresso aparece aqui mesmo a cada sincronização
+                pendentes = []
+                observador = ObservadorPasta(origem, lambda: pendentes.append(1)).iniciar()
+                print_status("Observando... (Ctrl+C para voltar ao menu)")
+                try:
+                    while True:
+                        time.sleep(1)
+                        if pendentes:
+                            pendentes.clear()
+                            sincronizar_pasta(origem)
+                except KeyboardInterrupt:
+                    print()
+                finally:
+                    observador.parar()
+
+        elif opcao == '6':
+            if backend_do_caso(PASTA_MEMORIA) != "chroma":
+                print_status("Nada a migrar: a memória não está no Chroma.")
+                continue
+            if FilaIngestao(PASTA_MEMORIA).ativos(PASTA_MEMORIA):
+                print_erro("Há ingestão em andamento. Tente de novo quando terminar.")
+                continue
+            if _casos is not None and not _casos.fechar(PASTA_MEMORIA, espera=ESPERA_FECHAR): # Solta o Chroma antes de copiar e apagar
+                print_erro("Memória ainda em uso por uma consulta. Tente de novo em instantes.")
+                continue
+            try:
+                r = migrar_de_chroma(PASTA_MEMORIA, COLECAO, "int8",
+                                     ao_progresso=lambda feitos, total: print(f"\r\033[94m[INFO]\033[0m {feitos}/{total} fragmentos   ", end="", flush=True))
+                print()
+                print_sucesso(f"{r['fragmentos']} fragmentos migrados para vetores {r['tipo']}.")
+                if r["sobras"]: print_status(f"Arquivos do Chroma ainda presos: {', '.join(r['sobras'])} (apague depois).")
+            except Exception as e:
+                print()
+                print_erro(f"Falha na migração (a memória continua no Chroma): {e}")
+
+        elif opcao == '7':
+            mostrar_resposta(input("Pergunta (todos os casos): "), todos_os_casos=True)
+
         elif opcao == '0':
             print("Encerrando protocolo...")
+            try: exportar()
+            except OSError: pass
             break
\ No newline at end of file
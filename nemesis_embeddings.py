@@ -0,0 +1,141 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+from nemesis_telemetria import etapa, contar
+from nemesis_modelos import KEEP_ALIVE
+
+# --- CONFIGURAÇÃO ---
+MODELO_EMBEDDING = "all-minilm"
+LIMITE_CACHE_MB = int(os.environ.get("NEMESIS_CACHE_EMBEDDINGS_MB", 512))
+ACESSOS_POR_GRAVACAO = 2000 # Hits acumulados em memória antes de gravar os horários de acesso (LRU)
+INTERVALO_ACESSOS = 60 # ...ou segundos desde a última gravação, o que vier primeiro
+
+# --- CACHE DE EMBEDDINGS (DISCO, FLOAT32, LRU POR TAMANHO) ---
+# Chave = SHA-256(modelo + texto). Cláusulas padrão, cabeçalhos de planilha repetidos
+# e o mesmo documento em outro caso deixam de ir ao Ollama. Vale para perguntas também.
+def chave_embedding(modelo, texto):
+    return hashlib.sha256(f"{modelo}\0{texto}".encode("utf-8")).digest()
+
+class EmbeddingsComCache(Embeddings):
+    def __init__(self, base, modelo, pasta, limite_mb=LIMITE_CACHE_MB):
+        os.makedirs(pasta, exist_ok=True)
+        self.base = base
+        self.modelo = modelo
+        self.limite_bytes = limite_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(os.path.join(pasta, "embeddings.sqlite"), check_same_thread=False)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        self._con.execute("""CREATE TABLE IF NOT EXISTS vetores (
+            chave BLOB PRIMARY KEY, vetor BLOB, acesso REAL)""")
+        self._con.execute("CREATE INDEX IF NOT EXISTS idx_acesso ON vetores (acesso)")
+        self._con.commit()
+        self._bytes = self._con.execute("SELECT COALESCE(SUM(LENGTH(vetor)), 0) FROM vetores").fetchone()[0]
+        self._acessos = {} # chave -> último acesso ainda não gravado (hit não paga commit/fsync)
+        self._gravado = time.time()
+        self.hits = 0
+        self.misses = 0
+
+    # --- ARMAZENAMENTO ---
+    def _gravar_acessos(self, commit=True):
+        # Chamado com a trava; um UPDATE em lote por vez em vez de um commit por hit
+        if self._acessos:
+            self._con.executemany("UPDATE vetores SET acesso = ? WHERE chave = ?", [(t, c) for c, t in self._acessos.items()])
+            self._acessos = {}
+            if commit: self._con.commit()
+        self._gravado = time.time()
+
+    def _existentes(self, chaves):
+        achados = {}
+        for i in range(0, len(chaves), 500): # Limite de parâmetros do SQLite
+            parte = chaves[i : i + 500]
+            marcas = ",".join("?" * len(parte))
+            achados.update(self._con.execute(f"SELECT chave, vetor FROM vetores WHERE chave IN ({marcas})", parte))
+        return achados
+
+    def _buscar(self, chaves):
+        with self._lock:
+            achados = {chave: array('f', vetor).tolist() for chave, vetor in self._existentes(chaves).items()}
+            if achados:
+                agora = time.time()
+                self._acessos.update((c, agora) for c in achados)
+                if len(self._acessos) >= ACESSOS_POR_GRAVACAO or agora - self._gravado > INTERVALO_ACESSOS: self._gravar_acessos()
+        return achados
+
+    def _guardar(self, pares):
+        agora = time.time()
+        with self._lock:
+            # Mesma chave = mesmo modelo e texto = mesmo vetor: o que já existe só conta como acesso (e não soma bytes)
+            existentes = self._existentes(list({c for c, _ in pares}))
+            novos = {chave: array('f', vetor).tobytes() for chave, vetor in pares if chave not in existentes}
+            self._acessos.update((c, agora) for c in existentes)
+            self._con.executemany("INSERT OR IGNORE INTO vetores (chave, vetor, acesso) VALUES (?, ?, ?)",
+                                  [(c, v, agora) for c, v in novos.items()])
+            self._bytes += sum(len(v) for v in novos.values())
+            self._gravar_acessos(commit=False) # Vai no mesmo commit
+            if self._bytes > self.limite_bytes: self._despejar()
+            self._con.commit()
+
+    def _despejar(self):
+        # Remove os menos usados até ficar em 90% do limite
+        alvo = int(self.limite_bytes * 0.9)
+        self._gravar_acessos(commit=False) # Ordem LRU com os hits ainda em memória
+        self._bytes = self._con.execute("SELECT COALESCE(SUM(LENGTH(vetor)), 0) FROM vetores").fetchone()[0]
+        while self._bytes > alvo:
+            linhas = self._con.execute("SELECT chave, LENGTH(vetor) FROM vetores ORDER BY acesso LIMIT 1000").fetchall()
+            if not linhas: break
+            removidas = []
+            for chave, tamanho in linhas:
+                removidas.append((chave,))
+                self._bytes -= tamanho
+                if self._bytes <= alvo: break
+            self._con.executemany("DELETE FROM vetores WHERE chave = ?", removidas)
+
+    # --- INTERFACE LANGCHAIN ---
+    def embed_documents(self, texts):
+        chaves = [chave_embedding(self.modelo, t) for t in texts]
+        achados = self._buscar(list(set(chaves)))
+        faltando = {}
+        for chave, texto in zip(chaves, texts):
+            if chave not in achados: faltando.setdefault(chave, texto)
+        self.hits += len(texts) - len(faltando)
+        self.misses += len(faltando)
+        contar("embedding_cache_hits", len(texts) - len(faltando))
+        contar("embedding_cache_misses", len(faltando))
+        if faltando:
+            with etapa("embedding.ollama", itens=len(faltando)): novos = self.base.embed_documents(list(faltando.values()))
+            pares = list(zip(faltando.keys(), novos))
+            self._guardar(pares)
+            achados.update(pares)
+        return [achados[c] for c in chaves]
+
+    def embed_query(self, text):
+        chave = chave_embedding(self.modelo, text)
+        achado = self._buscar([chave]).get(chave)
+        if achado is not None:
+            self.hits += 1
+            contar("embedding_cache_hits")
+            return achado
+        self.misses += 1
+        contar("embedding_cache_misses")
+        with etapa("embedding.consulta"): vetor = self.base.embed_query(text)
+        self._guardar([(chave, vetor)])
+        return vetor
+
+    def fechar(self):
+        with self._lock:
+            self._gravar_acessos()
+            self._con.close()
+
+    def estatisticas(self):
+        return {"hits": self.hits, "misses": self.misses, "mb": round(self._bytes / 1024 / 1024, 1)}
+
+def criar_embeddings(pasta_cache, modelo=MODELO_EMBEDDING):
+    from langchain_ollama import OllamaEmbeddings # ~1s de import: só quando o primeiro banco/consulta precisa
+    return EmbeddingsComCache(OllamaEmbeddings(model=modelo, keep_alive=KEEP_ALIVE), modelo, pasta_cache)
@@ -0,0 +1,96 @@
+import os
+import time
+import threading
+
+from nemesis_telemetria import acumular, contar
+
+# --- BACKENDS (IMPORTADOS SÓ NO PRIMEIRO ARQUIVO DO TIPO) ---
+# Cada fábrica recebe (pasta_cache, ocr) e devolve extrator(caminho, ao_progresso) -> gerador de partes.
+# Os imports ficam dentro da fábrica: Whisper/torch, PyMuPDF, Tesseract e pandas não pesam na partida.
+def _backend_pdf(pasta_cache, ocr):
+    from nemesis_ocr import iterar_paginas_pdf, CacheOCR, encerrar_pool
+    cache = CacheOCR(pasta_cache) if pasta_cache and ocr else None # OCR por hash da página
+    def extrair_pdf(caminho, ao_progresso=None):
+        yield from iterar_paginas_pdf(caminho, ao_progresso=ao_progresso, ocr=ocr, cache=cache)
+    def fechar():
+        encerrar_pool()
+        if cache: cache.fechar()
+    extrair_pdf.fechar = fechar
+    return extrair_pdf
+
+def _backend_imagem(pasta_cache, ocr):
+    if not ocr: raise RuntimeError("OCR não instalado.")
+    from PIL import Image
+    from nemesis_ocr import ocr_imagem
+    def extrair_imagem(caminho, ao_progresso=None):
+        yield ocr_imagem(Image.open(caminho))
+    return extrair_imagem
+
+def _backend_audio(pasta_cache, ocr):
+    from nemesis_audio import criar_extrator_audio, encerrar_pool
+    extrator = criar_extrator_audio(pasta_cache)
+    def fechar():
+        encerrar_pool() # Workers com o Whisper carregado vivem até o worker de ingestão encerrar
+        extrator.cache.fechar()
+    extrator.fechar = fechar
+    return extrator
+
+def _backend_planilha(pasta_cache, ocr):
+    from nemesis_planilhas import criar_extrator_planilha
+    return criar_extrator_planilha(os.path.join(pasta_cache, "tabelas"))
+
+BACKENDS = {
+    'pdf': ("pdf", _backend_pdf),
+    'jpg': ("imagem", _backend_imagem), 'jpeg': ("imagem", _backend_imagem), 'png': ("imagem", _backend_imagem),
+    'wav': ("audio", _backend_audio), 'mp3': ("audio", _backend_audio),
+    'xlsx': ("planilha", _backend_planilha), 'xls': ("planilha", _backend_planilha), 'csv': ("planilha", _backend_planilha),
+}
+EXTENSOES = list(BACKENDS) # Tipos aceitos no upload
+
+# --- REGISTRO POR EXTENSÃO ---
+class RegistroExtratores:
+    # Usado como o dict de extratores do pipeline ("ext in registro", "registro[ext]").
+    # O backend é carregado uma vez por processo, no primeiro arquivo daquele tipo.
+    def __init__(self, pasta_cache=None, ocr=True, backends=BACKENDS):
+        self.pasta_cache = pasta_cache
+        self.ocr = ocr
+        self._backends = dict(backends)
+        self._carregados = {} # nome do backend -> extrator
+        self._lock = threading.Lock()
+        self.tempos_carga = {} # nome do backend -> segundos do import + inicialização
+
+    def __contains__(self, ext):
+        return ext in self._backends
+
+    def __iter__(self):
+        return iter(self._backends)
+
+    def __getitem__(self, ext):
+        nome, fabrica = self._backends[ext]
+        with self._lock:
+            extrator = self._carregados.get(nome)
+            if extrator is None:
+                t0 = time.perf_counter()
+                extrator = fabrica(self.pasta_cache, self.ocr)
+                segundos = time.perf_counter() - t0
+                self._carregados[nome] = extrator
+                self.tempos_carga[nome] = round(segundos, 3)
+                acumular(f"carga.{nome}", segundos) # Aparece na quebra da ingestão que pagou o import
+                contar(f"backends_carregados_{nome}")
+        return extrator
+
+    def get(self, ext, padrao=None):
+        return self[ext] if ext in self else padrao
+
+    def carregados(self):
+        with self._lock: return dict(self.tempos_carga)
+
+    def fechar(self):
+        # Pools de OCR e caches SQLite dos backends já carregados (fim do worker)
+        with self._lock:
+            for extrator in self._carregados.values():
+                if hasattr(extrator, "fechar"): extrator.fechar()
+            self._carregados.clear()
+
+def criar_extratores(raiz, ocr=True):
+    return RegistroExtratores(os.path.join(raiz, "_cache"), ocr=ocr)
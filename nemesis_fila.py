@@ -0,0 +1,350 @@
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import threading
+import subprocess
+
+from nemesis_extratores import criar_extratores
+
+# --- CONFIGURAÇÃO ---
+INGESTAO_WORKERS = int(os.environ.get("NEMESIS_INGESTAO_WORKERS", 2)) # Processos de ingestão (casos diferentes em paralelo)
+OCIOSO_SEGUNDOS = int(os.environ.get("NEMESIS_INGESTAO_OCIOSO", 300)) # Worker sem trabalho encerra sozinho
+BATIMENTO_SEGUNDOS = 5
+EXPIRA_SEGUNDOS = 60 # Job "rodando" sem batimento = worker morreu; volta para a fila
+INTERVALO_PROGRESSO = 0.5 # Grava o progresso de um arquivo no máximo a cada 0,5s
+
+# --- FILA PERSISTENTE (SQLITE EM <raiz>/_cache/fila) ---
+# Os arquivos enviados são copiados para a pasta da fila: um job sobrevive a recarregar a página
+# ou a um crash e é retomado do arquivo em que parou (o cache de ingestão evita refazer o OCR).
+class FilaIngestao:
+    def __init__(self, raiz):
+        self.raiz = os.path.abspath(raiz)
+        self.pasta = os.path.join(self.raiz, "_cache", "fila")
+        self.caminho = os.path.join(self.pasta, "fila.sqlite")
+
+    def _conectar(self):
+        os.makedirs(self.pasta, exist_ok=True)
+        con = sqlite3.connect(self.caminho, timeout=30, isolation_level=None)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, caso TEXT, pasta_caso TEXT, colecao TEXT, status TEXT,
+            worker INTEGER, batimento REAL, criado REAL, iniciado REAL, concluido REAL, escrita TEXT, erro TEXT)""")
+        con.execute("""CREATE TABLE IF NOT EXISTS arquivos (
+            job_id INTEGER, n INTEGER, nome TEXT, caminho TEXT, status TEXT, etapa TEXT, fracao REAL,
+            hash TEXT, origem TEXT, fragmentos INTEGER, erro TEXT, PRIMARY KEY (job_id, n))""")
+        for coluna in ("etapas", "remover"): # Filas anteriores à telemetria / à sincronização de pastas
+            try: con.execute(f"ALTER TABLE jobs ADD COLUMN {coluna} TEXT")
+            except sqlite3.OperationalError: pass
+        con.execute("CREATE TABLE IF NOT EXISTS workers (pid INTEGER PRIMARY KEY, batimento REAL)")
+        con.execute("CREATE TABLE IF NOT EXISTS controle (chave TEXT PRIMARY KEY, valor REAL)")
+        return con
+
+    # --- LADO DE QUEM ENVIA (APP / CLI) ---
+    def enviar(self, caso, pasta_caso, colecao, arquivos, remover=None):
+        # arquivos: [(nome, bytes ou caminho)]. Só vira "pendente" depois de tudo copiado.
+        # remover: hashes de origem cujos fragmentos saem do banco antes da ingestão (sincronização de pasta),
+        # ou {hash: [caminhos completos]} para achar também fragmentos antigos, gravados sem o hash
+        con = self._conectar()
+        try:
+            job_id = con.execute("INSERT INTO jobs (caso, pasta_caso, colecao, status, criado, remover) VALUES (?, ?, ?, 'preparando', ?, ?)",
+                                 (caso, os.path.abspath(pasta_caso), colecao, time.time(),
+                                  json.dumps(remover if isinstance(remover, dict) else list(remover)) if remover else None)).lastrowid
+            pasta_job = os.path.join(self.pasta, str(job_id))
+            os.makedirs(pasta_job, exist_ok=True)
+            linhas = []
+            for n, (nome, conteudo) in enumerate(arquivos):
+                destino = os.path.join(pasta_job, f"{n}_{os.path.basename(nome)}")
+                if isinstance(conteudo, (bytes, bytearray)):
+                    with open(destino, "wb") as f: f.write(conteudo)
+                else:
+                    shutil.copyfile(conteudo, destino)
+                linhas.append((job_id, n, nome, destino, "na_fila", 0.0))
+            con.executemany("INSERT INTO arquivos (job_id, n, nome, caminho, etapa, fracao) VALUES (?, ?, ?, ?, ?, ?)", linhas)
+            con.execute("UPDATE jobs SET status = 'pendente' WHERE id = ?", (job_id,))
+            return job_id
+        finally:
+            con.close()
+
+    def job(self, job_id):
+        con = self._conectar()
+        try:
+            linha = con.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if linha is None: return None
+            job = dict(linha)
+            job["escrita"] = json.loads(job["escrita"]) if job["escrita"] else {}
+            job["etapas"] = json.loads(job["etapas"]) if job.get("etapas") else None
+            job["remover"] = json.loads(job["remover"]) if job.get("remover") else []
+            job["arquivos"] = [dict(a) for a in con.execute("SELECT * FROM arquivos WHERE job_id = ? ORDER BY n", (job_id,))]
+            return job
+        finally:
+            con.close()
+
+    def ativos(self, pasta_caso=None):
+        con = self._conectar()
+        try:
+            sql = "SELECT id FROM jobs WHERE status IN ('pendente', 'rodando')"
+            args = ()
+            if pasta_caso:
+                sql += " AND pasta_caso = ?"
+                args = (os.path.abspath(pasta_caso),)
+            return [r[0] for r in con.execute(sql + " ORDER BY id", args)]
+        finally:
+            con.close()
+
+    # --- LADO DO WORKER ---
+    def pegar(self, pid):
+        # Um job rodando por caso por vez (um único escritor por banco Chroma)
+        con = self._conectar()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            linha = con.execute("""SELECT id FROM jobs WHERE status = 'pendente' AND pasta_caso NOT IN
+                                   (SELECT pasta_caso FROM jobs WHERE status = 'rodando') ORDER BY id LIMIT 1""").fetchone()
+            if linha:
+                agora = time.time()
+                con.execute("UPDATE jobs SET status = 'rodando', worker = ?, batimento = ?, iniciado = COALESCE(iniciado, ?) WHERE id = ?",
+                            (pid, agora, agora, linha[0]))
+            con.execute("COMMIT")
+        finally:
+            con.close()
+        return self.job(linha[0]) if linha else None
+
+    def recuperar_orfaos(self):
+        con = self._conectar()
+        try:
+            limite = time.time() - EXPIRA_SEGUNDOS
+            con.execute("UPDATE jobs SET status = 'pendente', worker = NULL WHERE status = 'rodando' AND batimento < ?", (limite,))
+            con.execute("DELETE FROM workers WHERE batimento < ?", (limite,))
+        finally:
+            con.close()
+
+    def bater(self, pid, job_id=None):
+        con = self._conectar()
+        try:
+            agora = time.time()
+            con.execute("INSERT OR REPLACE INTO workers (pid, batimento) VALUES (?, ?)", (pid, agora))
+            if job_id is not None: con.execute("UPDATE jobs SET batimento = ? WHERE id = ? AND worker = ?", (agora, job_id, pid))
+        finally:
+            con.close()
+
+    def sair(self, pid):
+        con = self._conectar()
+        try: con.execute("DELETE FROM workers WHERE pid = ?", (pid,))
+        finally: con.close()
+
+    def atualizar_arquivo(self, job_id, n, **campos):
+        con = self._conectar()
+        try:
+            colunas = ", ".join(f"{c} = ?" for c in campos)
+            con.execute(f"UPDATE arquivos SET {colunas} WHERE job_id = ? AND n = ?", (*campos.values(), job_id, n))
+        finally:
+            con.close()
+
+    def concluir(self, job_id, status, escrita=None, erro=None, etapas=None):
+        con = self._conectar()
+        try:
+            con.execute("UPDATE jobs SET status = ?, concluido = ?, escrita = ?, erro = ?, etapas = ? WHERE id = ?",
+                        (status, time.time(), json.dumps(escrita or {}), erro,
+                         json.dumps(etapas, ensure_ascii=False) if etapas else None, job_id))
+            # Arquivo sem resultado = mesmo conteúdo de outro arquivo do job
+            con.execute("UPDATE arquivos SET status = 'duplicado' WHERE job_id = ? AND status IS NULL AND etapa = 'concluido'", (job_id,))
+        finally:
+            con.close()
+        shutil.rmtree(os.path.join(self.pasta, str(job_id)), ignore_errors=True) # Cópias dos uploads
+
+    def registrar_remocao(self, job_id, fragmentos):
+        # Marca a remoção como feita: um job retomado após crash não repete a etapa
+        con = self._conectar()
+        try: con.execute("UPDATE jobs SET escrita = ? WHERE id = ?", (json.dumps({"removidos": fragmentos}), job_id))
+        finally: con.close()
+
+    def salvar_etapas(self, job_id, resumo):
+        # Quebra por etapa (OCR, Whisper, embeddings, Chroma...) para o painel de depuração
+        con = self._conectar()
+        try: con.execute("UPDATE jobs SET etapas = ? WHERE id = ?", (json.dumps(resumo, ensure_ascii=False), job_id))
+        finally: con.close()
+
+    # --- WORKERS VIVOS / PARADA ---
+    def workers_vivos(self):
+        con = self._conectar()
+        try: return con.execute("SELECT COUNT(*) FROM workers WHERE batimento >= ?", (time.time() - EXPIRA_SEGUNDOS,)).fetchone()[0]
+        finally: con.close()
+
+    def pedir_parada(self, ativo=True):
+        con = self._conectar()
+        try:
+            if ativo: con.execute("INSERT OR REPLACE INTO controle (chave, valor) VALUES ('parar', ?)", (time.time(),))
+            else: con.execute("DELETE FROM controle WHERE chave = 'parar'")
+        finally:
+            con.close()
+
+    def parada_pedida(self):
+        con = self._conectar()
+        try: return con.execute("SELECT 1 FROM controle WHERE chave = 'parar'").fetchone() is not None
+        finally: con.close()
+
+def garantir_workers(raiz, quantidade=INGESTAO_WORKERS, tesseract_cmd=None, ocr=True):
+    # Sobe processos independentes do Streamlit/CLI (continuam se a página recarregar)
+    fila = FilaIngestao(raiz)
+    fila.pedir_parada(False)
+    fila.recuperar_orfaos()
+    faltando = quantidade - fila.workers_vivos()
+    if faltando <= 0: return 0
+    comando = [sys.executable, os.path.abspath(__file__), fila.raiz]
+    if tesseract_cmd: comando += ["--tesseract", tesseract_cmd]
+    if not ocr: comando.append("--sem-ocr")
+    extras = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP} if os.name == "nt" else {"start_new_session": True}
+    with open(os.path.join(fila.pasta, "workers.log"), "ab") as log:
+        for _ in range(faltando):
+            proc = subprocess.Popen(comando, stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)), **extras)
+            fila.bater(proc.pid) # Já conta como vivo: duas chamadas seguidas não sobem o dobro
+    return faltando
+
+def parar_workers(raiz, espera=15):
+    # Antes de apagar a pasta de memória: workers ociosos soltam os arquivos e saem
+    fila = FilaIngestao(raiz)
+    fila.pedir_parada()
+    limite = time.time() + espera
+    while fila.workers_vivos() and time.time() < limite: time.sleep(0.5)
+    return fila.workers_vivos() == 0
+
+def memoria_do_job(cache, job, limite):
+    # Reconstrói a memória imediata do job a partir do cache de ingestão (o worker não manda texto)
+    from nemesis_pipeline import texto_do_cache
+    partes, tamanho = [], 0
+    for a in job["arquivos"]:
+        if not a["hash"] or a["status"] in ("erro", "vazio", "duplicado"): continue
+        for texto in [*texto_do_cache(cache, a["hash"], a["nome"], a["origem"] or ""), "\n\n"]:
+            if tamanho >= limite: return "".join(partes)
+            partes.append(texto[: limite - tamanho])
+            tamanho += len(partes[-1])
+    return "".join(partes)
+
+# --- PROCESSO WORKER ---
+def processar_job(fila, job, cache, casos, extratores):
+    from nemesis_pipeline import ingerir_arquivos, remover_fontes, migrar_hash_nos_metadados
+    from nemesis_sync import EstadoSync
+    from nemesis_lexico import IndiceLexico
+    from nemesis_planilhas import CatalogoTabelas
+    from nemesis_telemetria import span_atual, etapa
+
+    def resumo():
+        # A quebra por etapa já vai junto com o status (o app lê o job assim que ele termina)
+        span = span_atual()
+        return span.resumo() if span else None
+
+    pendentes = [a for a in job["arquivos"] if a["etapa"] != "concluido"]
+    atual = {"n": None, "gravado": 0.0}
+
+    def fontes():
+        for a in pendentes:
+            atual["n"] = a["n"]
+            fila.atualizar_arquivo(job["id"], a["n"], etapa="extraindo", fracao=0.0)
+            yield a["nome"], a["caminho"]
+
+    def ao_progresso(i, nome, fracao):
+        agora = time.time()
+        if fracao < 1.0 and agora - atual["gravado"] < INTERVALO_PROGRESSO: return
+        atual["gravado"] = agora
+        fila.atualizar_arquivo(job["id"], atual["n"], fracao=fracao)
+
+    def ao_arquivo(r):
+        # Extração terminou; os fragmentos ainda podem estar indo para o banco
+        fila.atualizar_arquivo(job["id"], atual["n"], etapa="gravando", fracao=1.0, status=r["status"], hash=r["hash"],
+                               origem=r["origem"], fragmentos=r["fragmentos"], erro=str(r["erro"]) if r["erro"] else None)
+
+    vectorstore = casos.obter(job["pasta_caso"], job["colecao"])
+    lexico = IndiceLexico(job["pasta_caso"])
+    catalogo = CatalogoTabelas(job["pasta_caso"])
+    removidos = job["escrita"].get("removidos") # Preenchido = job retomado depois da remoção
+    try:
+        if job["remover"] and removidos is None:
+            # Antes da ingestão: um arquivo alterado sai com o hash antigo e entra com o novo
+            remover = job["remover"]
+            caminhos = [c for lista in remover.values() for c in lista] if isinstance(remover, dict) else [] # Jobs antigos: só hashes
+            estado = EstadoSync(job["pasta_caso"])
+            with etapa("sync.remocao", hashes=len(remover)):
+                if not estado.meta("hash_nos_metadados"): # Uma vez por caso, na primeira remoção
+                    migrar_hash_nos_metadados(vectorstore)
+                    estado.definir_meta("hash_nos_metadados", "1")
+                removidos = remover_fontes(vectorstore, list(remover), lexico=lexico, caminhos=caminhos)
+            catalogo.remover(job["remover"])
+            fila.registrar_remocao(job["id"], removidos)
+        resultados, escrita = ingerir_arquivos(vectorstore, fontes(), cache, extratores=extratores,
+                                               ao_progresso=ao_progresso, ao_arquivo=ao_arquivo, lexico=lexico)
+    except Exception as e:
+        fila.concluir(job["id"], "erro", erro=str(e), etapas=resumo())
+        return
+    catalogo.registrar(resultados)
+    for a in pendentes: fila.atualizar_arquivo(job["id"], a["n"], etapa="concluido", fracao=1.0)
+    if job["remover"]: escrita = {**escrita, "removidos": removidos}
+    fila.concluir(job["id"], "concluido", escrita, etapas=resumo())
+
+def executar_worker(raiz, tesseract_cmd=None, ocr=True):
+    from nemesis_cache import CacheIngestao
+    from nemesis_embeddings import criar_embeddings
+    from nemesis_store import GerenciadorCasos
+    from nemesis_telemetria import configurar, etapa, exportar
+
+    if tesseract_cmd:
+        import pytesseract
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+
+    fila = FilaIngestao(raiz)
+    pid = os.getpid()
+    pasta_cache = os.path.join(fila.raiz, "_cache")
+    configurar(os.path.join(pasta_cache, "metricas"), f"worker-{pid}")
+    cache = CacheIngestao(pasta_cache)
+    embeddings = criar_embeddings(pasta_cache)
+    casos = GerenciadorCasos(embeddings)
+    extratores = criar_extratores(fila.raiz, ocr=ocr)
+
+    estado = {"job": None, "ativo": True}
+    def batimento():
+        while estado["ativo"]:
+            try: fila.bater(pid, estado["job"])
+            except Exception: pass
+            time.sleep(BATIMENTO_SEGUNDOS)
+    threading.Thread(target=batimento, daemon=True, name="nemesis-batimento").start()
+
+    ocioso_desde = time.time()
+    try:
+        while True:
+            fila.recuperar_orfaos()
+            job = fila.pegar(pid)
+            if job is None:
+                if fila.parada_pedida() or time.time() - ocioso_desde > OCIOSO_SEGUNDOS: break
+                time.sleep(1)
+                continue
+            estado["job"] = job["id"]
+            print(f"[{time.strftime('%H:%M:%S')}] worker {pid}: job {job['id']} ({job['caso']}, {len(job['arquivos'])} arquivo(s))", flush=True)
+            with etapa("ingestao", caso=job["caso"], arquivos=len(job["arquivos"])) as rastro:
+                try: processar_job(fila, job, cache, casos, extratores)
+                except Exception as e: fila.concluir(job["id"], "erro", erro=str(e)) # Sem isso o job voltaria à fila para sempre
+            fila.salvar_etapas(job["id"], rastro.resumo())
+            # Solta o banco do caso: o app reabre com os vetores novos
+            casos.fechar(job["pasta_caso"])
+            estado["job"] = None
+            ocioso_desde = time.time()
+    finally:
+        estado["ativo"] = False
+        try: exportar()
+        except OSError: pass
+        casos.fechar_todos()
+        extratores.fechar()
+        cache.fechar()
+        embeddings.fechar()
+        fila.sair(pid)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker de ingestão do Nemesis")
+    parser.add_argument("raiz", help="Pasta de memória (ex.: ./banco_de_dados_nemesis)")
+    parser.add_argument("--tesseract", default=None, help="Caminho do executável do Tesseract")
+    parser.add_argument("--sem-ocr", action="store_true", help="Não faz OCR de páginas digitalizadas")
+    args = parser.parse_args()
+    executar_worker(args.raiz, args.tesseract, ocr=not args.sem_ocr)
@@ -0,0 +1,169 @@
+import os
+import re
+import math
+import sqlite3
+import unicodedata
+from collections import Counter
+
+from langchain_core.documents import Document
+
+from nemesis_telemetria import etapa
+
+# --- CONFIGURAÇÃO ---
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60 # Constante da fusão por posição (Reciprocal Rank Fusion)
+K_CANDIDATOS = 20 # Candidatos de cada lado antes da fusão
+
+STOPWORDS = set("""a o e é de do da dos das em no na nos nas um uma uns umas por para pelo pela pelos pelas com sem
+se que qual quais como mais menos ao aos as os ou ja nao sim sua seu suas seus ele ela eles elas isso isto esse essa
+este esta aquele aquela foi ser sao ter tem tinha ha entre sobre ate apos the of and to in is""".split())
+
+# --- TOKENIZAÇÃO ---
+# Identificadores (processo CNJ, CPF, CNPJ, datas) viram um token só com os dígitos:
+# "0001234-12.2023.8.26.0100" e "00012341220238260100" batem entre si.
+RE_IDENTIFICADOR = re.compile(r"\d[\d./\-]{6,}\d")
+RE_ARTIGO = re.compile(r"\bart(?:igo)?s?\.?\s*(\d+)")
+RE_PALAVRA = re.compile(r"[a-z0-9]+")
+RE_NAO_DIGITO = re.compile(r"\D")
+
+def _normalizar(texto):
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+def identificadores(texto):
+    return ["n" + RE_NAO_DIGITO.sub("", m) for m in RE_IDENTIFICADOR.findall(texto)]
+
+def tokenizar(texto):
+    norm = _normalizar(texto)
+    tokens = [t for t in RE_PALAVRA.findall(norm) if len(t) > 1 and t not in STOPWORDS]
+    tokens += identificadores(norm)
+    tokens += [f"art{n}" for n in RE_ARTIGO.findall(norm)]
+    return tokens
+
+# --- ÍNDICE INVERTIDO BM25 (SQLITE NA PASTA DO CASO) ---
+class IndiceLexico:
+    # Abre a conexão só durante cada operação: nenhum arquivo fica preso (WinError 32)
+    def __init__(self, pasta_caso):
+        self.caminho = os.path.join(pasta_caso, "lexico.sqlite")
+
+    def _conectar(self):
+        os.makedirs(os.path.dirname(self.caminho) or ".", exist_ok=True)
+        con = sqlite3.connect(self.caminho, timeout=30)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("CREATE TABLE IF NOT EXISTS docs (id TEXT PRIMARY KEY, tamanho INTEGER)")
+        con.execute("CREATE TABLE IF NOT EXISTS postings (termo TEXT, doc_id TEXT, tf INTEGER)")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_termo ON postings (termo)")
+        con.execute("CREATE INDEX IF NOT EXISTS idx_doc ON postings (doc_id)")
+        con.execute("CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor INTEGER)")
+        return con
+
+    def _nova_versao(self, con):
+        # Toda escrita muda a versão do corpus (invalida o cache de respostas do caso)
+        con.execute("INSERT INTO meta (chave, valor) VALUES ('versao', 1) ON CONFLICT(chave) DO UPDATE SET valor = valor + 1")
+
+    def adicionar(self, ids, textos):
+        con = self._conectar()
+        try:
+            with con:
+                # Upsert: o mesmo ID (mesmo arquivo) substitui as postings antigas
+                con.executemany("DELETE FROM postings WHERE doc_id = ?", [(i,) for i in ids])
+                for doc_id, texto in zip(ids, textos):
+                    contagem = Counter(tokenizar(texto))
+                    con.execute("INSERT OR REPLACE INTO docs (id, tamanho) VALUES (?, ?)", (doc_id, sum(contagem.values())))
+                    con.executemany("INSERT INTO postings (termo, doc_id, tf) VALUES (?, ?, ?)",
+                                    [(t, doc_id, tf) for t, tf in contagem.items()])
+                self._nova_versao(con)
+        finally:
+            con.close()
+
+    def remover(self, ids):
+        con = self._conectar()
+        try:
+            with con:
+                con.executemany("DELETE FROM postings WHERE doc_id = ?", [(i,) for i in ids])
+                con.executemany("DELETE FROM docs WHERE id = ?", [(i,) for i in ids])
+                self._nova_versao(con)
+        finally:
+            con.close()
+
+    def versao(self):
+        con = self._conectar()
+        try:
+            linha = con.execute("SELECT valor FROM meta WHERE chave = 'versao'").fetchone()
+            return linha[0] if linha else 0
+        finally: con.close()
+
+    def total(self):
+        con = self._conectar()
+        try: return con.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+        finally: con.close()
+
+    def buscar(self, consulta, k=K_CANDIDATOS, termos=None):
+        # Retorna [(doc_id, score)] ordenado por BM25
+        termos = Counter(termos if termos is not None else tokenizar(consulta))
+        if not termos: return []
+        con = self._conectar()
+        try:
+            n, soma = con.execute("SELECT COUNT(*), COALESCE(SUM(tamanho), 0) FROM docs").fetchone()
+            if not n: return []
+            media = soma / n or 1
+            scores = Counter()
+            for termo, qtf in termos.items():
+                linhas = con.execute("""SELECT p.doc_id, p.tf, d.tamanho FROM postings p
+                                        JOIN docs d ON d.id = p.doc_id WHERE p.termo = ?""", (termo,)).fetchall()
+                if not linhas: continue
+                idf = math.log(1 + (n - len(linhas) + 0.5) / (len(linhas) + 0.5))
+                for doc_id, tf, tamanho in linhas:
+                    scores[doc_id] += qtf * idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * tamanho / media))
+            return scores.most_common(k)
+        finally:
+            con.close()
+
+    def sincronizar(self, vectorstore, lote=1000):
+        # Casos indexados antes do índice léxico existir: reconstrói a partir do Chroma
+        try: total_vetorial = vectorstore._collection.count()
+        except Exception: return
+        if self.total() >= total_vetorial: return
+        for inicio in range(0, total_vetorial, lote):
+            dados = vectorstore.get(limit=lote, offset=inicio, include=["documents"])
+            self.adicionar(dados["ids"], dados["documents"])
+
+# --- BUSCA HÍBRIDA ---
+def documentos_por_id(vectorstore, ids):
+    if not ids: return []
+    dados = vectorstore.get(ids=list(ids), include=["documents", "metadatas"])
+    por_id = {i: Document(id=i, page_content=t, metadata=m or {})
+              for i, t, m in zip(dados["ids"], dados["documents"], dados["metadatas"])}
+    return [por_id[i] for i in ids if i in por_id]
+
+def buscar_hibrido(vectorstore, lexico, pergunta, k=5, k_candidatos=K_CANDIDATOS, vetor=None):
+    # vetor: embedding da pergunta já calculado (lote de perguntas embedado de uma vez)
+    def vetorial(n):
+        if vetor is None: return vectorstore.similarity_search(pergunta, k=n)
+        return vectorstore.similarity_search_by_vector(vetor, k=n)
+    if lexico is None:
+        with etapa("busca.vetorial"): return vetorial(k)
+    with etapa("bm25.sincronizar"): lexico.sincronizar(vectorstore)
+
+    # 1. Pergunta com identificador exato (processo/CPF/CNPJ): responde só pelo léxico, sem embedding
+    exatos = identificadores(_normalizar(pergunta))
+    if exatos:
+        with etapa("busca.bm25"): achados = lexico.buscar(pergunta, k=k, termos=exatos)
+        if achados:
+            with etapa("busca.documentos"): return documentos_por_id(vectorstore, [i for i, _ in achados])
+
+    # 2. Fusão por posição (RRF) entre BM25 e vetorial
+    with etapa("busca.bm25"): lexicos = [i for i, _ in lexico.buscar(pergunta, k=k_candidatos)]
+    with etapa("busca.vetorial"): vetoriais = vetorial(k_candidatos)
+    pontos, docs = Counter(), {}
+    for pos, d in enumerate(vetoriais):
+        chave = d.id or d.page_content
+        pontos[chave] += 1 / (RRF_K + pos + 1)
+        docs[chave] = d
+    for pos, doc_id in enumerate(lexicos):
+        pontos[doc_id] += 1 / (RRF_K + pos + 1)
+    melhores = [c for c, _ in pontos.most_common(k)]
+    faltando = [c for c in melhores if c not in docs]
+    with etapa("busca.documentos"): docs.update({d.id: d for d in documentos_por_id(vectorstore, faltando)})
+    return [docs[c] for c in melhores if c in docs]
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import threading
+import urllib.request
+
+from nemesis_telemetria import acumular, contar
+
+# --- CONFIGURAÇÃO ---
+KEEP_ALIVE = int(os.environ.get("NEMESIS_KEEP_ALIVE", 1800)) # Segundos que o Ollama mantém o modelo carregado depois de cada uso
+INTERVALO_PING = float(os.environ.get("NEMESIS_INTERVALO_PING", 240)) # Segundos entre pings de keep-alive (0 desliga)
+PRAZO_CARGA = 300 # Primeira carga do llama3.1 a partir de disco lento
+RECARREGOU = 0.5 # Carga acima disso num ping = o Ollama tinha descarregado o modelo
+
+# --- CHAMADAS DIRETAS AO OLLAMA (SEM LANGCHAIN: SÓ CARGA E TEMPOS) ---
+def url_ollama():
+    # Mesmo endereço que langchain_ollama/ollama usam quando base_url não é passado
+    host = os.environ.get("OLLAMA_HOST", "127.0.0.1:11434")
+    if not host.startswith("http"): host = "http://" + host
+    return host.rstrip("/")
+
+def _post(caminho, corpo, prazo=PRAZO_CARGA):
+    pedido = urllib.request.Request(url_ollama() + caminho, data=json.dumps(corpo).encode("utf-8"),
+                                    headers={"Content-Type": "application/json"})
+    return urllib.request.urlopen(pedido, timeout=prazo)
+
+def aquecer_chat(modelo, keep_alive=KEEP_ALIVE):
+    # Gera 1 token: carrega o modelo e mede o tempo até o 1º token como uma pergunta real
+    inicio = time.perf_counter()
+    primeiro, fim = None, {}
+    corpo = {"model": modelo, "messages": [{"role": "user", "content": "ok"}], "stream": True,
+             "keep_alive": keep_alive, "options": {"num_predict": 1}}
+    with _post("/api/chat", corpo) as resposta:
+        for linha in resposta:
+            if not linha.strip(): continue
+            if primeiro is None: primeiro = time.perf_counter() - inicio
+            dados = json.loads(linha)
+            if dados.get("done"): fim = dados
+    return {"carga": (fim.get("load_duration") or 0) / 1e9, "primeiro_token": primeiro or 0, "total": time.perf_counter() - inicio}
+
+def aquecer_embedding(modelo, keep_alive=KEEP_ALIVE):
+    inicio = time.perf_counter()
+    with _post("/api/embed", {"model": modelo, "input": "ok", "keep_alive": keep_alive}) as resposta:
+        dados = json.loads(resposta.read() or b"{}")
+    total = time.perf_counter() - inicio
+    return {"carga": (dados.get("load_duration") or 0) / 1e9, "primeiro_token": total, "total": total}
+
+def pingar_chat(modelo, keep_alive=KEEP_ALIVE):
+    # Sem mensagens o Ollama só carrega/renova o modelo, sem gerar nada
+    inicio = time.perf_counter()
+    with _post("/api/chat", {"model": modelo, "messages": [], "stream": False, "keep_alive": keep_alive}) as resposta:
+        dados = json.loads(resposta.read() or b"{}")
+    return {"carga": (dados.get("load_duration") or 0) / 1e9, "total": time.perf_counter() - inicio}
+
+# --- CICLO DE VIDA DOS MODELOS ---
+class GerenciadorModelos:
+    # Um por processo. Aquece o embedding e o chat numa thread assim que o app/menu abre e renova
+    # o keep_alive a cada INTERVALO_PING segundos, para a 1ª pergunta não pagar a carga do modelo.
+    # status: frio | aquecendo | pronto | erro (Ollama fora do ar: tenta de novo no próximo ping)
+    def __init__(self, chat, embedding, keep_alive=KEEP_ALIVE, intervalo=INTERVALO_PING):
+        self.keep_alive = keep_alive
+        self.intervalo = intervalo
+        self.modelos = {embedding: "embedding", chat: "chat"} # Embedding primeiro: é pequeno e a busca vem antes
+        self.estado = {m: {"tipo": t, "status": "frio", "carga": None, "primeiro_token": None, "ultimo_ping": None,
+                           "recargas": 0, "erro": None} for m, t in self.modelos.items()}
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def _atualizar(self, modelo, **valores):
+        with self._lock: self.estado[modelo].update(valores)
+
+    def aquecer(self, modelo):
+        self._atualizar(modelo, status="aquecendo")
+        try:
+            r = (aquecer_chat if self.modelos[modelo] == "chat" else aquecer_embedding)(modelo, self.keep_alive)
+        except Exception as e:
+            self._atualizar(modelo, status="erro", erro=str(e))
+            return None
+        acumular(f"modelo.aquecimento.{self.modelos[modelo]}", r["total"])
+        self._atualizar(modelo, status="pronto", erro=None, carga=round(r["carga"], 3), primeiro_token=round(r["primeiro_token"], 3),
+                        ultimo_ping=time.time())
+        return r
+
+    def pingar(self, modelo):
+        if self.estado[modelo]["status"] != "pronto": return self.aquecer(modelo) # Ainda frio ou deu erro: aquece de novo
+        try:
+            r = pingar_chat(modelo, self.keep_alive) if self.modelos[modelo] == "chat" else aquecer_embedding(modelo, self.keep_alive)
+        except Exception as e:
+            self._atualizar(modelo, status="erro", erro=str(e))
+            return None
+        contar("modelo_pings")
+        if r["carga"] > RECARREGOU: # Descarregado por fora (outro modelo, reinício do Ollama)
+            contar("modelo_recargas")
+            with self._lock: self.estado[modelo]["recargas"] += 1
+        self._atualizar(modelo, ultimo_ping=time.time())
+        return r
+
+    def _rodar(self):
+        for modelo in self.modelos:
+            if self._parar.is_set(): return
+            self.aquecer(modelo)
+        while self.intervalo > 0 and not self._parar.wait(self.intervalo):
+            for modelo in self.modelos: self.pingar(modelo)
+
+    def iniciar(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._rodar, daemon=True, name="nemesis-modelos")
+                self._thread.start()
+        return self
+
+    def parar(self):
+        self._parar.set()
+
+    def estatisticas(self):
+        with self._lock: return {m: dict(e) for m, e in self.estado.items()}
+
+def descrever(estado):
+    # "llama3.1: pronto (carga 3.2s, 1º token 3.5s)" por modelo, para a barra lateral e a opção 4 da CLI
+    partes = []
+    for modelo, e in estado.items():
+        texto = f"{modelo}: {e['status']}"
+        if e["status"] == "pronto" and e["carga"] is not None:
+            texto += f" (carga {e['carga']:.1f}s" + (f", 1º token {e['primeiro_token']:.1f}s" if e["tipo"] == "chat" else "") + ")"
+        if e["recargas"]: texto += f" · recarregado {e['recargas']}x"
+        partes.append(texto)
+    return " | ".join(partes)
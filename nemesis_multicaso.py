@@ -0,0 +1,115 @@
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import numpy as np
+
+from nemesis_lexico import IndiceLexico, documentos_por_id, identificadores, _normalizar, RRF_K
+from nemesis_vetores import BancoPlano, backend_do_caso
+from nemesis_catalogo import CatalogoCasos
+from nemesis_telemetria import etapa, acumular, contar, no_contexto
+
+# --- CONFIGURAÇÃO ---
+BUSCA_WORKERS = int(os.environ.get("NEMESIS_BUSCA_WORKERS", 8)) # Casos consultados ao mesmo tempo
+PRAZO_BUSCA = float(os.environ.get("NEMESIS_PRAZO_BUSCA", 8.0)) # Segundos; caso que não respondeu fica de fora
+K_POR_CASO = 8 # Candidatos de cada lado (BM25 e vetorial) por caso antes da fusão global
+
+# --- CASOS PESQUISÁVEIS ---
+def casos_indexados(raiz, nomes=None, ocultos=()):
+    # [(caso, pasta, coleção)] com banco no disco. nomes: lista já filtrada pelo catálogo (a do app);
+    # sem ela, pastas "_..." (caches) e a lixeira ficam de fora pelo próprio catálogo.
+    if not os.path.isdir(raiz): return []
+    if nomes is None: nomes = CatalogoCasos(raiz).visiveis()
+    casos = []
+    for nome in sorted(nomes):
+        pasta = os.path.join(raiz, nome)
+        if nome in ocultos or not os.path.isdir(pasta): continue
+        if backend_do_caso(pasta) is None: continue # Caso sem nada indexado
+        casos.append((nome, pasta, nome))
+    return casos
+
+# --- BUSCA EM UM CASO ---
+def _vetoriais(vs, vetor, k):
+    # [(Document, cosseno)]: pontuações comparáveis entre casos (Chroma devolve distância na métrica da coleção)
+    if isinstance(vs, BancoPlano): return vs.similarity_search_by_vector_with_score(vetor, k=k)
+    from langchain_core.documents import Document
+    dados = vs._collection.query(query_embeddings=[vetor], n_results=k, include=["documents", "metadatas", "embeddings"])
+    if not dados["ids"] or not dados["ids"][0]: return []
+    matriz = np.asarray(dados["embeddings"][0], dtype=np.float32)
+    q = np.asarray(vetor, dtype=np.float32)
+    cossenos = matriz @ q / (np.linalg.norm(matriz, axis=1) * np.linalg.norm(q) + 1e-12)
+    return [(Document(id=i, page_content=t or "", metadata=m or {}), float(c))
+            for i, t, m, c in zip(dados["ids"][0], dados["documents"][0], dados["metadatas"][0], cossenos)]
+
+def buscar_no_caso(casos, entrada, pergunta, vetor, exatos, k=K_POR_CASO):
+    caso, pasta, colecao = entrada
+    t0 = time.perf_counter()
+    with casos.usar(pasta, colecao) as vs:
+        lexico = IndiceLexico(pasta)
+        lexicos = lexico.buscar(pergunta, k=k, termos=exatos or None)
+        vetoriais = _vetoriais(vs, vetor, k) if vetor is not None else []
+        # Documentos do lado léxico lidos ainda com o handle em uso (pode ser despejado depois)
+        vistos = {d.id for d, _ in vetoriais}
+        docs = {d.id: d for d, _ in vetoriais}
+        docs.update({d.id: d for d in documentos_por_id(vs, [i for i, _ in lexicos if i not in vistos])})
+    acumular("multicaso.caso", time.perf_counter() - t0)
+    return {"caso": caso, "vetoriais": [(d.id, s) for d, s in vetoriais], "lexicos": lexicos, "docs": docs}
+
+# --- FUSÃO GLOBAL ---
+def fundir(respostas, k):
+    # RRF sobre os rankings globais (cosseno entre todos os casos; BM25 entre todos os casos).
+    # O mesmo fragmento (mesmo hash de arquivo) em vários casos vira um resultado com todos eles.
+    pontos, docs, casos_do_doc = Counter(), {}, {}
+    for lado in ("vetoriais", "lexicos"):
+        ranking = sorted(((s, r["caso"], i) for r in respostas for i, s in r[lado] if i in r["docs"]), key=lambda x: -x[0])
+        vistos = set()
+        for s, caso, i in ranking:
+            casos_do_doc.setdefault(i, [])
+            if caso not in casos_do_doc[i]: casos_do_doc[i].append(caso)
+            if i in vistos: continue
+            vistos.add(i)
+            pontos[i] += 1 / (RRF_K + len(vistos))
+    for r in respostas:
+        for i, d in r["docs"].items(): docs.setdefault(i, d)
+    saida = []
+    for i, p in pontos.most_common(k):
+        d = docs[i]
+        d.metadata = {**d.metadata, "caso": casos_do_doc[i][0], "casos": casos_do_doc[i], "pontuacao": round(p, 5)}
+        saida.append(d)
+    return saida
+
+def _consultar(casos, entradas, pergunta, vetor, exatos, k_por_caso, workers, prazo):
+    respostas, erros = [], {}
+    pool = ThreadPoolExecutor(max_workers=max(1, min(workers, len(entradas))), thread_name_prefix="nemesis-multicaso")
+    try:
+        futuros = {pool.submit(no_contexto(buscar_no_caso), casos, e, pergunta, vetor, exatos, k_por_caso): e[0] for e in entradas}
+        prontos, pendentes = wait(futuros, timeout=max(0.0, prazo))
+        for f in prontos:
+            try: respostas.append(f.result())
+            except Exception as e: erros[futuros[f]] = str(e)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True) # Os atrasados terminam sozinhos em segundo plano
+    return respostas, erros, sorted(futuros[f] for f in pendentes)
+
+def buscar_em_casos(casos, entradas, pergunta, embeddings, k=5, k_por_caso=K_POR_CASO, workers=BUSCA_WORKERS, prazo=PRAZO_BUSCA):
+    # Consulta todos os casos em paralelo (pool de threads sobre o pool de bancos) e devolve o top-k global.
+    # A pergunta é embedada uma vez só; caso lento ou com erro fica de fora, a resposta não espera.
+    t0 = time.perf_counter()
+    respostas, erros, atrasados = [], {}, []
+    # 1. Identificador exato (processo/CPF/CNPJ): só BM25, sem embedding
+    exatos = identificadores(_normalizar(pergunta))
+    if exatos and entradas:
+        with etapa("multicaso.busca", casos=len(entradas), modo="exato"):
+            respostas, erros, atrasados = _consultar(casos, entradas, pergunta, None, exatos, k_por_caso, workers, prazo)
+    # 2. Híbrido (BM25 + vetorial) em todos os casos
+    if entradas and not any(r["lexicos"] for r in respostas):
+        with etapa("multicaso.embedding"): vetor = embeddings.embed_query(pergunta)
+        with etapa("multicaso.busca", casos=len(entradas), modo="hibrido"):
+            respostas, erros, atrasados = _consultar(casos, entradas, pergunta, vetor, None, k_por_caso, workers,
+                                                     prazo - (time.perf_counter() - t0))
+    with etapa("multicaso.fusao"): docs = fundir(respostas, k)
+    contar("multicaso_buscas")
+    if atrasados: contar("multicaso_casos_atrasados", len(atrasados))
+    return {"docs": docs, "consultados": len(entradas), "responderam": len(respostas), "atrasados": atrasados,
+            "erros": erros, "segundos": round(time.perf_counter() - t0, 3)}
@@ -0,0 +1,273 @@
+import os
+import math
+import sqlite3
+import hashlib
+import threading
+import subprocess
+from io import BytesIO
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytesseract
+from PIL import Image, ImageOps, ImageStat
+import fitz  # PyMuPDF
+import numpy as np
+
+from nemesis_telemetria import contar
+
+# tesserocr (API C do Tesseract) é opcional: mantém uma instância viva por processo, com os idiomas já carregados
+try:
+    import tesserocr
+    TEM_TESSEROCR = True
+except ImportError:
+    TEM_TESSEROCR = False
+
+# --- CONFIGURAÇÃO ---
+# Nº de processos para OCR de páginas digitalizadas (NEMESIS_OCR_WORKERS=1 desliga o paralelismo)
+OCR_WORKERS = int(os.environ.get("NEMESIS_OCR_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+OCR_IDIOMAS = 'por+eng'
+VERSAO_OCR = 2 # Muda quando a renderização/pré-processamento muda (invalida o cache de páginas)
+MIN_CHARS_TEXTO = 5 # Abaixo disso a página é tratada como digitalizada
+
+# DPI da renderização: escolhido por página a partir de uma prévia em baixa resolução
+DPI_PREVIA = 72 # A4 = 0,5 MP: barato e ainda separa texto de fundo
+DPI_ESPARSO = 200 # Pouca tinta (letras grandes, slides)
+DPI_PADRAO = 300
+DPI_DENSO = 400 # Muita tinta ou página pequena (recibos, letra miúda)
+DPI_MIN = 150
+MAX_MEGAPIXELS = 16 # Plantas/A3 descem o DPI para não estourar memória nem tempo
+CONTRASTE_TINTA = 64 # Pixel a mais que isso do tom de fundo conta como tinta
+TINTA_VAZIA = 0.003 # Fração de tinta abaixo da qual a página está em branco (não vai ao OCR)
+TINTA_ESPARSA = 0.03
+TINTA_DENSA = 0.18
+LARGURA_PEQUENA_POL = 4.5 # Página mais estreita que isso = recibo/cupom
+
+# --- MOTOR DE OCR (UM POR PROCESSO/THREAD) ---
+def _tessdata():
+    # TESSDATA_PREFIX ou a pasta tessdata ao lado do executável configurado (instalação do Windows)
+    if os.environ.get("TESSDATA_PREFIX"): return os.environ["TESSDATA_PREFIX"]
+    pasta = os.path.join(os.path.dirname(pytesseract.pytesseract.tesseract_cmd), "tessdata")
+    return pasta if os.path.isdir(pasta) else None
+
+class MotorOCR:
+    # Com tesserocr o Tesseract fica carregado e recebe o buffer da imagem direto da memória.
+    # Sem ele (instalação padrão: não está no requirements.txt), cada PÁGINA ainda sobe um processo tesseract;
+    # o ganho aí é só a imagem ir por pipe (stdin/stdout), sem arquivos temporários nem PNG.
+    def __init__(self, idiomas=OCR_IDIOMAS):
+        self.idiomas = idiomas
+        self._api = None
+        self._pipe = True
+        if TEM_TESSEROCR:
+            try:
+                tessdata = _tessdata()
+                self._api = tesserocr.PyTessBaseAPI(path=tessdata, lang=idiomas) if tessdata else tesserocr.PyTessBaseAPI(lang=idiomas)
+            except Exception:
+                self._api = None # tessdata sem os idiomas, versão incompatível...: cai no executável
+
+    @property
+    def nome(self):
+        return "tesserocr" if self._api else "tesseract"
+
+    def ler_bytes(self, dados, largura, altura, por_linha):
+        # Imagem em tons de cinza (1 byte por pixel), como sai do get_pixmap(colorspace=csGRAY)
+        if self._api:
+            self._api.SetImageBytes(bytes(dados), largura, altura, 1, por_linha) # tesserocr só aceita bytes (copia para o Pix de qualquer jeito)
+            return self._api.GetUTF8Text()
+        return self._ler_processo(Image.frombuffer("L", (largura, altura), dados, "raw", "L", por_linha, 1))
+
+    def ler_imagem(self, img):
+        if self._api:
+            self._api.SetImage(img)
+            return self._api.GetUTF8Text()
+        return self._ler_processo(img)
+
+    def _ler_processo(self, img):
+        if self._pipe:
+            try:
+                buffer = _imagem_pnm(img)
+                args = pytesseract.pytesseract.subprocess_args() # Esconde a janela do console no Windows
+                args.pop("stdin", None)
+                r = subprocess.run([pytesseract.pytesseract.tesseract_cmd, "stdin", "stdout", "-l", self.idiomas],
+                                   input=buffer, **args)
+                if r.returncode == 0: return r.stdout.decode("utf-8", errors="replace")
+            except OSError:
+                pass
+            self._pipe = False # Tesseract antigo sem suporte a stdin: volta ao caminho do pytesseract
+        return pytesseract.image_to_string(img, lang=self.idiomas)
+
+    def fechar(self):
+        if self._api:
+            self._api.End()
+            self._api = None
+
+def _imagem_pnm(img):
+    # PGM/PPM sem compressão: nada a codificar, o Leptonica lê direto do pipe
+    buffer = BytesIO()
+    img.save(buffer, format="PPM")
+    return buffer.getvalue()
+
+_motores = threading.local()
+
+def get_motor():
+    motor = getattr(_motores, "motor", None)
+    if motor is None: motor = _motores.motor = MotorOCR()
+    return motor
+
+# --- OCR DE IMAGEM ---
+def preparar_imagem(img):
+    # Uma conversão para cinza; a média vem do histograma (sem copiar a imagem para numpy).
+    # Dark Mode: fundo escuro atrapalha o Tesseract, inverte para texto escuro em fundo claro.
+    cinza = img if img.mode == "L" else img.convert("L")
+    if ImageStat.Stat(cinza).mean[0] < 127: return ImageOps.invert(cinza)
+    return cinza
+
+def ocr_imagem(img):
+    return get_motor().ler_imagem(preparar_imagem(img))
+
+# --- PÁGINA DE PDF: DPI ADAPTATIVO + RENDERIZAÇÃO EM CINZA ---
+def analisar_pagina(pag):
+    # Prévia em cinza: decide DPI (tamanho da página e densidade de tinta) e dark mode numa passada só
+    previa = pag.get_pixmap(dpi=DPI_PREVIA, colorspace=fitz.csGRAY)
+    px = np.frombuffer(previa.samples_mv, dtype=np.uint8) # View do buffer do pixmap, sem cópia
+    if px.size == 0: return {"dpi": DPI_PADRAO, "escuro": False, "tinta": 1.0}
+    fundo = int(np.median(px))
+    escuro = fundo < 127
+    tinta = float(np.count_nonzero(np.abs(px.astype(np.int16) - fundo) > CONTRASTE_TINTA)) / px.size
+    largura_pol, altura_pol = pag.rect.width / 72, pag.rect.height / 72
+    if tinta < TINTA_ESPARSA: dpi = DPI_ESPARSO
+    elif tinta > TINTA_DENSA or largura_pol < LARGURA_PEQUENA_POL: dpi = DPI_DENSO
+    else: dpi = DPI_PADRAO
+    teto = math.sqrt(MAX_MEGAPIXELS * 1e6 / max(largura_pol * altura_pol, 1e-6))
+    return {"dpi": int(max(DPI_MIN, min(dpi, teto))), "escuro": escuro, "tinta": tinta}
+
+def ocr_pagina(pag):
+    info = analisar_pagina(pag)
+    if info["tinta"] < TINTA_VAZIA: return "" # Página em branco (verso de folha digitalizada)
+    pix = pag.get_pixmap(dpi=info["dpi"], colorspace=fitz.csGRAY, alpha=False)
+    if info["escuro"]: pix.invert_irect() # No próprio buffer
+    return get_motor().ler_bytes(pix.samples_mv, pix.width, pix.height, pix.stride) # View do buffer, sem cópia
+
+def hash_pagina(doc, pag):
+    # Conteúdo da página + imagens embutidas (streams ainda comprimidos): não precisa renderizar
+    h = hashlib.sha256()
+    h.update(f"{pag.rotation}:{tuple(pag.rect)}".encode())
+    h.update(pag.read_contents() or b"")
+    for img in pag.get_images(full=True):
+        try: h.update(doc.xref_stream_raw(img[0]) or b"")
+        except Exception: h.update(str(img).encode())
+    return h.hexdigest()
+
+# --- CACHE DE OCR (POR HASH DA PÁGINA) ---
+class CacheOCR:
+    # Mesma página em outro PDF (re-digitalização, anexo repetido) ou job retomado no meio: não refaz o OCR
+    def __init__(self, pasta):
+        os.makedirs(pasta, exist_ok=True)
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(os.path.join(pasta, "ocr.sqlite"), check_same_thread=False)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("""CREATE TABLE IF NOT EXISTS paginas (
+            hash TEXT, versao TEXT, texto TEXT, PRIMARY KEY (hash, versao))""")
+        self._con.commit()
+        self.versao = f"{OCR_IDIOMAS}:{VERSAO_OCR}"
+        self.hits = 0
+        self.misses = 0
+
+    def buscar(self, h):
+        with self._lock:
+            linha = self._con.execute("SELECT texto FROM paginas WHERE hash = ? AND versao = ?", (h, self.versao)).fetchone()
+            if linha: self.hits += 1
+            else: self.misses += 1
+        return linha[0] if linha else None
+
+    def salvar(self, h, texto):
+        with self._lock:
+            self._con.execute("INSERT OR REPLACE INTO paginas VALUES (?, ?, ?)", (h, self.versao, texto))
+            self._con.commit()
+
+    def fechar(self):
+        with self._lock: self._con.close()
+
+# --- WORKERS (POOL PERSISTENTE, UM MOTOR DE OCR POR PROCESSO) ---
+def _iniciar_worker(tesseract_cmd):
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    get_motor() # tesserocr carrega os idiomas uma vez aqui
+
+def _ocr_pagina_worker(caminho_pdf, indice):
+    # Abre e fecha o PDF a cada página (<1 ms, o MuPDF só lê o xref): o worker não fica segurando o
+    # arquivo depois do job, senão o Windows impede a fila de apagar _cache/fila/<id>
+    with fitz.open(caminho_pdf) as doc: return indice, ocr_pagina(doc[indice])
+
+_pool = None
+_pool_config = None
+_lock_pool = threading.Lock()
+
+def _get_pool(workers):
+    # O pool sobrevive entre PDFs: processos e instâncias do Tesseract são reaproveitados
+    global _pool, _pool_config
+    config = (workers, pytesseract.pytesseract.tesseract_cmd)
+    with _lock_pool:
+        if _pool is None or _pool_config != config:
+            if _pool is not None: _pool.shutdown(cancel_futures=True)
+            _pool = ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_worker, initargs=(config[1],))
+            _pool_config = config
+        return _pool
+
+def encerrar_pool():
+    global _pool, _pool_config
+    with _lock_pool:
+        if _pool is not None: _pool.shutdown(cancel_futures=True)
+        _pool, _pool_config = None, None
+
+# --- PDF HÍBRIDO (STREAMING) ---
+def _resolver(item, cache):
+    if isinstance(item, str): return item
+    h, futuro = item
+    texto = futuro.result()[1]
+    if cache and h: cache.salvar(h, texto)
+    return texto
+
+def iterar_paginas_pdf(caminho_pdf, ao_progresso=None, workers=None, ocr=True, cache=None):
+    # Gera o texto de cada página, na ordem original, assim que fica pronto.
+    # Páginas com camada de texto ficam no processo atual; as digitalizadas vão para o pool,
+    # com no máximo 2x workers páginas em voo (memória limitada mesmo em PDFs enormes).
+    workers = OCR_WORKERS if workers is None else workers
+    doc = fitz.open(caminho_pdf)
+    total = len(doc)
+    pendentes = deque() # texto pronto (str) ou (hash, Future), na ordem das páginas
+    feitas = 0
+    try:
+        for pag in doc:
+            t = pag.get_text()
+            if ocr and len(t.strip()) < MIN_CHARS_TEXTO:
+                h = hash_pagina(doc, pag) if cache else None
+                t = cache.buscar(h) if cache else None
+                if cache: contar("ocr_paginas_cache" if t is not None else "ocr_paginas_novas")
+                if t is None:
+                    if workers <= 1:
+                        t = ocr_pagina(pag)
+                        if cache: cache.salvar(h, t)
+                    else:
+                        t = (h, _get_pool(workers).submit(_ocr_pagina_worker, os.path.abspath(caminho_pdf), pag.number))
+            pendentes.append(t)
+            # Janela cheia: espera a página mais antiga antes de ler a próxima
+            while pendentes and (isinstance(pendentes[0], str) or len(pendentes) > 2 * workers):
+                texto = _resolver(pendentes.popleft(), cache)
+                feitas += 1
+                if ao_progresso: ao_progresso(feitas, total)
+                yield texto
+        while pendentes:
+            texto = _resolver(pendentes.popleft(), cache)
+            feitas += 1
+            if ao_progresso: ao_progresso(feitas, total)
+            yield texto
+    except BrokenProcessPool:
+        encerrar_pool() # Worker morreu (falta de memória, DLL do Tesseract): o próximo PDF recria o pool
+        raise
+    finally:
+        for item in pendentes:
+            if not isinstance(item, str): item[1].cancel() # Gerador abandonado: não deixa páginas na fila do pool
+        doc.close()
+
+def extrair_paginas_pdf(caminho_pdf, ao_progresso=None, workers=None, ocr=True, cache=None):
+    return list(iterar_paginas_pdf(caminho_pdf, ao_progresso=ao_progresso, workers=workers, ocr=ocr, cache=cache))
@@ -0,0 +1,322 @@
+import os
+import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+from nemesis_extratores import RegistroExtratores, BACKENDS
+from nemesis_cache import hash_arquivo, ids_fragmentos, ja_indexado
+from nemesis_telemetria import etapa, acumular, contar, no_contexto
+
+# --- CONFIGURAÇÃO ---
+TAMANHO_CHUNK = 2000
+SOBREPOSICAO_CHUNK = 200
+EMBED_CONCORRENCIA = int(os.environ.get("NEMESIS_EMBED_CONCORRENCIA", 4)) # Requisições de embedding em voo
+ALVO_SEGUNDOS_LOTE = 2.0 # Lote é redimensionado para levar ~isso no Ollama
+LOTE_INICIAL = 64
+LOTE_MIN = 8
+LOTE_MAX = 2048 # Nunca passa do max_batch_size do ChromaDB (~5461)
+
+ORIGENS = {
+    'pdf': "PDF",
+    'jpg': "IMAGEM", 'jpeg': "IMAGEM", 'png': "IMAGEM",
+    'wav': "ÁUDIO", 'mp3': "ÁUDIO",
+    'xlsx': "PLANILHA", 'xls': "PLANILHA", 'csv': "PLANILHA",
+}
+
+def novo_splitter():
+    return RecursiveCharacterTextSplitter(chunk_size=TAMANHO_CHUNK, chunk_overlap=SOBREPOSICAO_CHUNK)
+
+# --- EXTRATORES (GERADORES DE TEXTO POR PÁGINA/PARTE) ---
+# Padrão sem pasta de cache: só PDF e imagem (áudio e planilha vêm de criar_extratores)
+EXTRATORES = RegistroExtratores(backends={ext: b for ext, b in BACKENDS.items() if b[0] in ("pdf", "imagem")})
+
+# --- FATIAMENTO INCREMENTAL ---
+class FatiadorIncremental:
+    # Acumula páginas num buffer curto e só libera fragmentos "fechados";
+    # o último fragmento volta para o buffer e continua com a próxima página (mantém a sobreposição).
+    def __init__(self, splitter, metadata, limite=TAMANHO_CHUNK * 4):
+        self.splitter = splitter
+        self.metadata = metadata
+        self.limite = limite
+        self.buffer = ""
+
+    def _docs(self, textos):
+        return [Document(page_content=t, metadata=dict(self.metadata)) for t in textos]
+
+    def alimentar(self, texto):
+        self.buffer += texto
+        if len(self.buffer) < self.limite: return []
+        partes = self.splitter.split_text(self.buffer)
+        if len(partes) <= 1: return []
+        self.buffer = partes[-1]
+        return self._docs(partes[:-1])
+
+    def finalizar(self):
+        partes = self.splitter.split_text(self.buffer) if self.buffer.strip() else []
+        self.buffer = ""
+        return self._docs(partes)
+
+# --- GRAVAÇÃO CONCORRENTE COM LOTE ADAPTATIVO ---
+def limite_lote_chroma(vectorstore):
+    # ChromaDB recusa lotes acima do max_batch_size do cliente (~5461 no SQLite)
+    cliente = getattr(vectorstore, "_client", None)
+    try: return int(cliente.get_max_batch_size())
+    except Exception: return int(getattr(cliente, "max_batch_size", 5461) or 5461)
+
+class EscritorEmbeddings:
+    # Vários lotes sendo embedados ao mesmo tempo (pool de threads) e uma thread só para o upsert
+    # no Chroma: enquanto o lote N grava, os lotes N+1.. já estão no Ollama.
+    # O tamanho do lote segue a latência medida, mirando ALVO_SEGUNDOS_LOTE por chamada.
+    def __init__(self, vectorstore, concorrencia=EMBED_CONCORRENCIA, alvo_segundos=ALVO_SEGUNDOS_LOTE, lexico=None):
+        self.vectorstore = vectorstore
+        self.lexico = lexico # Índice BM25 do caso, atualizado junto com o Chroma
+        self.embeddings = getattr(vectorstore, "embeddings", None)
+        self.lote_max = max(LOTE_MIN, min(LOTE_MAX, limite_lote_chroma(vectorstore)))
+        self.lote = min(LOTE_INICIAL, self.lote_max)
+        self.alvo_segundos = alvo_segundos
+        self.erro = None
+        self.gravados = 0
+        self._pendente = []
+        self._lock = threading.Lock()
+        self._vagas = threading.BoundedSemaphore(concorrencia * 2) # Lotes em voo (limita memória)
+        self._pool_embed = ThreadPoolExecutor(max_workers=concorrencia, thread_name_prefix="nemesis-embed")
+        self._pool_grava = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nemesis-chroma")
+        self._inicio = None
+        self._fim = None
+
+    def _ajustar_lote(self, segundos, qtd):
+        if qtd == 0 or segundos <= 0: return
+        ideal = self.alvo_segundos / (segundos / qtd)
+        with self._lock:
+            self.lote = int(min(self.lote_max, max(LOTE_MIN, 0.5 * self.lote + 0.5 * ideal)))
+
+    def _embedar(self, lote):
+        try:
+            if self.erro: return self._vagas.release()
+            if self.embeddings is None:
+                # Sem função de embedding exposta: deixa o próprio vectorstore embedar
+                return self._pool_grava.submit(no_contexto(self._gravar), lote, None)
+            t0 = time.perf_counter()
+            with etapa("embedding.lote", itens=len(lote)):
+                vetores = self.embeddings.embed_documents([d.page_content for _, d in lote])
+            self._ajustar_lote(time.perf_counter() - t0, len(lote))
+            self._pool_grava.submit(no_contexto(self._gravar), lote, vetores)
+        except Exception as e:
+            self.erro = self.erro or e
+            self._vagas.release()
+
+    def _gravar(self, lote, vetores):
+        try:
+            if self.erro: return
+            ids = [k for k, _ in lote]
+            with etapa("chroma.upsert", itens=len(lote)):
+                if vetores is None:
+                    self.vectorstore.add_documents([d for _, d in lote], ids=ids)
+                else:
+                    self.vectorstore._collection.upsert(
+                        ids=ids, embeddings=vetores,
+                        documents=[d.page_content for _, d in lote],
+                        metadatas=[d.metadata for _, d in lote])
+            if self.lexico is not None:
+                with etapa("bm25.indexar", itens=len(lote)): self.lexico.adicionar(ids, [d.page_content for _, d in lote])
+            contar("fragmentos_gravados", len(lote))
+            with self._lock:
+                self.gravados += len(lote)
+                self._fim = time.perf_counter()
+        except Exception as e:
+            self.erro = self.erro or e
+        finally:
+            self._vagas.release()
+
+    def _enviar(self, lote):
+        if self.erro: raise self.erro
+        self._vagas.acquire()
+        if self._inicio is None: self._inicio = time.perf_counter()
+        self._pool_embed.submit(no_contexto(self._embedar), lote)
+
+    def adicionar(self, ids, docs):
+        self._pendente.extend(zip(ids, docs))
+        while len(self._pendente) >= self.lote:
+            corte = self.lote
+            self._enviar(self._pendente[:corte])
+            self._pendente = self._pendente[corte:]
+
+    def fechar(self):
+        try:
+            if self._pendente and not self.erro: self._enviar(self._pendente)
+            self._pendente = []
+        finally:
+            self._pool_embed.shutdown(wait=True)
+            self._pool_grava.shutdown(wait=True)
+        if self.erro: raise self.erro
+
+    def estatisticas(self):
+        duracao = (self._fim - self._inicio) if self._inicio and self._fim else 0.0
+        return {"fragmentos": self.gravados, "segundos": round(duracao, 2),
+                "fragmentos_por_segundo": round(self.gravados / duracao, 1) if duracao else 0.0,
+                "lote_atual": self.lote}
+
+# --- PIPELINE ---
+def texto_do_cache(cache, h, nome, origem):
+    # Texto já extraído de um arquivo, no mesmo formato da memória imediata
+    yield f"--- {origem}: {nome} ---\n"
+    for texto, meta in cache.partes(h): yield texto if meta is None else texto + "\n"
+
+def _ingerir_um(nome, caminho, h, vectorstore, cache, extratores, gravador, splitter, ao_progresso, ao_texto):
+    ext = nome.split('.')[-1].lower()
+    registro = cache.buscar(h)
+    origem = registro["origem"] if registro else ORIGENS.get(ext, "")
+    resultado = {"nome": nome, "hash": h, "origem": origem, "status": "novo", "fragmentos": 0, "ids": [], "erro": None}
+
+    if registro:
+        resultado["status"] = "cache"
+        partes = cache.partes(h)
+        if ja_indexado(vectorstore, registro["chunk_ids"]):
+            # Já está neste caso: só repassa o texto para a memória imediata
+            resultado["status"] = "ja_indexado"
+            resultado["fragmentos"] = len(registro["chunk_ids"])
+            if ao_texto:
+                for texto in texto_do_cache(cache, h, nome, origem): ao_texto(texto)
+            return resultado
+    elif ext in extratores:
+        cache.iniciar(h)
+        partes = extratores[ext](caminho, ao_progresso=ao_progresso)
+    else:
+        resultado["status"] = "vazio"
+        return resultado
+
+    cabecalho = f"--- {origem}: {nome} ---\n"
+    base_meta = {"source_name": nome, "hash": h}
+    fatiador = FatiadorIncremental(splitter, base_meta)
+    cabecalho_pendente = True
+    total_chars = 0
+    n_parte = 0
+    if ao_texto: ao_texto(cabecalho)
+    rotulo = f"extracao.{origem or ext}"
+    t0 = time.perf_counter()
+    for parte in partes:
+        # Tempo parado esperando a próxima parte = OCR / Whisper / leitura da planilha (ou cache)
+        agora = time.perf_counter()
+        acumular(rotulo if not registro else "extracao.cache", agora - t0)
+        # Extrator pode gerar texto corrido (str) ou fragmentos prontos (Document, ex.: grupos de linhas)
+        if registro: texto, meta = parte
+        elif isinstance(parte, Document): texto, meta = parte.page_content, parte.metadata
+        else: texto, meta = parte + "\n", None
+        if not registro:
+            with etapa("cache.parte"): cache.adicionar_parte(h, n_parte, texto, meta)
+            n_parte += 1
+        total_chars += len(texto.strip())
+        if ao_texto: ao_texto(texto if meta is None else texto + "\n")
+        with etapa("fatiamento"):
+            if meta is not None:
+                prontos = [Document(page_content=cabecalho + texto, metadata={**base_meta, **meta})]
+            else:
+                if cabecalho_pendente:
+                    fatiador.alimentar(cabecalho)
+                    cabecalho_pendente = False
+                prontos = fatiador.alimentar(texto)
+        if prontos and gravador:
+            ids = ids_fragmentos(h, len(prontos), inicio=len(resultado["ids"]))
+            resultado["ids"].extend(ids)
+            with etapa("gravacao.fila"): gravador.adicionar(ids, prontos) # Bloqueia só quando há lotes demais em voo
+        t0 = time.perf_counter()
+    acumular(rotulo if not registro else "extracao.cache", time.perf_counter() - t0, n=0)
+
+    if total_chars <= 2:
+        resultado["status"] = "vazio"
+        if not registro: cache.descartar(h)
+        return resultado
+    if not registro: cache.concluir(h, nome, origem)
+
+    with etapa("fatiamento"): prontos = fatiador.finalizar()
+    if prontos and gravador:
+        ids = ids_fragmentos(h, len(prontos), inicio=len(resultado["ids"]))
+        resultado["ids"].extend(ids)
+        gravador.adicionar(ids, prontos)
+    resultado["fragmentos"] = len(resultado["ids"])
+    return resultado
+
+def ingerir_arquivos(vectorstore, fontes, cache, extratores=None, ao_progresso=None, ao_arquivo=None, ao_texto=None, lexico=None):
+    # fontes: iterável de (nome, caminho) consumido um arquivo por vez.
+    # ao_progresso(indice, nome, fração do arquivo) / ao_arquivo(resultado) / ao_texto(parte)
+    extratores = EXTRATORES if extratores is None else extratores
+    splitter = novo_splitter()
+    gravador = EscritorEmbeddings(vectorstore, lexico=lexico) if vectorstore is not None else None
+    resultados = []
+    vistos = set()
+    try:
+        for i, (nome, caminho) in enumerate(fontes):
+            def progresso_arquivo(feitas, total, i=i, nome=nome):
+                if ao_progresso: ao_progresso(i, nome, feitas / max(total, 1))
+            try:
+                with etapa("hash"): h = hash_arquivo(caminho)
+                if h in vistos: continue # Mesmo arquivo duas vezes no mesmo lote
+                vistos.add(h)
+                with etapa("arquivo", arquivo=nome) as span:
+                    r = _ingerir_um(nome, caminho, h, vectorstore, cache, extratores, gravador, splitter, progresso_arquivo, ao_texto)
+                    span.atributo("status", r["status"])
+                contar(f"arquivos_{r['status']}")
+            except Exception as e:
+                r = {"nome": nome, "hash": None, "origem": "", "status": "erro", "fragmentos": 0, "ids": [], "erro": e}
+            resultados.append(r)
+            if ao_progresso: ao_progresso(i, nome, 1.0)
+            if ao_arquivo: ao_arquivo(r)
+    finally:
+        if gravador:
+            with etapa("gravacao.final"): gravador.fechar() # Espera os lotes que ainda estão no Ollama/Chroma
+
+    # Só registra os IDs depois que tudo foi gravado
+    for r in resultados:
+        if r["ids"] and r["status"] in ("novo", "cache"): cache.salvar_chunks(r["hash"], r["ids"])
+    return resultados, (gravador.estatisticas() if gravador else {})
+
+ID_COM_HASH = re.compile(r"^([0-9a-f]{64}):\d+$") # ids_fragmentos()
+
+def migrar_hash_nos_metadados(vectorstore, lote=LOTE_MAX):
+    # Uma vez por caso: fragmentos com ID "<hash>:<n>" gravados antes do metadado "hash" passam a tê-lo,
+    # para a remoção achar tudo com where={"hash": ...} sem varrer o banco. Retorna quantos mudaram.
+    corrigidos, offset = 0, 0
+    while True:
+        dados = vectorstore._collection.get(include=["metadatas"], limit=lote, offset=offset)
+        ids, metadados = [], []
+        for i, m in zip(dados["ids"], dados["metadatas"]):
+            achado = ID_COM_HASH.match(i)
+            if achado and not (m or {}).get("hash"):
+                ids.append(i)
+                metadados.append({**(m or {}), "hash": achado.group(1)})
+        if ids: vectorstore._collection.update(ids=ids, metadatas=metadados)
+        corrigidos += len(ids)
+        if len(dados["ids"]) < lote: break
+        offset += lote
+    contar("fragmentos_migrados", corrigidos)
+    return corrigidos
+
+def _sem_hash(vectorstore, where):
+    achados = vectorstore._collection.get(where=where, include=["metadatas"])
+    return [i for i, m in zip(achados["ids"], achados["metadatas"]) if not (m or {}).get("hash")]
+
+def remover_fontes(vectorstore, hashes, lexico=None, caminhos=()):
+    # Tira do banco (e do índice léxico, mesmos IDs) todos os fragmentos de cada arquivo de origem.
+    # caminhos: caminho completo dos arquivos; só serve para fragmentos anteriores ao hash que o guardaram
+    # em "source" (CLI antiga). Upload antigo do app só tem o nome, que pode repetir em outra subpasta:
+    # esses ficam no banco, com aviso. Retorna quantos saíram.
+    ids = set()
+    for h in hashes: ids.update(vectorstore._collection.get(where={"hash": h}, include=[])["ids"])
+    mantidos = 0
+    for caminho in caminhos:
+        ids.update(_sem_hash(vectorstore, {"source": caminho}))
+        mantidos += len(_sem_hash(vectorstore, {"source_name": os.path.basename(caminho)}))
+    if mantidos:
+        contar("fragmentos_antigos_mantidos", mantidos)
+        print(f"⚠️ AVISO: {mantidos} fragmento(s) antigo(s) sem hash nem caminho completo não foram removidos "
+              f"(só o nome do arquivo não identifica a origem).", flush=True)
+    ids = sorted(ids)
+    for inicio in range(0, len(ids), LOTE_MAX):
+        vectorstore._collection.delete(ids=ids[inicio:inicio + LOTE_MAX])
+    if lexico is not None and ids: lexico.remover(ids)
+    contar("fragmentos_removidos", len(ids))
+    return len(ids)
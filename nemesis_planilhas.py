@@ -0,0 +1,283 @@
+import os
+import re
+import csv
+import json
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from langchain_core.documents import Document
+
+from nemesis_cache import hash_arquivo
+
+# pandas/pyarrow são importados dentro das funções: só carregam quando o caso tem planilha
+
+# --- CONFIGURAÇÃO ---
+CHARS_POR_GRUPO = 1800 # Cada fragmento = cabeçalho + linhas inteiras até ~este tamanho
+LINHAS_LEITURA = 5000 # Linhas lidas do disco por vez (CSV em chunks / XLSX em streaming)
+TOP_N_PADRAO = 5
+TABELAS_EM_MEMORIA = 8 # DataFrames mantidos abertos para as consultas numéricas
+VALORES_POR_COLUNA = 50000 # Valores distintos de cada coluna de texto no índice de filtros
+PALAVRAS_POR_VALOR = 8 # Valores mais longos que isso não viram filtro
+
+# --- LEITURA EM GRUPOS DE LINHAS ---
+def _nomes_colunas(brutos):
+    nomes, vistos = [], {}
+    for i, c in enumerate(brutos):
+        nome = str(c).strip() if c is not None and str(c).strip() and not str(c).startswith("Unnamed") else f"coluna_{i + 1}"
+        if nome in vistos:
+            vistos[nome] += 1
+            nome = f"{nome}.{vistos[nome]}"
+        else: vistos[nome] = 0
+        nomes.append(nome)
+    return nomes
+
+def _celula(v):
+    if v is None or (isinstance(v, float) and v != v): return ""
+    if isinstance(v, float) and v.is_integer(): return str(int(v))
+    return str(v).replace("|", "/").replace("\n", " ").strip()
+
+def _separador_csv(caminho):
+    # Detecta ; , \t | na amostra inicial (planilhas brasileiras costumam usar ;)
+    with open(caminho, 'r', encoding='utf-8', errors='replace') as f: amostra = f.read(65536)
+    try: return csv.Sniffer().sniff(amostra, delimiters=";,\t|").delimiter
+    except csv.Error: return ","
+
+def iterar_blocos(caminho):
+    # Gera (colunas, linhas) com no máximo LINHAS_LEITURA linhas; tudo como texto
+    import pandas as pd
+    ext = caminho.split('.')[-1].lower()
+    if ext == 'csv':
+        for df in pd.read_csv(caminho, dtype=str, keep_default_na=False, chunksize=LINHAS_LEITURA,
+                              sep=_separador_csv(caminho), encoding_errors="replace"):
+            yield _nomes_colunas(df.columns), [[_celula(v) for v in linha] for linha in df.itertuples(index=False)]
+    elif ext == 'xlsx':
+        from openpyxl import load_workbook
+        wb = load_workbook(caminho, read_only=True, data_only=True)
+        try:
+            linhas = wb.worksheets[0].iter_rows(values_only=True)
+            colunas = _nomes_colunas(next(linhas, []))
+            bloco = []
+            for linha in linhas:
+                if all(v is None for v in linha): continue
+                bloco.append([_celula(v) for v in linha[:len(colunas)]] + [""] * (len(colunas) - len(linha)))
+                if len(bloco) >= LINHAS_LEITURA:
+                    yield colunas, bloco
+                    bloco = []
+            if bloco: yield colunas, bloco
+        finally:
+            wb.close()
+    else:
+        # .xls antigo: sem leitura em streaming, fatia depois de carregar
+        df = pd.read_excel(caminho, dtype=str).fillna("")
+        colunas = _nomes_colunas(df.columns)
+        for i in range(0, len(df), LINHAS_LEITURA):
+            yield colunas, [[_celula(v) for v in linha] for linha in df.iloc[i : i + LINHAS_LEITURA].itertuples(index=False)]
+
+def _linha_md(valores):
+    return "| " + " | ".join(valores) + " |"
+
+def extrair_planilha(caminho, pasta_tabelas, ao_progresso=None):
+    # Cada fragmento repete o cabeçalho e carrega o intervalo de linhas nos metadados.
+    # Em paralelo grava uma cópia colunar (Parquet) para as contas feitas em pandas.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    os.makedirs(pasta_tabelas, exist_ok=True)
+    h = hash_arquivo(caminho)
+    destino = os.path.join(pasta_tabelas, f"{h}.parquet")
+    temporario = destino + ".tmp"
+    escritor = None
+    n_linha = 1 # Linha 1 = cabeçalho, como no Excel
+    try:
+        for colunas, linhas in iterar_blocos(caminho):
+            if escritor is None:
+                esquema = pa.schema([(c, pa.string()) for c in colunas])
+                escritor = pq.ParquetWriter(temporario, esquema)
+            escritor.write_table(pa.Table.from_pylist([dict(zip(colunas, l)) for l in linhas], schema=esquema))
+
+            cabecalho = _linha_md(colunas) + "\n" + _linha_md(["---"] * len(colunas)) + "\n"
+            grupo, tamanho, inicio = [], len(cabecalho), n_linha + 1
+            for linha in linhas:
+                n_linha += 1
+                texto = _linha_md(linha)
+                if grupo and tamanho + len(texto) > CHARS_POR_GRUPO:
+                    yield Document(page_content=cabecalho + "\n".join(grupo), metadata={"linha_inicio": inicio, "linha_fim": n_linha - 1, "tabela": h})
+                    grupo, tamanho, inicio = [], len(cabecalho), n_linha
+                grupo.append(texto)
+                tamanho += len(texto) + 1
+            if grupo:
+                yield Document(page_content=cabecalho + "\n".join(grupo), metadata={"linha_inicio": inicio, "linha_fim": n_linha, "tabela": h})
+        if escritor is not None:
+            escritor.close()
+            escritor = None
+            os.replace(temporario, destino)
+    finally:
+        if escritor is not None: escritor.close()
+        if os.path.exists(temporario): os.remove(temporario)
+
+def criar_extrator_planilha(pasta_tabelas):
+    def extrator(caminho, ao_progresso=None):
+        yield from extrair_planilha(caminho, pasta_tabelas, ao_progresso=ao_progresso)
+    return extrator
+
+# --- CATÁLOGO DE TABELAS DO CASO ---
+class CatalogoTabelas:
+    # tabelas.json na pasta do caso: {hash: nome do arquivo}
+    def __init__(self, pasta_caso):
+        self.caminho = os.path.join(pasta_caso, "tabelas.json")
+
+    def tabelas(self):
+        try:
+            with open(self.caminho, 'r', encoding='utf-8') as f: return json.load(f)
+        except Exception: return {}
+
+    def registrar(self, resultados):
+        tabelas = self.tabelas()
+        novas = {r["hash"]: r["nome"] for r in resultados
+                 if r.get("origem") == "PLANILHA" and r.get("hash") and r.get("status") not in ("erro", "vazio")}
+        if not novas or all(tabelas.get(k) == v for k, v in novas.items()): return
+        tabelas.update(novas)
+        os.makedirs(os.path.dirname(self.caminho) or ".", exist_ok=True)
+        with open(self.caminho, 'w', encoding='utf-8') as f: json.dump(tabelas, f, ensure_ascii=False)
+
+    def remover(self, hashes):
+        # Planilha apagada/alterada na pasta sincronizada deixa de responder consultas numéricas
+        tabelas = self.tabelas()
+        if not any(h in tabelas for h in hashes): return
+        for h in hashes: tabelas.pop(h, None)
+        with open(self.caminho, 'w', encoding='utf-8') as f: json.dump(tabelas, f, ensure_ascii=False)
+
+# --- CONSULTAS NUMÉRICAS EM PANDAS ---
+_tabelas_abertas = OrderedDict()
+_lock_tabelas = threading.Lock()
+
+def carregar_tabela(pasta_tabelas, hash_tabela):
+    # Retorna (df, colunas numéricas já convertidas, índice de valores de texto) ou None
+    with _lock_tabelas:
+        if hash_tabela in _tabelas_abertas:
+            _tabelas_abertas.move_to_end(hash_tabela)
+            return _tabelas_abertas[hash_tabela]
+    caminho = os.path.join(pasta_tabelas, f"{hash_tabela}.parquet")
+    if not os.path.exists(caminho): return None
+    import pandas as pd
+    df = pd.read_parquet(caminho)
+    numericas = _colunas_numericas(df)
+    tabela = (df, numericas, _indice_valores(df, numericas))
+    with _lock_tabelas:
+        _tabelas_abertas[hash_tabela] = tabela
+        while len(_tabelas_abertas) > TABELAS_EM_MEMORIA: _tabelas_abertas.popitem(last=False)
+    return tabela
+
+def _normalizar(texto):
+    texto = unicodedata.normalize("NFKD", str(texto).lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+def para_numero(serie):
+    # Aceita "1.234,56", "R$ 10,00", "15%" e números no formato americano
+    import pandas as pd
+    s = serie.astype("string").str.strip().str.replace(r"[R$\s%]", "", regex=True)
+    br = s.str.contains(r",\d{1,2}$", na=False) | s.str.contains(r"^\d{1,3}(?:\.\d{3})+$", na=False)
+    s = s.where(~br, s.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    return pd.to_numeric(s, errors="coerce")
+
+def _colunas_numericas(df):
+    numericas = {}
+    for c in df.columns:
+        valores = para_numero(df[c])
+        preenchidos = (df[c].astype("string").str.strip() != "").sum()
+        if preenchidos and valores.notna().sum() >= 0.8 * preenchidos: numericas[c] = valores
+    return numericas
+
+def _mencionadas(colunas, pergunta_norm):
+    # Coluna citada pelo nome (ignora acentos/maiúsculas), nomes mais longos primeiro
+    achadas = []
+    for c in sorted(colunas, key=lambda x: -len(str(x))):
+        nome = _normalizar(c).replace("_", " ").strip()
+        if len(nome) >= 2 and re.search(rf"\b{re.escape(nome)}\b", pergunta_norm) and not any(nome in _normalizar(a) for a in achadas):
+            achadas.append(c)
+    return achadas
+
+def _palavras(texto):
+    return re.findall(r"\w+", _normalizar(texto))
+
+def _indice_valores(df, numericas):
+    # {"valor normalizado": {coluna: (ordem, valor original)}}: montado uma vez por tabela carregada,
+    # para a pergunta não varrer cada coluna de texto com regex
+    indice = {}
+    for c in df.columns:
+        if c in numericas: continue
+        valores = df[c].astype("string").str.strip()
+        for ordem, v in enumerate(valores[valores.str.len() >= 3].unique()[:VALORES_POR_COLUNA]):
+            palavras = _palavras(v)
+            if palavras and len(palavras) <= PALAVRAS_POR_VALOR: indice.setdefault(" ".join(palavras), {}).setdefault(c, (ordem, v))
+    return indice
+
+def _valores_citados(indice, pergunta_norm):
+    # Sequências de palavras da pergunta procuradas no índice; por coluna vale o 1º valor na ordem da tabela
+    palavras = _palavras(pergunta_norm)
+    citados = {}
+    for n in range(1, min(PALAVRAS_POR_VALOR, len(palavras)) + 1):
+        for i in range(len(palavras) - n + 1):
+            for c, achado in indice.get(" ".join(palavras[i:i + n]), {}).items():
+                if c not in citados or achado < citados[c]: citados[c] = achado
+    return {c: v for c, (_, v) in citados.items()}
+
+OPERACOES = [
+    ("soma", r"\b(soma|somatorio|total|somar|some)\b"),
+    ("media", r"\b(media|medio)\b"),
+    ("maiores", r"\b(maior|maiores|maximo|top|ranking)\b"),
+    ("menores", r"\b(menor|menores|minimo)\b"),
+    ("contagem", r"\b(quantos|quantas|quantidade|contagem|conte)\b"),
+]
+
+def calcular_tabela(df, numericas, indice, nome, pergunta):
+    import pandas as pd
+    q = _normalizar(pergunta)
+    ops = [op for op, padrao in OPERACOES if re.search(padrao, q)]
+    if not ops: return []
+    citadas = _mencionadas(df.columns, q)
+    alvo = [c for c in citadas if c in numericas]
+    categoricas = [c for c in citadas if c not in numericas]
+
+    # Filtros: valores de colunas de texto que aparecem literalmente na pergunta
+    mascara = pd.Series(True, index=df.index)
+    filtros = []
+    citados = _valores_citados(indice, q)
+    for c in df.columns:
+        if c not in citados: continue
+        v = citados[c]
+        mascara &= (df[c].astype("string").str.strip() == v).fillna(False).astype(bool)
+        filtros.append(f"{c} = {v}")
+    base = df[mascara]
+    grupo = next((c for c in categoricas if re.search(rf"\bpor {re.escape(_normalizar(c))}\b", q)), None)
+    m = re.search(r"\btop\s*(\d{1,3})\b|\b(\d{1,3})\s*(?:maiores|menores|primeir[oa]s)\b", q)
+    n = int(m.group(1) or m.group(2)) if m else TOP_N_PADRAO
+
+    linhas = []
+    sufixo = f" (filtro: {', '.join(filtros)})" if filtros else ""
+    if "contagem" in ops:
+        linhas.append(f"- Linhas em {nome}{sufixo}: {len(base)}")
+    for c in alvo:
+        valores = numericas[c][mascara]
+        if grupo:
+            agrupado = valores.groupby(base[grupo])
+            if "soma" in ops: linhas.append(f"- Soma de {c} por {grupo}{sufixo}:\n{agrupado.sum().sort_values(ascending=False).head(50).to_string()}")
+            if "media" in ops: linhas.append(f"- Média de {c} por {grupo}{sufixo}:\n{agrupado.mean().sort_values(ascending=False).head(50).to_string()}")
+            continue
+        if "soma" in ops: linhas.append(f"- Soma de {c}{sufixo}: {valores.sum():,.2f}")
+        if "media" in ops: linhas.append(f"- Média de {c}{sufixo}: {valores.mean():,.2f}")
+        if "maiores" in ops or "menores" in ops:
+            ordem = valores.nlargest(n) if "maiores" in ops else valores.nsmallest(n)
+            linhas.append(f"- {'Maiores' if 'maiores' in ops else 'Menores'} {n} por {c}{sufixo}:\n{base.loc[ordem.index].to_markdown(index=False)}")
+    return linhas
+
+def calcular_respostas(pergunta, pasta_tabelas, catalogo):
+    # Resultados exatos calculados sobre as planilhas do caso (vão no prompt como fatos prontos)
+    blocos = []
+    for h, nome in catalogo.tabelas().items():
+        tabela = carregar_tabela(pasta_tabelas, h)
+        if tabela is None: continue
+        try: linhas = calcular_tabela(*tabela, nome, pergunta)
+        except Exception: continue
+        if linhas: blocos.append(f"PLANILHA {nome}:\n" + "\n".join(linhas))
+    return "\n\n".join(blocos)
@@ -0,0 +1,127 @@
+import os
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict, Counter
+
+from nemesis_vetores import BancoPlano, TIPOS, garantir_backend
+
+# --- CONFIGURAÇÃO ---
+POOL_CASOS = int(os.environ.get("NEMESIS_POOL_CASOS", 4)) # Bancos Chroma abertos ao mesmo tempo
+ESPERA_FECHAR = 10.0 # Segundos que apagar/renomear/migrar um caso espera as buscas nele terminarem
+
+# --- FECHAMENTO LIMPO DE UM CLIENTE CHROMA ---
+def fechar_chroma(vectorstore):
+    # Libera os arquivos (chroma.sqlite3 / segmentos HNSW) para apagar ou renomear a pasta
+    if isinstance(vectorstore, BancoPlano): return vectorstore.fechar() # Só memmaps
+    client = getattr(vectorstore, "_client", None)
+    if client is None: return
+    if hasattr(client, "close"): # chromadb com contagem de referências
+        try:
+            client.close()
+            return
+        except Exception: pass
+    try:
+        from chromadb.api.shared_system_client import SharedSystemClient
+        client._system.stop()
+        SharedSystemClient._identifier_to_system.pop(getattr(client, "_identifier", None), None)
+    except Exception: pass
+
+# --- POOL LRU DE BANCOS POR CASO ---
+class GerenciadorCasos:
+    # Um handle por pasta de caso, compartilhado entre sessões do Streamlit e consultas da CLI.
+    # O cliente do Chroma é único por pasta dentro do processo: nunca abra um Chroma fora daqui.
+    def __init__(self, embeddings, tamanho=POOL_CASOS):
+        self.embeddings = embeddings
+        self.tamanho = max(1, tamanho)
+        self._abertos = OrderedDict() # caminho absoluto -> (coleção, Chroma ou BancoPlano)
+        self._lock = threading.RLock()
+        self._liberado = threading.Condition(self._lock) # Avisado quando a última busca de um caso termina
+        self._abrindo = {} # caminho -> trava da abertura (casos diferentes abrem em paralelo)
+        self._em_uso = Counter() # caminho -> buscas em andamento (não é despejado no meio)
+        self._fechar_depois = set() # Caminhos com fechar() pedido durante uma busca: fecham quando ela terminar
+        self.hits = 0
+        self.misses = 0
+        self.despejos = 0
+
+    def obter(self, pasta, colecao, backend=None):
+        # backend (chroma | int8 | float16) só vale para caso novo; caso existente abre o que tem no disco
+        chave = os.path.abspath(pasta)
+        with self._lock:
+            vs = self._reusar(chave, colecao)
+            if vs is not None: return vs
+            trava = self._abrindo.setdefault(chave, threading.Lock())
+        with trava: # Só quem abre a mesma pasta espera
+            with self._lock:
+                vs = self._reusar(chave, colecao)
+                if vs is not None: return vs
+                if chave in self._abertos: self._fechar(chave) # Mesma pasta, outra coleção
+                self.misses += 1
+            os.makedirs(chave, exist_ok=True)
+            if garantir_backend(chave, backend) in TIPOS:
+                vs = BancoPlano(chave, self.embeddings)
+            else:
+                from langchain_chroma import Chroma # chromadb pesa ~1s: só no primeiro banco aberto
+                vs = Chroma(collection_name=colecao, embedding_function=self.embeddings, persist_directory=chave)
+            with self._lock:
+                self._abertos[chave] = (colecao, vs)
+                self._despejar()
+            return vs
+
+    def _reusar(self, chave, colecao):
+        item = self._abertos.get(chave)
+        if not item or item[0] != colecao: return None
+        self._abertos.move_to_end(chave)
+        self.hits += 1
+        return item[1]
+
+    def _despejar(self):
+        # Mais antigos primeiro; handle em uso por uma busca fica até ela terminar
+        livres = [c for c in self._abertos if not self._em_uso[c]]
+        while len(self._abertos) > self.tamanho and livres:
+            self._fechar(livres.pop(0))
+            self.despejos += 1
+
+    @contextmanager
+    def usar(self, pasta, colecao, backend=None):
+        # Toda busca passa por aqui: o handle não é despejado nem fechado no meio dela.
+        # O pool pode passar da capacidade enquanto durarem (buscas em vários casos ao mesmo tempo)
+        chave = os.path.abspath(pasta)
+        with self._lock: self._em_uso[chave] += 1
+        try: yield self.obter(pasta, colecao, backend=backend)
+        finally:
+            with self._lock:
+                self._em_uso[chave] -= 1
+                if not self._em_uso[chave]:
+                    del self._em_uso[chave]
+                    if chave in self._fechar_depois and chave in self._abertos: self._fechar(chave)
+                    self._liberado.notify_all()
+                self._despejar()
+
+    def _fechar(self, chave):
+        _, vs = self._abertos.pop(chave)
+        self._fechar_depois.discard(chave)
+        fechar_chroma(vs)
+
+    def fechar(self, pasta, espera=0.0):
+        # Antes de apagar/renomear a pasta do caso: espera até `espera` segundos as buscas nele terminarem.
+        # Ainda em uso: fica marcado, fecha quando a última terminar (como no despejo) e retorna False,
+        # com os arquivos ainda abertos. Quem mexe na pasta tem que desistir e pedir para tentar de novo.
+        chave = os.path.abspath(pasta)
+        with self._liberado:
+            if chave not in self._abertos: return True
+            if espera: self._liberado.wait_for(lambda: not self._em_uso[chave], timeout=espera)
+            if chave not in self._abertos: return True
+            if self._em_uso[chave]:
+                self._fechar_depois.add(chave)
+                return False
+            self._fechar(chave)
+            return True
+
+    def fechar_todos(self):
+        with self._lock:
+            for chave in list(self._abertos): self.fechar(chave)
+
+    def estatisticas(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "abertos": len(self._abertos),
+                    "capacidade": self.tamanho, "despejos": self.despejos}
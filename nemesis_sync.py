@@ -0,0 +1,252 @@
+import os
+import time
+import sqlite3
+import threading
+
+from nemesis_cache import hash_arquivo
+from nemesis_extratores import EXTENSOES
+
+# watchdog é opcional: sem ele a sincronização continua manual (botão / menu)
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    TEM_WATCHDOG = True
+except ImportError:
+    TEM_WATCHDOG = False
+
+# --- CONFIGURAÇÃO ---
+ESPERA_OBSERVADOR = 3.0 # Segundos sem eventos antes de sincronizar (cópias grandes geram vários eventos)
+IGNORAR_PREFIXOS = ("~$", ".~lock", ".") # Travas do Office/LibreOffice e arquivos ocultos
+IGNORAR_SUFIXOS = (".tmp", ".part", ".crdownload")
+
+# --- ESTADO DA PASTA SINCRONIZADA (sync.sqlite NA PASTA DO CASO) ---
+class EstadoSync:
+    # Um registro por arquivo: mtime/tamanho evitam recalcular o hash do que não mudou.
+    # status: pendente (job na fila) | indexado | erro | removendo (arquivo apagado, job removendo os fragmentos)
+    def __init__(self, pasta_caso):
+        self.caminho = os.path.join(pasta_caso, "sync.sqlite")
+
+    def _conectar(self):
+        os.makedirs(os.path.dirname(self.caminho) or ".", exist_ok=True)
+        con = sqlite3.connect(self.caminho, timeout=30)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("""CREATE TABLE IF NOT EXISTS arquivos (
+            caminho TEXT PRIMARY KEY, mtime REAL, tamanho INTEGER, hash TEXT, status TEXT, job INTEGER, atualizado REAL)""")
+        con.execute("CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT)")
+        return con
+
+    def origem(self):
+        if not os.path.exists(self.caminho): return None
+        con = self._conectar()
+        try:
+            linha = con.execute("SELECT valor FROM meta WHERE chave = 'origem'").fetchone()
+            return linha[0] if linha else None
+        finally: con.close()
+
+    def definir_origem(self, pasta):
+        con = self._conectar()
+        try:
+            with con:
+                anterior = con.execute("SELECT valor FROM meta WHERE chave = 'origem'").fetchone()
+                # Outra pasta: os arquivos da antiga passam a contar como apagados na próxima sincronização
+                con.execute("INSERT OR REPLACE INTO meta (chave, valor) VALUES ('origem', ?)", (os.path.abspath(pasta),))
+                return anterior is not None and anterior[0] != os.path.abspath(pasta)
+        finally: con.close()
+
+    def meta(self, chave):
+        con = self._conectar()
+        try:
+            linha = con.execute("SELECT valor FROM meta WHERE chave = ?", (chave,)).fetchone()
+            return linha[0] if linha else None
+        finally: con.close()
+
+    def definir_meta(self, chave, valor):
+        con = self._conectar()
+        try:
+            with con: con.execute("INSERT OR REPLACE INTO meta (chave, valor) VALUES (?, ?)", (chave, valor))
+        finally: con.close()
+
+    def registros(self):
+        con = self._conectar()
+        try: return {r["caminho"]: dict(r) for r in con.execute("SELECT * FROM arquivos")}
+        finally: con.close()
+
+    def gravar(self, linhas):
+        # linhas: [(caminho, mtime, tamanho, hash, status, job)]
+        if not linhas: return
+        con = self._conectar()
+        try:
+            with con:
+                agora = time.time()
+                con.executemany("INSERT OR REPLACE INTO arquivos VALUES (?, ?, ?, ?, ?, ?, ?)", [(*l, agora) for l in linhas])
+        finally: con.close()
+
+    def marcar(self, caminhos, status):
+        if not caminhos: return
+        con = self._conectar()
+        try:
+            with con: con.executemany("UPDATE arquivos SET status = ?, atualizado = ? WHERE caminho = ?",
+                                      [(status, time.time(), c) for c in caminhos])
+        finally: con.close()
+
+    def apagar(self, caminhos):
+        if not caminhos: return
+        con = self._conectar()
+        try:
+            with con: con.executemany("DELETE FROM arquivos WHERE caminho = ?", [(c,) for c in caminhos])
+        finally: con.close()
+
+    def resumo(self):
+        if not os.path.exists(self.caminho): return {}
+        con = self._conectar()
+        try: return {s: n for s, n in con.execute("SELECT status, COUNT(*) FROM arquivos GROUP BY status")}
+        finally: con.close()
+
+# --- VARREDURA ---
+def aceito(nome):
+    base = os.path.basename(nome)
+    if base.startswith(IGNORAR_PREFIXOS) or base.lower().endswith(IGNORAR_SUFIXOS): return False
+    return base.rsplit(".", 1)[-1].lower() in EXTENSOES if "." in base else False
+
+def listar_arquivos(origem):
+    # {caminho relativo (com "/"): (caminho absoluto, mtime, tamanho)}
+    arquivos = {}
+    for raiz, pastas, nomes in os.walk(origem):
+        pastas[:] = [p for p in pastas if not p.startswith((".", "_"))]
+        for nome in nomes:
+            if not aceito(nome): continue
+            caminho = os.path.join(raiz, nome)
+            try: st = os.stat(caminho)
+            except OSError: continue # Apagado no meio da varredura
+            arquivos[os.path.relpath(caminho, origem).replace(os.sep, "/")] = (caminho, st.st_mtime, st.st_size)
+    return arquivos
+
+# --- RECONCILIAÇÃO COM A FILA ---
+OK_INGESTAO = ("novo", "cache", "ja_indexado", "duplicado", "vazio") # vazio: nada a indexar até o arquivo mudar
+
+def reconciliar(estado, fila, registros=None):
+    # Resultado dos jobs de sincronizações anteriores. Retorna os caminhos ainda em andamento.
+    registros = estado.registros() if registros is None else registros
+    em_andamento = set()
+    por_job = {}
+    for caminho, r in registros.items():
+        if r["status"] in ("pendente", "removendo") and r["job"]: por_job.setdefault(r["job"], []).append(r)
+    for job_id, linhas in por_job.items():
+        job = fila.job(job_id)
+        if job is not None and job["status"] in ("pendente", "rodando", "preparando"):
+            em_andamento.update(r["caminho"] for r in linhas)
+            continue
+        resultado = {a["nome"]: a["status"] for a in job["arquivos"]} if job else {}
+        ok = job is not None and job["status"] == "concluido"
+        indexados = [r["caminho"] for r in linhas if r["status"] == "pendente" and ok and resultado.get(r["caminho"]) in OK_INGESTAO]
+        falhas = [r["caminho"] for r in linhas if r["status"] == "pendente" and r["caminho"] not in indexados]
+        removidos = [r["caminho"] for r in linhas if r["status"] == "removendo" and ok]
+        estado.marcar(indexados, "indexado")
+        estado.marcar(falhas, "erro") # Vai de novo na próxima sincronização
+        estado.apagar(removidos) # Remoção que falhou fica "removendo" e é refeita
+        for caminho in indexados: registros[caminho]["status"] = "indexado"
+        for caminho in falhas: registros[caminho]["status"] = "erro"
+        for caminho in removidos: registros.pop(caminho, None)
+    return em_andamento
+
+# --- SINCRONIZAÇÃO INCREMENTAL ---
+def sincronizar(origem, pasta_caso, caso, colecao, fila):
+    # Só arquivos novos ou alterados vão para a fila; fragmentos de arquivos alterados ou apagados
+    # são removidos pelo hash de origem no mesmo job (um único escritor por banco).
+    origem = os.path.abspath(origem)
+    if not os.path.isdir(origem): raise FileNotFoundError(f"Pasta não encontrada: {origem}")
+    estado = EstadoSync(pasta_caso)
+    estado.definir_origem(origem)
+    registros = estado.registros()
+    em_andamento = reconciliar(estado, fila, registros)
+    atuais = listar_arquivos(origem)
+
+    enviar, tocar, remover, apagados = [], [], {}, [] # remover: hash -> caminhos completos que o tinham
+    resumo = {"job": None, "novos": 0, "alterados": 0, "removidos": 0, "inalterados": 0, "em_andamento": len(em_andamento)}
+    for rel, (caminho, mtime, tamanho) in sorted(atuais.items()):
+        if rel in em_andamento: continue
+        r = registros.get(rel)
+        if r and r["status"] == "indexado" and r["mtime"] == mtime and r["tamanho"] == tamanho:
+            resumo["inalterados"] += 1
+            continue
+        try: h = hash_arquivo(caminho)
+        except OSError: continue # Ainda sendo copiado / travado: fica para a próxima
+        if r and r["status"] == "indexado" and r["hash"] == h:
+            tocar.append((rel, mtime, tamanho, h, "indexado", r["job"])) # Só o mtime mudou
+            resumo["inalterados"] += 1
+            continue
+        if r and r["hash"] and r["hash"] != h and r["status"] != "erro": remover.setdefault(r["hash"], []).append(caminho)
+        resumo["alterados" if r else "novos"] += 1
+        enviar.append((rel, caminho, mtime, tamanho, h))
+    for rel, r in registros.items():
+        if rel in atuais or rel in em_andamento: continue
+        if r["hash"]: remover.setdefault(r["hash"], []).append(os.path.join(origem, *rel.split("/")))
+        apagados.append(rel)
+    resumo["removidos"] = len(apagados)
+
+    # Conteúdo que continua em outro arquivo da pasta não sai do banco
+    em_uso = {h for *_, h in enviar} | {r["hash"] for rel, r in registros.items() if rel in atuais and r["hash"]
+                                        and rel not in {e[0] for e in enviar}}
+    remover = {h: sorted(c) for h, c in sorted(remover.items()) if h not in em_uso}
+    estado.gravar(tocar)
+    if not enviar and not remover:
+        estado.apagar(apagados)
+        return resumo
+
+    job_id = fila.enviar(caso, pasta_caso, colecao, [(rel, caminho) for rel, caminho, *_ in enviar], remover=remover)
+    estado.gravar([(rel, mtime, tamanho, h, "pendente", job_id) for rel, _, mtime, tamanho, h in enviar])
+    estado.gravar([(rel, registros[rel]["mtime"], registros[rel]["tamanho"], registros[rel]["hash"], "removendo", job_id)
+                   for rel in apagados])
+    resumo["job"] = job_id
+    return resumo
+
+# --- OBSERVADOR (WATCHDOG) ---
+class ObservadorPasta:
+    # Eventos do sistema de arquivos só disparam uma sincronização incremental depois de ESPERA_OBSERVADOR
+    # segundos de silêncio; a própria sincronização descobre o que mudou (mtime/tamanho/hash).
+    def __init__(self, origem, ao_mudar, espera=ESPERA_OBSERVADOR):
+        if not TEM_WATCHDOG: raise RuntimeError("watchdog não instalado.")
+        self.origem = os.path.abspath(origem)
+        self.ao_mudar = ao_mudar
+        self.espera = espera
+        self._timer = None
+        self._lock = threading.Lock()
+        self._observer = None
+        self.ultimo = None # Último resumo (ou exceção) da sincronização disparada
+
+    def _agendar(self):
+        with self._lock:
+            if self._timer: self._timer.cancel()
+            self._timer = threading.Timer(self.espera, self._disparar)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _disparar(self):
+        try: self.ultimo = self.ao_mudar()
+        except Exception as e: self.ultimo = e
+
+    def iniciar(self):
+        observador = self
+        class Manipulador(FileSystemEventHandler):
+            def on_any_event(self, evento):
+                if evento.is_directory and evento.event_type != "deleted": return
+                caminhos = [evento.src_path, getattr(evento, "dest_path", "")]
+                if evento.is_directory or any(c and aceito(c) for c in caminhos): observador._agendar()
+        self._observer = Observer()
+        self._observer.schedule(Manipulador(), self.origem, recursive=True)
+        self._observer.daemon = True
+        self._observer.start()
+        return self
+
+    def parar(self):
+        with self._lock:
+            if self._timer: self._timer.cancel()
+        if self._observer:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
+
+    @property
+    def ativo(self):
+        return self._observer is not None and self._observer.is_alive()
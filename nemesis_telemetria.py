@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# OpenTelemetry é opcional: sem ele as etapas continuam medidas e exportadas localmente
+try:
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    TEM_OTEL = True
+except ImportError:
+    TEM_OTEL = False
+
+# --- CONFIGURAÇÃO ---
+PORTA_METRICAS = int(os.environ.get("NEMESIS_METRICAS_PORTA", 0)) # 0 = sem endpoint HTTP (só arquivo)
+INTERVALO_EXPORTACAO = 2.0 # Regrava o arquivo de métricas no máximo a cada 2s
+LIMITES_HISTOGRAMA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# --- MÉTRICAS (CONTADORES + HISTOGRAMAS POR ETAPA) ---
+class Metricas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.contadores = {}
+        self.histogramas = {} # etapa -> {"baldes": [...], "soma": s, "total": n}
+
+    def contar(self, nome, n=1):
+        with self._lock: self.contadores[nome] = self.contadores.get(nome, 0) + n
+
+    def observar(self, etapa, segundos):
+        with self._lock:
+            h = self.histogramas.get(etapa)
+            if h is None: h = self.histogramas[etapa] = {"baldes": [0] * (len(LIMITES_HISTOGRAMA) + 1), "soma": 0.0, "total": 0}
+            i = next((i for i, limite in enumerate(LIMITES_HISTOGRAMA) if segundos <= limite), len(LIMITES_HISTOGRAMA))
+            h["baldes"][i] += 1
+            h["soma"] += segundos
+            h["total"] += 1
+
+    def como_dict(self):
+        with self._lock:
+            return {"contadores": dict(self.contadores),
+                    "histogramas": {k: {**v, "baldes": list(v["baldes"])} for k, v in self.histogramas.items()}}
+
+def texto_prometheus(dados):
+    linhas = ["# TYPE nemesis_etapa_segundos histogram"]
+    for etapa, h in sorted(dados["histogramas"].items()):
+        acumulado = 0
+        for limite, qtd in zip((*LIMITES_HISTOGRAMA, "+Inf"), h["baldes"]):
+            acumulado += qtd
+            linhas.append(f'nemesis_etapa_segundos_bucket{{etapa="{etapa}",le="{limite}"}} {acumulado}')
+        linhas.append(f'nemesis_etapa_segundos_sum{{etapa="{etapa}"}} {h["soma"]:.6f}')
+        linhas.append(f'nemesis_etapa_segundos_count{{etapa="{etapa}"}} {h["total"]}')
+    linhas.append("# TYPE nemesis_total counter")
+    for nome, valor in sorted(dados["contadores"].items()):
+        linhas.append(f'nemesis_total{{nome="{nome}"}} {valor}')
+    return "\n".join(linhas) + "\n"
+
+def agregar(pasta):
+    # Soma os arquivos de todos os processos (app, CLI, workers de ingestão)
+    total = {"contadores": {}, "histogramas": {}}
+    if not os.path.isdir(pasta): return total
+    for nome in os.listdir(pasta):
+        if not nome.endswith(".json"): continue
+        try:
+            with open(os.path.join(pasta, nome), encoding="utf-8") as f: dados = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for k, v in dados.get("contadores", {}).items(): total["contadores"][k] = total["contadores"].get(k, 0) + v
+        for k, h in dados.get("histogramas", {}).items():
+            t = total["histogramas"].setdefault(k, {"baldes": [0] * len(h["baldes"]), "soma": 0.0, "total": 0})
+            t["baldes"] = [a + b for a, b in zip(t["baldes"], h["baldes"])]
+            t["soma"] += h["soma"]
+            t["total"] += h["total"]
+    return total
+
+# --- INICIALIZAÇÃO (TEMPO DE IMPORT E MEMÓRIA NA PARTIDA) ---
+BACKENDS_PESADOS = ("torch", "whisper", "fitz", "pytesseract", "pandas", "pyarrow", "chromadb",
+                    "langchain_chroma", "langchain_ollama", "langchain_community", "docx")
+
+def rss_mb():
+    # psutil (inclui processos filhos: OCR/Whisper), senão /proc, senão API do Windows
+    try:
+        import psutil
+        proc = psutil.Process()
+        total = proc.memory_info().rss
+        for filho in proc.children(recursive=True):
+            try: total += filho.memory_info().rss
+            except Exception: pass
+        return total / 1024 / 1024
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/status") as f:
+            for linha in f:
+                if linha.startswith("VmRSS:"): return int(linha.split()[1]) / 1024
+    except OSError:
+        pass
+    if os.name == "nt":
+        import ctypes
+        from ctypes import wintypes
+        class Contadores(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD), ("PeakWorkingSetSize", ctypes.c_size_t),
+                        ("WorkingSetSize", ctypes.c_size_t), ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPagedPoolUsage", ctypes.c_size_t), ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaNonPagedPoolUsage", ctypes.c_size_t), ("PagefileUsage", ctypes.c_size_t),
+                        ("PeakPagefileUsage", ctypes.c_size_t)]
+        c = Contadores()
+        c.cb = ctypes.sizeof(c)
+        ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(c), c.cb)
+        return c.WorkingSetSize / 1024 / 1024
+    return None
+
+def relatorio_inicio(processo, inicio, pasta=None):
+    # 'inicio' = time.perf_counter() na primeira linha do ponto de entrada.
+    # Cada partida vira uma linha em inicio.jsonl para acompanhar a latência de import ao longo do tempo.
+    segundos = time.perf_counter() - inicio
+    rss = rss_mb()
+    dados = {"processo": processo, "quando": time.time(), "segundos": round(segundos, 3),
+             "rss_mb": round(rss, 1) if rss is not None else None,
+             "carregados": [m for m in BACKENDS_PESADOS if m in sys.modules]}
+    _metricas.observar("inicio.importacao", segundos)
+    pasta = pasta or _config["pasta"]
+    if pasta:
+        try:
+            os.makedirs(pasta, exist_ok=True)
+            with open(os.path.join(pasta, "inicio.jsonl"), "a", encoding="utf-8") as f: f.write(json.dumps(dados, ensure_ascii=False) + "\n")
+        except OSError: pass
+    _config["inicio"] = dados
+    return dados
+
+def ultimo_inicio():
+    return _config.get("inicio")
+
+# --- ETAPAS (SPANS) ---
+class Span:
+    def __init__(self, nome, pai=None, atributos=None):
+        self.nome = nome
+        self.raiz = pai.raiz if pai else self
+        self.atributos = dict(atributos or {})
+        self.inicio = time.time()
+        self.segundos = None
+        if self.raiz is self:
+            self._lock = threading.Lock()
+            self._etapas = {} # nome -> [segundos, n, ordem]
+
+    def atributo(self, chave, valor):
+        self.atributos[chave] = valor
+
+    def _somar(self, nome, segundos, n=1):
+        raiz = self.raiz
+        with raiz._lock:
+            e = raiz._etapas.setdefault(nome, [0.0, 0, len(raiz._etapas)])
+            e[0] += segundos
+            e[1] += n
+
+    def resumo(self):
+        # Quebra por etapa do rastro inteiro (etapas concorrentes somam mais que o total)
+        raiz = self.raiz
+        with raiz._lock:
+            etapas = sorted(raiz._etapas.items(), key=lambda kv: kv[1][2])
+        total = raiz.segundos if raiz.segundos is not None else time.time() - raiz.inicio
+        return {"raiz": raiz.nome, "inicio": raiz.inicio, "total_s": round(total, 4), "concluido": raiz.segundos is not None,
+                "atributos": raiz.atributos,
+                "etapas": [{"etapa": nome, "segundos": round(s, 4), "n": n} for nome, (s, n, _) in etapas]}
+
+_atual = contextvars.ContextVar("nemesis_span", default=None)
+_metricas = Metricas()
+_ultimos = {}
+_config = {"pasta": None, "processo": "processo", "exportado": 0.0}
+_tracer = None
+_lock_config = threading.Lock()
+
+def configurar(pasta_metricas=None, processo=None):
+    # Chamado uma vez por processo. OTLP só se OTEL_EXPORTER_OTLP_ENDPOINT estiver definido.
+    global _tracer
+    with _lock_config:
+        if pasta_metricas: _config["pasta"] = pasta_metricas
+        if processo: _config["processo"] = processo
+        if TEM_OTEL and _tracer is None:
+            provedor = TracerProvider(resource=Resource.create({"service.name": "nemesis", "nemesis.processo": _config["processo"]}))
+            if os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT"):
+                try:
+                    from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+                    provedor.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+                except Exception: pass
+            try: trace.set_tracer_provider(provedor)
+            except Exception: pass
+            _tracer = trace.get_tracer("nemesis")
+
+@contextmanager
+def etapa(nome, **atributos):
+    pai = _atual.get()
+    span = Span(nome, pai, atributos)
+    token = _atual.set(span)
+    otel = _tracer.start_as_current_span(nome, attributes={k: v for k, v in atributos.items() if isinstance(v, (str, int, float, bool))}) if _tracer else None
+    if otel: otel.__enter__()
+    t0 = time.perf_counter()
+    try:
+        yield span
+    finally:
+        span.segundos = time.perf_counter() - t0
+        if otel: otel.__exit__(None, None, None)
+        _atual.reset(token)
+        _metricas.observar(nome, span.segundos)
+        if pai is None:
+            _ultimos[nome] = span
+            _exportar_se_preciso()
+        else:
+            span._somar(nome, span.segundos)
+
+def acumular(nome, segundos, n=1):
+    # Tempo não contíguo (ex.: esperando o próximo pedaço de um gerador de OCR) sem abrir span
+    _metricas.observar(nome, segundos)
+    atual = _atual.get()
+    if atual is not None: atual._somar(nome, segundos, n)
+
+def contar(nome, n=1):
+    _metricas.contar(nome, n)
+
+def no_contexto(funcao):
+    # Para pool de threads: a etapa criada lá dentro entra no rastro de quem submeteu
+    contexto = contextvars.copy_context()
+    def executar(*args, **kwargs): return contexto.run(funcao, *args, **kwargs)
+    return executar
+
+def span_atual():
+    return _atual.get()
+
+def ultimo(nome):
+    span = _ultimos.get(nome)
+    return span.resumo() if span else None
+
+def metricas():
+    return _metricas.como_dict()
+
+# --- EXPORTAÇÃO (ARQUIVO POR PROCESSO + ENDPOINT OPCIONAL) ---
+def exportar():
+    pasta = _config["pasta"]
+    if not pasta: return None
+    os.makedirs(pasta, exist_ok=True)
+    caminho = os.path.join(pasta, f"metricas_{_config['processo']}.json")
+    dados = {"processo": _config["processo"], "pid": os.getpid(), "atualizado": time.time(), **metricas(),
+             "ultimos": {k: s.resumo() for k, s in list(_ultimos.items())}}
+    temporario = caminho + ".tmp"
+    with open(temporario, "w", encoding="utf-8") as f: json.dump(dados, f, ensure_ascii=False)
+    os.replace(temporario, caminho)
+    _config["exportado"] = time.time()
+    return caminho
+
+def _exportar_se_preciso():
+    if _config["pasta"] and time.time() - _config["exportado"] >= INTERVALO_EXPORTACAO:
+        try: exportar()
+        except OSError: pass
+
+def iniciar_endpoint(porta=PORTA_METRICAS):
+    # GET /metrics (Prometheus, soma de todos os processos) e GET /ultimos (JSON deste processo)
+    if not porta: return None
+    class Manipulador(BaseHTTPRequestHandler):
+        def log_message(self, *args): pass
+        def do_GET(self):
+            if self.path.startswith("/metrics"):
+                try: exportar()
+                except OSError: pass
+                corpo, tipo = texto_prometheus(agregar(_config["pasta"]) if _config["pasta"] else metricas()), "text/plain; version=0.0.4"
+            elif self.path.startswith("/ultimos"):
+                corpo, tipo = json.dumps({k: s.resumo() for k, s in list(_ultimos.items())}, ensure_ascii=False), "application/json"
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            dados = corpo.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", tipo)
+            self.send_header("Content-Length", str(len(dados)))
+            self.end_headers()
+            self.wfile.write(dados)
+    try:
+        servidor = ThreadingHTTPServer(("127.0.0.1", porta), Manipulador)
+    except OSError:
+        return None # Porta ocupada (outro processo já serve as métricas)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True, name="nemesis-metricas").start()
+    return servidor
@@ -0,0 +1,345 @@
+import os
+import re
+import json
+import shutil
+import sqlite3
+import argparse
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+
+from nemesis_telemetria import etapa, contar
+
+# --- CONFIGURAÇÃO ---
+BACKEND_PADRAO = os.environ.get("NEMESIS_BACKEND_VETORIAL", "chroma") # Casos novos: chroma | int8 | float16
+TIPOS = {"int8": np.int8, "float16": np.float16}
+BACKENDS = ("chroma", *TIPOS)
+PASTA_PLANO = "vetores"
+BLOCO_BUSCA = 65536 # Linhas convertidas para float32 por vez no produto escalar
+COMPACTAR_MIN = 256 # Posições mortas (removidas/substituídas) antes de reescrever o arquivo
+COMPACTAR_FRACAO = 0.5
+LOTE_SQL = 500 # Limite de parâmetros do SQLite
+_UUID = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+# --- BANCO VETORIAL PLANO (NUMPY MEMMAP + SQLITE DE METADADOS) ---
+# <caso>/vetores/vetores_<g>.bin  linhas int8/float16 normalizadas (g = geração, muda ao compactar)
+# <caso>/vetores/escalas_<g>.bin  float32 por linha (só int8)
+# <caso>/vetores/meta.sqlite      id, texto e metadados por posição + tipo/dimensão/versão
+# Busca por força bruta (produto escalar vetorizado): para casos de alguns milhares de fragmentos
+# é mais rápido que abrir um Chroma, ocupa 1/4 (int8) do disco e não deixa arquivos presos.
+# Implementa só o que o resto do código usa do Chroma/LangChain (get, upsert, delete, count,
+# similarity_search, add_documents); `_collection` aponta para o próprio banco.
+class BancoPlano:
+    def __init__(self, pasta_caso, embeddings=None, tipo=None, nome=PASTA_PLANO):
+        self.pasta = os.path.join(pasta_caso, nome)
+        self.caminho_meta = os.path.join(self.pasta, "meta.sqlite")
+        self.embeddings = embeddings
+        self._lock = threading.RLock()
+        self._vista = None # (versao, vetores, escalas, posicoes) do processo atual
+        if tipo is not None and not os.path.exists(self.caminho_meta):
+            if tipo not in TIPOS: raise ValueError(f"Tipo de banco desconhecido: {tipo}")
+            con = self._conectar()
+            try:
+                with con: con.executemany("INSERT OR IGNORE INTO meta (chave, valor) VALUES (?, ?)",
+                                          [("tipo", tipo), ("dimensao", "0"), ("geracao", "0"), ("proxima", "0"), ("versao", "0")])
+            finally: con.close()
+        self.tipo = self._meta().get("tipo")
+
+    @property
+    def _collection(self):
+        return self
+
+    def _conectar(self):
+        os.makedirs(self.pasta, exist_ok=True)
+        con = sqlite3.connect(self.caminho_meta, timeout=30)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("CREATE TABLE IF NOT EXISTS itens (pos INTEGER PRIMARY KEY, id TEXT UNIQUE, documento TEXT, metadados TEXT)")
+        con.execute("CREATE TABLE IF NOT EXISTS meta (chave TEXT PRIMARY KEY, valor TEXT)")
+        return con
+
+    def _meta(self, con=None):
+        if con is not None: return dict(con.execute("SELECT chave, valor FROM meta"))
+        con = self._conectar()
+        try: return dict(con.execute("SELECT chave, valor FROM meta"))
+        finally: con.close()
+
+    def _arquivos(self, geracao):
+        return (os.path.join(self.pasta, f"vetores_{geracao}.bin"), os.path.join(self.pasta, f"escalas_{geracao}.bin"))
+
+    # --- QUANTIZAÇÃO ---
+    def _quantizar(self, vetores):
+        v = np.asarray(vetores, dtype=np.float32)
+        v = v / (np.linalg.norm(v, axis=1, keepdims=True) + 1e-12) # Cosseno vira produto escalar
+        if self.tipo == "float16": return v.astype(np.float16), None
+        escalas = np.abs(v).max(axis=1) / 127.0 + 1e-12
+        return np.round(v / escalas[:, None]).astype(np.int8), escalas.astype(np.float32)
+
+    def _dequantizar(self, linhas, escalas):
+        v = linhas.astype(np.float32)
+        return v * escalas[:, None] if escalas is not None else v
+
+    # --- LEITURA (MEMMAP RENOVADO QUANDO A VERSÃO MUDA) ---
+    def _abrir_vista(self):
+        with self._lock:
+            con = self._conectar()
+            try:
+                meta = self._meta(con)
+                if self._vista is not None and self._vista[0] == meta["versao"]: return self._vista
+                posicoes = np.fromiter((p for (p,) in con.execute("SELECT pos FROM itens ORDER BY pos")), dtype=np.int64)
+            finally: con.close()
+            dimensao, proxima = int(meta["dimensao"]), int(meta["proxima"])
+            vetores = escalas = None
+            if proxima and dimensao:
+                caminho_v, caminho_e = self._arquivos(meta["geracao"])
+                vetores = np.memmap(caminho_v, dtype=TIPOS[self.tipo], mode="r", shape=(proxima, dimensao))
+                if self.tipo == "int8": escalas = np.memmap(caminho_e, dtype=np.float32, mode="r", shape=(proxima,))
+            self._vista = (meta["versao"], vetores, escalas, posicoes)
+            return self._vista
+
+    def _pontuar(self, consulta):
+        _, vetores, escalas, posicoes = self._abrir_vista()
+        if vetores is None or not len(posicoes): return np.empty(0, dtype=np.float32), posicoes
+        q = np.asarray(consulta, dtype=np.float32)
+        q = q / (np.linalg.norm(q) + 1e-12)
+        pontos = np.empty(len(vetores), dtype=np.float32)
+        for i in range(0, len(vetores), BLOCO_BUSCA):
+            pontos[i:i + BLOCO_BUSCA] = vetores[i:i + BLOCO_BUSCA].astype(np.float32) @ q
+        if escalas is not None: pontos *= escalas
+        return pontos[posicoes], posicoes
+
+    def _linhas(self, sql, args=()):
+        con = self._conectar()
+        try: return con.execute(sql, args).fetchall()
+        finally: con.close()
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4):
+        pontos, posicoes = self._pontuar(embedding)
+        if not len(pontos): return []
+        k = min(k, len(pontos))
+        melhores = np.argpartition(-pontos, k - 1)[:k]
+        melhores = melhores[np.argsort(-pontos[melhores])]
+        escolhidas = [int(posicoes[i]) for i in melhores]
+        marcas = ",".join("?" * len(escolhidas))
+        por_pos = {p: (i, t, m) for p, i, t, m in self._linhas(
+            f"SELECT pos, id, documento, metadados FROM itens WHERE pos IN ({marcas})", escolhidas)}
+        saida = []
+        for pos, ponto in zip(escolhidas, pontos[melhores]):
+            if pos not in por_pos: continue # Removido entre a pontuação e a leitura
+            i, t, m = por_pos[pos]
+            saida.append((Document(id=i, page_content=t or "", metadata=json.loads(m) if m else {}), float(ponto)))
+        return saida
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [d for d, _ in self.similarity_search_by_vector_with_score(embedding, k=k)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector_with_score(self.embeddings.embed_query(query), k=k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [d for d, _ in self.similarity_search_with_score(query, k=k)]
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("documents", "metadatas")):
+        # Mesmo formato do Chroma: {"ids", "documents", "metadatas"[, "embeddings"]}
+        filtros, args = [], []
+        for chave, valor in (where or {}).items():
+            filtros.append(f"json_extract(metadados, '$.{chave}') = ?")
+            args.append(valor)
+        grupos = [list(ids[i:i + LOTE_SQL]) for i in range(0, len(ids), LOTE_SQL)] if ids is not None else [None]
+        linhas = []
+        for grupo in grupos:
+            condicoes, valores = list(filtros), list(args)
+            if grupo is not None:
+                if not grupo: continue
+                condicoes.append(f"id IN ({','.join('?' * len(grupo))})")
+                valores += grupo
+            sql = "SELECT pos, id, documento, metadados FROM itens"
+            if condicoes: sql += " WHERE " + " AND ".join(condicoes)
+            sql += " ORDER BY pos"
+            if limit is not None: sql += f" LIMIT {int(limit)} OFFSET {int(offset or 0)}"
+            linhas += self._linhas(sql, valores)
+        dados = {"ids": [l[1] for l in linhas],
+                 "documents": [l[2] for l in linhas] if "documents" in include else None,
+                 "metadatas": [json.loads(l[3]) if l[3] else {} for l in linhas] if "metadatas" in include else None}
+        if "embeddings" in include:
+            _, vetores, escalas, _ = self._abrir_vista()
+            pos = np.array([l[0] for l in linhas], dtype=np.int64)
+            dados["embeddings"] = self._dequantizar(vetores[pos], escalas[pos] if escalas is not None else None) if len(pos) else []
+        return dados
+
+    def count(self):
+        return self._linhas("SELECT COUNT(*) FROM itens")[0][0]
+
+    # --- ESCRITA (UM ÚNICO ESCRITOR POR CASO: O WORKER DA FILA) ---
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        if not ids: return
+        linhas, escalas = self._quantizar(embeddings)
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+        with self._lock:
+            con = self._conectar()
+            try:
+                with con:
+                    con.execute("BEGIN IMMEDIATE")
+                    meta = self._meta(con)
+                    dimensao, inicio = int(meta["dimensao"]), int(meta["proxima"])
+                    if dimensao and dimensao != linhas.shape[1]:
+                        raise ValueError(f"Dimensão {linhas.shape[1]} diferente do banco ({dimensao}).")
+                    # Vetores antes das linhas do SQLite: posição registrada sempre tem vetor gravado
+                    caminho_v, caminho_e = self._arquivos(meta["geracao"])
+                    self._anexar(caminho_v, inicio * linhas.shape[1] * linhas.itemsize, linhas)
+                    if escalas is not None: self._anexar(caminho_e, inicio * 4, escalas)
+                    grupos = [ids[i:i + LOTE_SQL] for i in range(0, len(ids), LOTE_SQL)]
+                    substituidos = sum(con.execute(f"DELETE FROM itens WHERE id IN ({','.join('?' * len(g))})", g).rowcount for g in grupos)
+                    con.executemany("INSERT INTO itens (pos, id, documento, metadados) VALUES (?, ?, ?, ?)",
+                                    [(inicio + n, i, d, json.dumps(m, ensure_ascii=False) if m else None)
+                                     for n, (i, d, m) in enumerate(zip(ids, documents, metadatas))])
+                    self._gravar_meta(con, dimensao=linhas.shape[1], proxima=inicio + len(ids), versao=int(meta["versao"]) + 1)
+            finally: con.close()
+        if substituidos: self._talvez_compactar()
+
+    def update(self, ids, metadatas=None, **kwargs):
+        # Como o update do Chroma, mas só metadados (vetor e texto mudam via upsert)
+        if not ids or metadatas is None: return
+        with self._lock:
+            con = self._conectar()
+            try:
+                with con: con.executemany("UPDATE itens SET metadados = ? WHERE id = ?",
+                                          [(json.dumps(m, ensure_ascii=False) if m else None, i) for i, m in zip(ids, metadatas)])
+            finally: con.close()
+
+    def _anexar(self, caminho, deslocamento, matriz):
+        # Sobrescreve a partir do fim lógico: sobra de uma gravação interrompida é descartada
+        with open(caminho, "r+b" if os.path.exists(caminho) else "wb") as f:
+            f.seek(deslocamento)
+            f.write(np.ascontiguousarray(matriz).tobytes())
+
+    def _gravar_meta(self, con, **valores):
+        con.executemany("INSERT OR REPLACE INTO meta (chave, valor) VALUES (?, ?)", [(c, str(v)) for c, v in valores.items()])
+
+    def add_documents(self, documents, ids=None, **kwargs):
+        ids = ids or [d.id for d in documents]
+        self.upsert(ids, self.embeddings.embed_documents([d.page_content for d in documents]),
+                    [d.page_content for d in documents], [d.metadata for d in documents])
+        return ids
+
+    def delete(self, ids=None, where=None):
+        if ids is None: ids = self.get(where=where, include=[])["ids"]
+        if not ids: return
+        with self._lock:
+            con = self._conectar()
+            try:
+                with con:
+                    for i in range(0, len(ids), LOTE_SQL):
+                        grupo = list(ids[i:i + LOTE_SQL])
+                        con.execute(f"DELETE FROM itens WHERE id IN ({','.join('?' * len(grupo))})", grupo)
+                    self._gravar_meta(con, versao=int(self._meta(con)["versao"]) + 1)
+            finally: con.close()
+        self._talvez_compactar()
+
+    # --- COMPACTAÇÃO (NOVA GERAÇÃO DE ARQUIVOS, SÓ COM AS POSIÇÕES VIVAS) ---
+    def _talvez_compactar(self):
+        meta = self._meta()
+        mortos = int(meta["proxima"]) - self.count()
+        if mortos >= COMPACTAR_MIN and mortos >= COMPACTAR_FRACAO * int(meta["proxima"]): self.compactar()
+
+    def compactar(self):
+        with self._lock, etapa("vetores.compactar"):
+            con = self._conectar()
+            try:
+                with con:
+                    con.execute("BEGIN IMMEDIATE")
+                    meta = self._meta(con)
+                    dimensao, proxima, geracao = int(meta["dimensao"]), int(meta["proxima"]), int(meta["geracao"])
+                    posicoes = [p for (p,) in con.execute("SELECT pos FROM itens ORDER BY pos")]
+                    nova = geracao + 1
+                    antigos, novos = self._arquivos(geracao), self._arquivos(nova)
+                    if proxima and dimensao:
+                        vetores = np.fromfile(antigos[0], dtype=TIPOS[self.tipo], count=proxima * dimensao).reshape(proxima, dimensao)
+                        vetores[posicoes].tofile(novos[0])
+                        if self.tipo == "int8": np.fromfile(antigos[1], dtype=np.float32, count=proxima)[posicoes].tofile(novos[1])
+                    # Posições crescentes: a nova (n) nunca colide com uma antiga ainda não movida
+                    con.executemany("UPDATE itens SET pos = ? WHERE pos = ?", [(n, p) for n, p in enumerate(posicoes) if n != p])
+                    self._gravar_meta(con, geracao=nova, proxima=len(posicoes), versao=int(meta["versao"]) + 1)
+            finally: con.close()
+            self._vista = None
+            self._limpar_geracoes(nova)
+            contar("vetores_compactacoes")
+
+    def _limpar_geracoes(self, atual):
+        # Arquivos de gerações antigas ainda mapeados por outro processo (Windows) ficam para a próxima
+        for nome in os.listdir(self.pasta):
+            m = re.match(r"^(vetores|escalas)_(\d+)\.bin$", nome)
+            if m and int(m.group(2)) != atual:
+                try: os.remove(os.path.join(self.pasta, nome))
+                except OSError: pass
+
+    def fechar(self):
+        # Solta os memmaps (pasta do caso pode ser apagada/renomeada em seguida)
+        with self._lock: self._vista = None
+
+    def estatisticas(self):
+        meta = self._meta()
+        ocupado = sum(os.path.getsize(os.path.join(self.pasta, n)) for n in os.listdir(self.pasta))
+        return {"tipo": self.tipo, "fragmentos": self.count(), "dimensao": int(meta["dimensao"]),
+                "posicoes": int(meta["proxima"]), "mb": round(ocupado / 1024 / 1024, 2)}
+
+# --- ESCOLHA DO BACKEND POR CASO ---
+def backend_do_caso(pasta_caso):
+    # Decidido pelo que existe no disco: o worker de ingestão abre o mesmo tipo que o app/CLI escolheu
+    if os.path.exists(os.path.join(pasta_caso, PASTA_PLANO, "meta.sqlite")): return BancoPlano(pasta_caso).tipo
+    if os.path.exists(os.path.join(pasta_caso, "chroma.sqlite3")): return "chroma"
+    return None
+
+def garantir_backend(pasta_caso, tipo=None):
+    # Caso sem banco ainda: grava a escolha (o banco plano já nasce vazio na pasta)
+    atual = backend_do_caso(pasta_caso)
+    if atual is not None: return atual
+    tipo = tipo or BACKEND_PADRAO
+    if tipo in TIPOS: BancoPlano(pasta_caso, tipo=tipo)
+    return tipo
+
+# --- MIGRAÇÃO CHROMA -> PLANO ---
+def migrar_de_chroma(pasta_caso, colecao, tipo="int8", lote=1000, ao_progresso=None):
+    # O handle do caso precisa estar fechado (GerenciadorCasos.fechar) e sem job de ingestão rodando.
+    from langchain_chroma import Chroma
+    from nemesis_store import fechar_chroma
+    if tipo not in TIPOS: raise ValueError(f"Tipo de banco desconhecido: {tipo}")
+    if backend_do_caso(pasta_caso) != "chroma": raise ValueError("O caso não tem banco Chroma para migrar.")
+    temporaria = os.path.join(pasta_caso, PASTA_PLANO + ".migrando")
+    shutil.rmtree(temporaria, ignore_errors=True) # Migração interrompida antes
+    origem = Chroma(collection_name=colecao, persist_directory=pasta_caso)
+    try:
+        colecao_chroma = origem._collection
+        total = colecao_chroma.count()
+        destino = BancoPlano(pasta_caso, tipo=tipo, nome=PASTA_PLANO + ".migrando")
+        with etapa("vetores.migrar", fragmentos=total):
+            for inicio in range(0, total, lote):
+                dados = colecao_chroma.get(limit=lote, offset=inicio, include=["embeddings", "documents", "metadatas"])
+                destino.upsert(dados["ids"], dados["embeddings"], dados["documents"], dados["metadatas"])
+                if ao_progresso: ao_progresso(min(inicio + lote, total), total)
+        if destino.count() != total: raise RuntimeError(f"Migração incompleta: {destino.count()} de {total} fragmentos.")
+        destino.fechar()
+    finally:
+        fechar_chroma(origem)
+    os.replace(temporaria, os.path.join(pasta_caso, PASTA_PLANO))
+    # A partir daqui o caso já abre como plano; sobra do Chroma presa (Windows) não atrapalha
+    sobras = []
+    for nome in os.listdir(pasta_caso):
+        caminho = os.path.join(pasta_caso, nome)
+        if nome.startswith("chroma.sqlite3") or (os.path.isdir(caminho) and _UUID.match(nome)):
+            try: shutil.rmtree(caminho) if os.path.isdir(caminho) else os.remove(caminho)
+            except OSError: sobras.append(nome)
+    return {"fragmentos": total, "tipo": tipo, "sobras": sobras}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converte o banco Chroma de um caso para o banco vetorial plano")
+    parser.add_argument("pasta_caso", help="Pasta do caso (ex.: ./banco_de_dados_nemesis/Silva)")
+    parser.add_argument("--colecao", default=None, help="Coleção do Chroma (padrão: nome da pasta)")
+    parser.add_argument("--tipo", default="int8", choices=list(TIPOS), help="Quantização dos vetores")
+    args = parser.parse_args()
+    pasta = os.path.abspath(args.pasta_caso)
+    resultado = migrar_de_chroma(pasta, args.colecao or os.path.basename(pasta), args.tipo,
+                                 ao_progresso=lambda feitos, total: print(f"\r{feitos}/{total} fragmentos", end="", flush=True))
+    print(f"\n{resultado['fragmentos']} fragmentos migrados ({resultado['tipo']}).")
+    if resultado["sobras"]: print(f"Não foi possível apagar agora: {', '.join(resultado['sobras'])}")